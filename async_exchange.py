@@ -0,0 +1,171 @@
+"""AsyncExchangeFacade: ティック開始時に市場データを並行取得する取引所ファサード
+
+`run_bot` は fetch_order_book → fetch_ticker（2回）と、残高・未約定注文を順番に
+ブロッキング取得しています。このファサードは asyncio で各リクエストを同時に発行し、
+1ティック分の一貫したスナップショットを作ります。`run_bot_di(exchange_override=...)`
+に渡せば、ティック中の fetch_* はスナップショットから返されます。
+提供するメソッド:
+  - begin_tick(pair) -> dict       # ticker / order_book（include_private なら balance / open_orders も）を並行取得
+  - snapshot(pair) -> dict         # begin_tick と同じ（名前付きの別名）
+  - fetch_ticker / fetch_order_book / fetch_balance / fetch_open_orders  # スナップショット優先
+  - 上記以外の属性は元の取引所オブジェクトへ委譲
+
+ccxt.async_support のようにコルーチンを返す取引所はそのまま await し、
+同期版 ccxt はスレッドプール上で実行します。
+run_bot は残高・未約定注文を使わないので、それらの取得（レート制限のかかる private API）は
+include_private=True（ASYNC_EXCHANGE_PRIVATE=1）のときだけ行います。
+"""
+
+from typing import Any, Dict, Optional
+import asyncio
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncExchangeFacade:
+    """同期 API の取引所オブジェクトとして振る舞いながら、内部で並行取得するファサード。"""
+
+    SNAPSHOT_ENDPOINTS = ('ticker', 'order_book', 'balance', 'open_orders')
+
+    def __init__(self, exchange, max_workers: int = 8, include_private: bool = False):
+        self._exchange = exchange
+        self._include_private = bool(include_private)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='exchange')
+        self._loop = asyncio.new_event_loop()
+        self._loop_lock = threading.Lock()
+        # pair -> snapshot dict
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        self.last_tick_sec: Optional[float] = None
+
+    # --- 非同期呼び出し ---
+    async def _call(self, name: str, *args, **kwargs):
+        fn = getattr(self._exchange, name)
+        if inspect.iscoroutinefunction(fn):
+            return await fn(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    async def _gather_snapshot(self, pair: str) -> Dict[str, Any]:
+        calls = {
+            'ticker': self._call('fetch_ticker', pair),
+            'order_book': self._call('fetch_order_book', pair),
+        }
+        if self._include_private:
+            if hasattr(self._exchange, 'fetch_balance'):
+                calls['balance'] = self._call('fetch_balance')
+            if hasattr(self._exchange, 'fetch_open_orders'):
+                calls['open_orders'] = self._call('fetch_open_orders', pair)
+        names = list(calls)
+        results = await asyncio.gather(*calls.values(), return_exceptions=True)
+        snap: Dict[str, Any] = {'pair': pair, 'timestamp': time.time()}
+        for name, res in zip(names, results):
+            # 失敗したエンドポイントはスナップショットに入れず、後で直接取得させる
+            if not isinstance(res, Exception):
+                snap[name] = res
+            else:
+                snap.setdefault('errors', {})[name] = str(res)
+        return snap
+
+    def run(self, coro):
+        """ファサード専用のイベントループでコルーチンを実行する（同期コードから呼べる）。"""
+        with self._loop_lock:
+            return self._loop.run_until_complete(coro)
+
+    # --- ティック管理 ---
+    def begin_tick(self, pair: str = 'BTC/JPY') -> Dict[str, Any]:
+        started = time.perf_counter()
+        snap = self.run(self._gather_snapshot(pair))
+        self.last_tick_sec = time.perf_counter() - started
+        self._snapshots[pair] = snap
+        return snap
+
+    def snapshot(self, pair: str = 'BTC/JPY') -> Dict[str, Any]:
+        return self.begin_tick(pair)
+
+    def end_tick(self) -> None:
+        self._snapshots.clear()
+
+    def _from_snapshot(self, pair: Optional[str], endpoint: str):
+        if pair is None:
+            # 残高はペアに依存しないので最新のスナップショットから返す
+            for snap in reversed(list(self._snapshots.values())):
+                if endpoint in snap:
+                    return snap[endpoint]
+            return None
+        snap = self._snapshots.get(pair)
+        if snap is not None:
+            return snap.get(endpoint)
+        return None
+
+    # --- 同期 API（ccxt 互換） ---
+    def _sync_call(self, name: str, *args, **kwargs):
+        fn = getattr(self._exchange, name)
+        if inspect.iscoroutinefunction(fn):
+            return self.run(fn(*args, **kwargs))
+        return fn(*args, **kwargs)
+
+    def fetch_ticker(self, pair, *args, **kwargs):
+        if not args and not kwargs:
+            cached = self._from_snapshot(pair, 'ticker')
+            if cached is not None:
+                return cached
+        return self._sync_call('fetch_ticker', pair, *args, **kwargs)
+
+    def fetch_order_book(self, pair, *args, **kwargs):
+        if not args and not kwargs:
+            cached = self._from_snapshot(pair, 'order_book')
+            if cached is not None:
+                return cached
+        return self._sync_call('fetch_order_book', pair, *args, **kwargs)
+
+    def fetch_balance(self, *args, **kwargs):
+        if not args and not kwargs:
+            cached = self._from_snapshot(None, 'balance')
+            if cached is not None:
+                return cached
+        return self._sync_call('fetch_balance', *args, **kwargs)
+
+    def fetch_open_orders(self, pair=None, *args, **kwargs):
+        if pair is not None and not args and not kwargs:
+            cached = self._from_snapshot(pair, 'open_orders')
+            if cached is not None:
+                return cached
+        return self._sync_call('fetch_open_orders', pair, *args, **kwargs)
+
+    def create_order(self, *args, **kwargs):
+        # 注文後は残高・未約定注文が変わるので、そのティックのスナップショットは使わない
+        result = self._sync_call('create_order', *args, **kwargs)
+        for snap in self._snapshots.values():
+            snap.pop('balance', None)
+            snap.pop('open_orders', None)
+        return result
+
+    def cancel_order(self, *args, **kwargs):
+        result = self._sync_call('cancel_order', *args, **kwargs)
+        for snap in self._snapshots.values():
+            snap.pop('open_orders', None)
+        return result
+
+    def __getattr__(self, name):
+        attr = getattr(self._exchange, name)
+        if inspect.iscoroutinefunction(attr):
+            return lambda *args, **kwargs: self.run(attr(*args, **kwargs))
+        return attr
+
+    def close(self) -> None:
+        try:
+            closer = getattr(self._exchange, 'close', None)
+            if closer is not None and inspect.iscoroutinefunction(closer):
+                self.run(closer())
+        except Exception:
+            pass
+        self._executor.shutdown(wait=False)
+        try:
+            self._loop.close()
+        except Exception:
+            pass
+
+    def __repr__(self) -> str:
+        return f"<AsyncExchangeFacade exchange={type(self._exchange).__name__} last_tick={self.last_tick_sec}>"
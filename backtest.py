@@ -0,0 +1,308 @@
+"""バックテスト: 保存済みのローソク足・板スナップショットを run_bot に流し込む
+
+`run_bot` の利確/ナンピン判定を、本番と同じコードのまま模擬時計で高速に再生します。
+時刻 t のティックから見えるのは t までに確定した足（開始時刻 + 足の長さ <= t）だけで、
+価格はその最新足の終値です（まだ確定していない足の終値を先読みしない）。
+  - BacktestExchange   # fetch_ticker / fetch_order_book / fetch_ohlcv / create_order を再生データで応答
+  - Backtester         # ティックを進め、約定・手数料・FundManager の資金を反映して PnL を集計
+  - load_ohlcv(path)   # candle_store の JSON / JSON 配列 / CSV を読み込む
+  - load_orderbooks(path)  # {"timestamp", "bids", "asks"} の JSONL を読み込む
+
+手数料は `compute_fee_jpy`（`compute_qty_for_budget_with_fee` と同じモデル）で計算し、
+約定ごとに FundManager.pay_fee で差し引きます。通知メールは送りません。
+
+使い方:
+  python backtest.py candles.csv [--orderbooks books.jsonl] [--positions positions_state.json]
+                     [--fund 20000] [--tick-sec 300] [--timeframe 1h]
+"""
+
+from typing import Callable, Dict, List, Optional
+import bisect
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def load_ohlcv(path: str) -> List[list]:
+    """OHLCV を [[ts_ms, o, h, l, c, v], ...]（昇順）で返す。"""
+    p = Path(path)
+    text = p.read_text(encoding='utf-8')
+    rows: List[list] = []
+    if p.suffix.lower() == '.json':
+        raw = json.loads(text)
+        if isinstance(raw, dict):
+            raw = raw.get('rows', [])
+        rows = [[int(r[0])] + [float(v) for v in r[1:6]] for r in raw if r and len(r) >= 6]
+    else:
+        for rec in csv.reader(text.splitlines()):
+            if len(rec) < 6:
+                continue
+            try:
+                rows.append([int(float(rec[0]))] + [float(v) for v in rec[1:6]])
+            except ValueError:
+                # ヘッダ行
+                continue
+    rows.sort(key=lambda r: r[0])
+    return rows
+
+
+def infer_timeframe_ms(candles: List[list]) -> int:
+    """隣り合う足の開始時刻の差の最小値を足の長さとみなす（1 本しかなければ 1 時間）。"""
+    diffs = [int(b[0]) - int(a[0]) for a, b in zip(candles, candles[1:]) if int(b[0]) > int(a[0])]
+    return min(diffs) if diffs else 60 * 60 * 1000
+
+
+def load_orderbooks(path: str) -> List[dict]:
+    books = []
+    with open(path, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                books.append(json.loads(line))
+            except Exception:
+                continue
+    books.sort(key=lambda b: int(b.get('timestamp', 0)))
+    return books
+
+
+class BacktestExchange:
+    """再生データで ccxt 互換の応答を返す模擬取引所。時刻は Backtester が進める。"""
+
+    def __init__(self, candles: List[list], orderbooks: Optional[List[dict]] = None,
+                 on_fill: Optional[Callable[[dict], None]] = None, timeframe_ms: Optional[int] = None):
+        self._candles = candles
+        self._candle_ts = [int(r[0]) for r in candles]
+        self.timeframe_ms = int(timeframe_ms or infer_timeframe_ms(candles))
+        self._books = orderbooks or []
+        self._book_ts = [int(b.get('timestamp', 0)) for b in self._books]
+        self._on_fill = on_fill
+        # index は now_ms の時点で確定している最新の足
+        self.now_ms = self._candle_ts[0] + self.timeframe_ms if candles else 0
+        self.index = 0
+        self.fills: List[dict] = []
+        self._order_seq = 0
+
+    # --- 時刻 ---
+    def set_time(self, now_ms: int, index: int) -> None:
+        self.now_ms = int(now_ms)
+        self.index = int(index)
+
+    @property
+    def price(self) -> float:
+        return float(self._candles[self.index][4])
+
+    # --- 公開 API（ccxt 互換） ---
+    def fetch_ticker(self, pair):
+        return {'symbol': pair, 'last': self.price, 'timestamp': self.now_ms}
+
+    def fetch_order_book(self, pair, limit=None):
+        i = bisect.bisect_right(self._book_ts, self.now_ms) - 1
+        if i >= 0:
+            book = self._books[i]
+            return {'bids': book.get('bids', []), 'asks': book.get('asks', []), 'timestamp': self._book_ts[i]}
+        # スナップショットが無い区間は均一な板を合成（厚い板・薄い板とも判定されない）
+        p = self.price
+        step = p * 0.001
+        return {
+            'bids': [[p - step * (i + 1), 0.1] for i in range(20)],
+            'asks': [[p + step * (i + 1), 0.1] for i in range(20)],
+            'timestamp': self.now_ms,
+        }
+
+    def fetch_ohlcv(self, pair, timeframe='1h', since=None, limit=100):
+        # 先読みしないよう確定済みの足だけを返す
+        end = self.index + 1
+        rows = self._candles[max(0, end - limit):end]
+        if since is not None:
+            rows = [r for r in rows if r[0] >= since]
+        return [list(r) for r in rows]
+
+    def fetch_balance(self):
+        return {'total': {}, 'free': {}, 'used': {}}
+
+    def create_order(self, pair, type, side, amount, price=None):
+        from ninibo1127 import compute_fee_jpy
+        fill_price = float(price) if (type == 'limit' and price) else self.price
+        cost = float(amount) * fill_price
+        self._order_seq += 1
+        fill = {
+            'id': f"bt-{self._order_seq}",
+            'symbol': pair,
+            'type': type,
+            'side': side,
+            'amount': float(amount),
+            'price': fill_price,
+            'cost': cost,
+            'fee': compute_fee_jpy(cost),
+            'timestamp': self.now_ms,
+            'status': 'closed',
+        }
+        self.fills.append(fill)
+        if self._on_fill is not None:
+            self._on_fill(fill)
+        return fill
+
+
+class Backtester:
+    """run_bot を模擬時計で繰り返し呼び出し、PnL を集計する。"""
+
+    def __init__(self, candles: List[list], orderbooks: Optional[List[dict]] = None,
+                 initial_fund: float = 20000.0, tick_sec: int = 300, work_dir: Optional[str] = None,
+                 initial_positions: Optional[List[dict]] = None, params: Optional[Dict[str, float]] = None,
+                 timeframe_ms: Optional[int] = None):
+        if not candles:
+            raise ValueError("candles are empty")
+        self.candles = candles
+        self.initial_fund = float(initial_fund)
+        self.tick_ms = int(tick_sec) * 1000
+        self._work_dir = work_dir
+        # run_bot は保有ポジションが無いと「前回高値の10%下」が現在値基準になり新規買いしないため、
+        # 既存ポジション（positions_state.json と同じ形式）から開始できるようにする
+        self.initial_positions = list(initial_positions or [])
+        # ninibo1127 のモジュール定数（PROFIT_TAKE_PCT など）を再生中だけ上書きする
+        self.params = dict(params or {})
+        self.exchange = BacktestExchange(candles, orderbooks, on_fill=self._on_fill, timeframe_ms=timeframe_ms)
+        self.fund_manager = None
+        self.base_held = sum(float(pos.get('amount', 0.0)) for pos in self.initial_positions)
+        self.fees_jpy = 0.0
+
+    def _on_fill(self, fill: dict) -> None:
+        if fill['side'] == 'buy':
+            self.base_held += fill['amount']
+        else:
+            self.base_held -= fill['amount']
+        self.fees_jpy += fill['fee']
+        # run_bot は約定代金だけを FundManager に反映するので、手数料はここで差し引く
+        if fill['fee'] > 0 and self.fund_manager is not None:
+            self.fund_manager.pay_fee(fill['fee'], order_id=fill['id'])
+
+    def _ticks(self):
+        """(tick_time_ms, candle_index) を順に返す。各ティックの価格は確定済みの最新足の終値。
+
+        足 i が確定するのは ts[i] + 足の長さ の時刻なので、最初のティックは最初の足が確定した時点、
+        最後のティックは最後の足が確定した時点になる。
+        """
+        ts = self.exchange._candle_ts
+        tf = self.exchange.timeframe_ms
+        t = ts[0] + tf
+        end = ts[-1] + tf
+        i = 0
+        while t <= end:
+            while i + 1 < len(ts) and ts[i + 1] + tf <= t:
+                i += 1
+            yield t, i
+            t += self.tick_ms
+
+    def run(self) -> Dict[str, float]:
+        import ninibo1127 as bot
+        from funds import FundManager
+
+        work_dir = self._work_dir or tempfile.mkdtemp(prefix='ninibo_bt_')
+        os.makedirs(work_dir, exist_ok=True)
+        positions_file = os.path.join(work_dir, 'positions_state.json')
+        with open(positions_file, 'w', encoding='utf-8') as fh:
+            json.dump(self.initial_positions, fh)
+        from position_journal import journal_paths
+        for path in journal_paths(positions_file):
+            if path.exists():
+                path.unlink()
+        fund_file = os.path.join(work_dir, 'funds_state.json')
+        if os.path.exists(fund_file):
+            os.remove(fund_file)
+        self.fund_manager = FundManager(initial_fund=self.initial_fund, state_file=fund_file)
+
+        # DRY_RUN だと execute_order が模擬取引所を呼ばないので、再生中だけ無効化する
+        saved_dry_run = os.environ.pop('DRY_RUN', None)
+        saved_params = {}
+        for name, value in self.params.items():
+            if not hasattr(bot, name):
+                raise ValueError(f"unknown strategy parameter: {name}")
+            saved_params[name] = getattr(bot, name)
+            setattr(bot, name, value)
+        clock = lambda: self.exchange.now_ms / 1000.0
+        ticks = 0
+        peak = self.initial_fund + self.base_held * self.exchange.price
+        max_drawdown = 0.0
+        started = time.perf_counter()
+        try:
+            for now_ms, index in self._ticks():
+                self.exchange.set_time(now_ms, index)
+                bot.run_bot(self.exchange, self.fund_manager, positions_file=positions_file,
+                            clock=clock, notify=False)
+                ticks += 1
+                equity = self.fund_manager.available_fund() + self.base_held * self.exchange.price
+                peak = max(peak, equity)
+                if peak > 0:
+                    max_drawdown = max(max_drawdown, (peak - equity) / peak)
+        finally:
+            # 作業ディレクトリごとのジャーナルを run_bot のキャッシュに残さない（スイープのワーカーで溜まる）
+            bot.forget_position_journal(positions_file)
+            for name, value in saved_params.items():
+                setattr(bot, name, value)
+            if saved_dry_run is not None:
+                os.environ['DRY_RUN'] = saved_dry_run
+        elapsed = time.perf_counter() - started
+
+        last_price = self.exchange.price
+        available = self.fund_manager.available_fund()
+        equity = available + self.base_held * last_price
+        initial_equity = self.initial_fund + sum(
+            float(pos.get('amount', 0.0)) * self.candles[0][4] for pos in self.initial_positions)
+        fills = self.exchange.fills
+        return {
+            'ticks': ticks,
+            'start_ms': self.candles[0][0],
+            'end_ms': self.candles[-1][0],
+            'trades': len(fills),
+            'buys': sum(1 for f in fills if f['side'] == 'buy'),
+            'sells': sum(1 for f in fills if f['side'] == 'sell'),
+            'fees_jpy': self.fees_jpy,
+            'initial_fund': self.initial_fund,
+            'final_available': available,
+            'base_held': self.base_held,
+            'last_price': last_price,
+            'initial_equity': initial_equity,
+            'equity': equity,
+            'pnl': equity - initial_equity,
+            'pnl_pct': (equity - initial_equity) / initial_equity * 100.0 if initial_equity else 0.0,
+            'max_drawdown_pct': max_drawdown * 100.0,
+            'elapsed_sec': elapsed,
+            'ticks_per_sec': ticks / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+def main(argv: list) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(description='Replay stored candles through run_bot')
+    ap.add_argument('candles', help='OHLCV file (candle_store JSON, JSON array or CSV)')
+    ap.add_argument('--orderbooks', help='order book snapshots (JSONL)')
+    ap.add_argument('--fund', type=float, default=float(os.getenv('INITIAL_FUND', '20000')))
+    ap.add_argument('--tick-sec', type=int, default=300)
+    ap.add_argument('--positions', help='initial positions (positions_state.json format)')
+    ap.add_argument('--timeframe', help='candle timeframe such as 1h (default: inferred from the candles)')
+    args = ap.parse_args(argv[1:])
+
+    candles = load_ohlcv(args.candles)
+    books = load_orderbooks(args.orderbooks) if args.orderbooks else None
+    positions = None
+    if args.positions:
+        with open(args.positions, 'r', encoding='utf-8') as fh:
+            positions = json.load(fh)
+    timeframe_ms = None
+    if args.timeframe:
+        from candle_store import timeframe_to_ms
+        timeframe_ms = timeframe_to_ms(args.timeframe)
+    result = Backtester(candles, books, initial_fund=args.fund, tick_sec=args.tick_sec,
+                        initial_positions=positions, timeframe_ms=timeframe_ms).run()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv))
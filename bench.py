@@ -0,0 +1,298 @@
+"""bench: 固定の合成データで指標・シグナル・永続化・板分析・1 ティックを計測するベンチマーク
+
+`run_dry.py` や `run_import_test.py` は落ちないことしか確かめていないので、性能の退行を
+コミット間で比べられるようにします。データはすべて乱数の種を固定して生成するため、
+同じマシンなら何度実行しても同じ入力になります。
+  - indicators : compute_ema / compute_rsi / compute_atr（200 〜 100k 本）
+  - signals    : generate_signals（200 〜 100k 本の DataFrame）
+  - persistence: save_state と FundManager の reserve/release（_persist）の 1 秒あたり回数
+  - orderbook  : analyze_orderbook_pressure（深さ 50 〜 5000 の板）
+  - tick       : ExchangeStub（板・注文を足したもの）に対する run_bot 1 ティック
+
+使い方:
+  python bench.py [--quick] [--only indicators,signals] [--out bench-<commit>.json]
+                  [--compare 以前の結果.json]
+結果は JSON（meta と、各ケースの 1 回あたり秒数の最小値・中央値・回数）で書き出します。
+"""
+
+from typing import Callable, Dict, List, Optional
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# 計測中にログ・メトリクス・トレースの出力で結果が揺れないようにする（明示指定があればそちらを使う）
+os.environ.setdefault('LOG_CONSOLE', '0')
+os.environ.setdefault('LOG_FILE', 'off')
+os.environ.setdefault('DRY_RUN', '1')
+os.environ.setdefault('NOTIFY_ASYNC', '0')
+os.environ.setdefault('TRACE_SLOW_TICK_SEC', '0')
+
+SEED = 20240601
+SUITES = ('indicators', 'signals', 'persistence', 'orderbook', 'tick')
+FULL_SIZES = (200, 1000, 10000, 100000)
+QUICK_SIZES = (200, 1000, 10000)
+
+
+# --- 合成データ ---
+def synthetic_ohlcv(n: int, seed: int = SEED, start_price: float = 4000000.0) -> List[list]:
+    """1 時間足のランダムウォーク [[ts_ms, o, h, l, c, v], ...]。"""
+    rng = random.Random(seed + n)
+    rows = []
+    price = start_price
+    ts = 1700000000000
+    for _ in range(n):
+        open_ = price
+        price = max(1000.0, price * (1.0 + rng.gauss(0.0, 0.004)))
+        high = max(open_, price) * (1.0 + abs(rng.gauss(0.0, 0.001)))
+        low = min(open_, price) * (1.0 - abs(rng.gauss(0.0, 0.001)))
+        rows.append([ts, open_, high, low, price, rng.uniform(0.01, 5.0)])
+        ts += 3600 * 1000
+    return rows
+
+
+def synthetic_book(depth: int, mid: float = 4000000.0, seed: int = SEED) -> dict:
+    """ccxt 形式の板（bids は降順、asks は昇順）。"""
+    rng = random.Random(seed + depth)
+    tick = 1.0
+    bids = [[mid - tick * (i + 1), round(rng.expovariate(20.0), 4)] for i in range(depth)]
+    asks = [[mid + tick * (i + 1), round(rng.expovariate(20.0), 4)] for i in range(depth)]
+    return {'bids': bids, 'asks': asks, 'timestamp': 1700000000000}
+
+
+# --- 計測 ---
+def measure(fn: Callable[[], object], min_time: float = 0.2, repeat: int = 5, max_number: int = 100000) -> dict:
+    """1 回あたりの秒数を repeat 回測る（各回は合計 min_time 秒以上になるよう回数を調整）。"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= max_number:
+            break
+        number = min(max_number, max(number * 2, int(number * min_time / max(elapsed, 1e-9))))
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - started) / number)
+    return {'min_sec': min(samples), 'median_sec': statistics.median(samples), 'number': number, 'repeat': repeat}
+
+
+def _bot():
+    import ninibo1127
+    return ninibo1127
+
+
+def bench_indicators(sizes, min_time: float) -> Dict[str, dict]:
+    bot = _bot()
+    out = {}
+    for n in sizes:
+        rows = synthetic_ohlcv(n)
+        closes = [r[4] for r in rows]
+        out[f"compute_ema[n={n}]"] = measure(lambda: bot.compute_ema(closes, 26), min_time)
+        out[f"compute_rsi[n={n}]"] = measure(lambda: bot.compute_rsi(closes, 14), min_time)
+        out[f"compute_atr[n={n}]"] = measure(lambda: bot.compute_atr(rows, 14), min_time)
+    return out
+
+
+def bench_signals(sizes, min_time: float) -> Dict[str, dict]:
+    import pandas as pd
+    bot = _bot()
+    out = {}
+    for n in sizes:
+        df = pd.DataFrame(synthetic_ohlcv(n), columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        out[f"generate_signals[n={n}]"] = measure(lambda: bot.generate_signals(df), min_time)
+    return out
+
+
+def bench_persistence(min_time: float) -> Dict[str, dict]:
+    from pathlib import Path
+    from funds import FundManager
+    bot = _bot()
+    out = {}
+    tmp = tempfile.mkdtemp(prefix='bench-persist-')
+    saved_state_file = bot.STATE_FILE
+    try:
+        bot.STATE_FILE = Path(tmp) / 'bot_state.json'
+        state = {'positions': [{'side': 'buy', 'price': 4000000.0 + i, 'qty': 0.001, 'time': i} for i in range(50)],
+                 'last_buy_time': 0}
+        counter = [0]
+
+        def save():
+            # 毎回内容を変えて「変化なしなら書かない」最適化に当たらないようにする
+            counter[0] += 1
+            state['last_buy_time'] = counter[0]
+            bot.save_state(state)
+        out['save_state'] = measure(save, min_time, max_number=5000)
+        for durability in ('sync', 'group', 'async'):
+            fm = FundManager(initial_fund=1e9, state_file=os.path.join(tmp, f'funds_{durability}.json'),
+                             durability=durability, ledger_file=None)
+
+            def cycle():
+                fm.reserve(1000.0)
+                fm.release(1000.0)
+            try:
+                out[f"FundManager.reserve+release[{durability}]"] = measure(cycle, min_time, max_number=20000)
+            finally:
+                fm.close()
+    finally:
+        bot.STATE_FILE = saved_state_file
+        shutil.rmtree(tmp, ignore_errors=True)
+    return out
+
+
+def bench_orderbook(min_time: float) -> Dict[str, dict]:
+    bot = _bot()
+    out = {}
+    for depth in (50, 500, 5000):
+        # OrderBook.shared() は直前の板 dict を覚えているので、2 つを交互に渡して毎回集計させる
+        books = [synthetic_book(depth), synthetic_book(depth, seed=SEED + 1)]
+        flip = [0]
+
+        def analyze():
+            flip[0] ^= 1
+            bot.analyze_orderbook_pressure(books[flip[0]])
+        out[f"analyze_orderbook_pressure[depth={depth}]"] = measure(analyze, min_time)
+    return out
+
+
+def bench_tick(min_time: float) -> Dict[str, dict]:
+    from funds import FundManager
+    bot = _bot()
+    # 本番と同じく毎ティック新しい板を受け取る（OrderBook.shared() の使い回しに当たらない）
+    books = [synthetic_book(200), synthetic_book(200, seed=SEED + 1)]
+    rows = synthetic_ohlcv(1000)
+
+    class BenchExchange(bot.ExchangeStub):
+        flip = 0
+
+        def fetch_order_book(self, pair, limit=None):
+            self.flip ^= 1
+            return books[self.flip]
+
+        def fetch_ohlcv(self, pair, timeframe='1h', since=None, limit=250):
+            return rows[-int(limit or 250):]
+
+        def create_order(self, pair, type_, side, amount, price=None, params=None):
+            return {'id': 'bench', 'status': 'closed', 'amount': amount, 'price': price or self._price}
+
+    tmp = tempfile.mkdtemp(prefix='bench-tick-')
+    try:
+        fm = FundManager(initial_fund=1e9, state_file=os.path.join(tmp, 'funds.json'), ledger_file=None)
+        exchange = BenchExchange(price=rows[-1][4])
+        positions_file = os.path.join(tmp, 'positions.json')
+        tick = lambda: bot.run_bot(exchange, fm, dry_run=True, positions_file=positions_file, notify=False)
+        tick()
+        out = {'run_bot[no_trade]': measure(tick, min_time, max_number=2000)}
+        fm.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return out
+
+
+# --- 実行・比較 ---
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def _versions() -> Dict[str, Optional[str]]:
+    out = {}
+    for name in ('numpy', 'pandas'):
+        try:
+            out[name] = __import__(name).__version__
+        except Exception:
+            out[name] = None
+    return out
+
+
+def run(suites=SUITES, quick: bool = False) -> dict:
+    sizes = QUICK_SIZES if quick else FULL_SIZES
+    min_time = 0.05 if quick else 0.2
+    results: Dict[str, dict] = {}
+    for suite in suites:
+        started = time.perf_counter()
+        if suite == 'indicators':
+            results.update(bench_indicators(sizes, min_time))
+        elif suite == 'signals':
+            results.update(bench_signals(sizes, min_time))
+        elif suite == 'persistence':
+            results.update(bench_persistence(min_time))
+        elif suite == 'orderbook':
+            results.update(bench_orderbook(min_time))
+        elif suite == 'tick':
+            results.update(bench_tick(min_time))
+        else:
+            raise ValueError(f"unknown suite: {suite}")
+        print(f"  {suite}: {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': SEED,
+            'quick': bool(quick),
+            'suites': list(suites),
+            **_versions(),
+        },
+        'results': results,
+    }
+
+
+def compare(old: dict, new: dict, threshold: float = 0.10) -> List[str]:
+    """2 つの結果の min_sec を比べた表を返す（threshold 以上遅くなったものに印を付ける）。"""
+    lines = [f"{'case':50s} {'old':>12s} {'new':>12s} {'ratio':>7s}"]
+    old_results = old.get('results', {})
+    for name, cur in new.get('results', {}).items():
+        prev = old_results.get(name)
+        if prev is None:
+            lines.append(f"{name:50s} {'-':>12s} {cur['min_sec'] * 1e6:10.1f}us {'new':>7s}")
+            continue
+        ratio = cur['min_sec'] / prev['min_sec'] if prev['min_sec'] else float('inf')
+        mark = '  ⚠️' if ratio > 1.0 + threshold else ''
+        lines.append(f"{name:50s} {prev['min_sec'] * 1e6:10.1f}us {cur['min_sec'] * 1e6:10.1f}us {ratio:6.2f}x{mark}")
+    return lines
+
+
+def main(argv) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(prog='bench.py', description='合成データでのベンチマーク')
+    parser.add_argument('--quick', action='store_true', help='100k 本を省き、計測時間を短くする')
+    parser.add_argument('--only', help=f"カンマ区切りで実行するスイート（{','.join(SUITES)}）")
+    parser.add_argument('--out', help='結果の JSON（既定: bench-<commit>.json）')
+    parser.add_argument('--compare', help='比較する以前の結果 JSON')
+    args = parser.parse_args(argv[1:])
+    suites = [s.strip() for s in args.only.split(',') if s.strip()] if args.only else list(SUITES)
+    unknown = [s for s in suites if s not in SUITES]
+    if unknown:
+        parser.error(f"unknown suite: {', '.join(unknown)}")
+    result = run(suites, quick=args.quick)
+    out_path = args.out or f"bench-{result['meta']['commit'] or 'local'}.json"
+    with open(out_path, 'w', encoding='utf-8') as fh:
+        json.dump(result, fh, ensure_ascii=False, indent=2)
+    for name, r in result['results'].items():
+        print(f"{name:50s} {r['min_sec'] * 1e6:12.1f}us  (median {r['median_sec'] * 1e6:.1f}us, x{r['number']})")
+    print(f"結果を {out_path} に書き出しました")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as fh:
+            old = json.load(fh)
+        print('\n'.join(compare(old, result)))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv))
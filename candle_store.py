@@ -0,0 +1,188 @@
+"""CandleStore: ペア/時間足ごとのローカル OHLCV キャッシュ
+
+取引所から毎回フルウィンドウの OHLCV を取り直す代わりに、最後に保存した
+ローソク足のタイムスタンプ以降（since）だけを取得してローカルに追記します。
+提供するメソッド:
+  - get_rows(exchange, pair, timeframe, limit) -> list    # [[ts, o, h, l, c, v], ...]
+  - refresh(exchange, pair, timeframe, limit) -> int       # 差分取得して件数を返す
+  - last_timestamp(pair, timeframe) -> Optional[int]
+
+保存形式はペア/時間足ごとの小さな JSON ファイル（書き込みは tmp + os.replace）。
+同一ティック内の重複呼び出しは `min_refresh_sec` の間メモリから返すため、
+1ティックあたりの REST 呼び出しは最大 1 回の小さな差分取得になります。
+取引所が limit 本より少ない足しか返さなかった場合（上場直後のペアなど）は、それ以上古い足は
+無いものとして記録し（complete）、以降も差分取得を続けます。
+"""
+
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+# ccxt の timeframe 表記 -> ミリ秒
+TIMEFRAME_MS = {
+    '1m': 60 * 1000,
+    '5m': 5 * 60 * 1000,
+    '15m': 15 * 60 * 1000,
+    '30m': 30 * 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '4h': 4 * 60 * 60 * 1000,
+    '8h': 8 * 60 * 60 * 1000,
+    '12h': 12 * 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000,
+    '1w': 7 * 24 * 60 * 60 * 1000,
+}
+
+
+def timeframe_to_ms(timeframe: str) -> int:
+    try:
+        return TIMEFRAME_MS[timeframe]
+    except KeyError:
+        raise ValueError(f"unsupported timeframe: {timeframe}")
+
+
+class CandleStore:
+    """ペア/時間足ごとのローソク足をローカル保存し、差分だけを取得するストア。"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_rows: int = 5000,
+                 min_refresh_sec: float = 30.0):
+        self._dir = Path(cache_dir) if cache_dir else Path(os.getenv('OHLCV_CACHE_DIR', 'ohlcv_cache'))
+        self._max_rows = int(max_rows)
+        self._min_refresh_sec = float(min_refresh_sec)
+        self._lock = threading.Lock()
+        # (pair, timeframe) -> rows（タイムスタンプ昇順）
+        self._rows: Dict[Tuple[str, str], List[list]] = {}
+        # (pair, timeframe) -> 最後に取引所へ問い合わせた時刻（time.time()）
+        self._checked_at: Dict[Tuple[str, str], float] = {}
+        # 取引所にこれより古い足が無いと分かっている (pair, timeframe)
+        self._complete: Dict[Tuple[str, str], bool] = {}
+        self.fetch_count = 0
+
+    # --- ファイル入出力 ---
+    def _path(self, pair: str, timeframe: str) -> Path:
+        name = pair.replace('/', '_').replace(':', '_')
+        return self._dir / f"{name}_{timeframe}.json"
+
+    def _load(self, pair: str, timeframe: str) -> List[list]:
+        key = (pair, timeframe)
+        if key in self._rows:
+            return self._rows[key]
+        rows: List[list] = []
+        complete = False
+        path = self._path(pair, timeframe)
+        try:
+            if path.exists():
+                raw = json.loads(path.read_text(encoding='utf-8'))
+                rows = [list(r) for r in raw.get('rows', []) if r and len(r) >= 6]
+                complete = bool(raw.get('complete', False))
+        except Exception:
+            rows = []
+        self._rows[key] = rows
+        self._complete[key] = complete
+        return rows
+
+    def _save(self, pair: str, timeframe: str, rows: List[list]) -> None:
+        path = self._path(pair, timeframe)
+        try:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + '.tmp')
+            obj = {'pair': pair, 'timeframe': timeframe, 'rows': rows,
+                   'complete': self._complete.get((pair, timeframe), False)}
+            tmp_path.write_text(json.dumps(obj, separators=(',', ':')), encoding='utf-8')
+            os.replace(str(tmp_path), str(path))
+        except Exception:
+            pass
+
+    # --- 取得 ---
+    def last_timestamp(self, pair: str, timeframe: str) -> Optional[int]:
+        with self._lock:
+            rows = self._load(pair, timeframe)
+            return int(rows[-1][0]) if rows else None
+
+    def _fetch(self, exchange, pair: str, timeframe: str, since: Optional[int], limit: int) -> List[list]:
+        self.fetch_count += 1
+        try:
+            raw = exchange.fetch_ohlcv(pair, timeframe=timeframe, since=since, limit=limit)
+        except TypeError:
+            # since を受け付けないスタブ等はフルウィンドウで取得
+            raw = exchange.fetch_ohlcv(pair, timeframe=timeframe, limit=limit)
+        return [list(r) for r in (raw or []) if r and len(r) >= 6]
+
+    def refresh(self, exchange, pair: str = 'BTC/JPY', timeframe: str = '1d', limit: int = 100,
+                force: bool = False) -> int:
+        """最後のローソク足以降だけを取得してマージする。取得した件数を返す。"""
+        key = (pair, timeframe)
+        now = time.time()
+        with self._lock:
+            rows = self._load(pair, timeframe)
+            # limit 本揃っているか、取引所にそれ以上の足が無ければ保存分で足りる
+            enough = len(rows) >= limit or self._complete.get(key, False)
+            checked = self._checked_at.get(key)
+            if not force and checked is not None and now - checked < self._min_refresh_sec and enough:
+                return 0
+            tf_ms = timeframe_to_ms(timeframe)
+            since = None
+            fetch_limit = limit
+            if rows:
+                last_ts = int(rows[-1][0])
+                gap = int(now * 1000) - last_ts
+                # 保存分が古すぎる/足りない場合はフルウィンドウを取り直す
+                if gap <= tf_ms * limit and enough:
+                    # 最後の足は未確定の可能性があるので含めて取り直す
+                    since = last_ts
+                    fetch_limit = max(2, gap // tf_ms + 2)
+            new_rows = self._fetch(exchange, pair, timeframe, since, fetch_limit)
+            self._checked_at[key] = now
+            if since is None and len(new_rows) < fetch_limit:
+                # フルウィンドウを頼んで足りなければ、それより古い足は取引所に無い
+                self._complete[key] = True
+            if not new_rows:
+                return 0
+            merged = {int(r[0]): r for r in rows}
+            for r in new_rows:
+                merged[int(r[0])] = r
+            rows = [merged[ts] for ts in sorted(merged)]
+            if len(rows) > self._max_rows:
+                rows = rows[-self._max_rows:]
+            self._rows[key] = rows
+            self._save(pair, timeframe, rows)
+            return len(new_rows)
+
+    def get_rows(self, exchange, pair: str = 'BTC/JPY', timeframe: str = '1d', limit: int = 100) -> List[list]:
+        """差分更新した上で、直近 `limit` 本のローソク足を返す。"""
+        if exchange is not None:
+            try:
+                self.refresh(exchange, pair, timeframe, limit)
+            except Exception as e:
+                print(f"⚠️ OHLCV差分取得エラー: {e}")
+        with self._lock:
+            rows = self._load(pair, timeframe)
+            return [list(r) for r in rows[-limit:]]
+
+    def invalidate(self, pair: Optional[str] = None, timeframe: Optional[str] = None) -> None:
+        """次回の get_rows で必ず取引所へ問い合わせるようにする。"""
+        with self._lock:
+            for key in list(self._checked_at):
+                if (pair is None or key[0] == pair) and (timeframe is None or key[1] == timeframe):
+                    del self._checked_at[key]
+
+    def __repr__(self) -> str:
+        return f"<CandleStore dir={str(self._dir)} series={len(self._rows)} fetches={self.fetch_count}>"
+
+
+_default_store: Optional[CandleStore] = None
+
+
+def get_default_store() -> CandleStore:
+    """プロセス全体で共有するデフォルトのストアを返す。"""
+    global _default_store
+    if _default_store is None:
+        try:
+            min_refresh = float(os.getenv('OHLCV_MIN_REFRESH_SEC', '30'))
+        except Exception:
+            min_refresh = 30.0
+        _default_store = CandleStore(min_refresh_sec=min_refresh)
+    return _default_store
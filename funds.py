@@ -1,188 +1,605 @@
-"""FundManager: シンプルな資金管理クラス
-
-このモジュールは `ninibo1127.py` と互換性のある資金管理を提供します。
-提供するメソッド:
-  - available_fund() -> float
-  - place_order(cost) -> bool            # 旧 API（即時差し引き）
-  - add_funds(amount)
-  - reserve(cost) -> bool                # 予約 API
-  - confirm(cost)                        # 予約確定（消費）
-  - release(cost)                        # 予約取消（返金）
-
-内部的にはスレッドロックと簡易的な JSON 永続化を行います。
-実運用では正しい会計・監査システムを用いてください。
-"""
-
-from typing import Optional, Callable
-import threading
-import json
-from pathlib import Path
-
-
-class FundManager:
-    """資金管理クラス。state は簡易 JSON で永続化されます。"""
-
-    def __init__(self, initial_fund: float = 0.0, state_file: Optional[str] = None):
-        self._lock = threading.Lock()
-        self._state_file = Path(state_file) if state_file else Path('funds_state.json')
-        self._available = 0.0
-        self._reserved = 0.0
-        self._load_or_init(float(initial_fund or 0.0))
-
-    def _load_or_init(self, initial: float) -> None:
-        try:
-            if self._state_file.exists():
-                raw = json.loads(self._state_file.read_text(encoding='utf-8'))
-                self._available = float(raw.get('available', initial))
-                self._reserved = float(raw.get('reserved', 0.0))
-            else:
-                self._available = float(initial)
-                self._reserved = 0.0
-                self._persist()
-        except Exception:
-            # フォールバック
-            self._available = float(initial)
-            self._reserved = 0.0
-            try:
-                self._persist()
-            except Exception:
-                pass
-
-    def _persist(self) -> None:
-        try:
-            obj = {'available': float(self._available), 'reserved': float(self._reserved)}
-            self._state_file.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding='utf-8')
-        except Exception:
-            pass
-
-    # --- 基本 API ---
-    def available_fund(self) -> float:
-        with self._lock:
-            try:
-                return float(max(0.0, self._available - self._reserved))
-            except Exception:
-                return 0.0
-
-    def add_funds(self, amount: float) -> None:
-        try:
-            a = float(amount or 0.0)
-        except Exception:
-            return
-        if a <= 0:
-            return
-        with self._lock:
-            self._available = float(self._available) + a
-            self._persist()
-
-    # Legacy wrapper
-    def add_fund(self, amount: float) -> None:
-        return self.add_funds(amount)
-
-    # --- 予約 API ---
-    def reserve(self, cost: float) -> bool:
-        try:
-            c = float(cost or 0.0)
-        except Exception:
-            return False
-        if c <= 0:
-            return False
-        with self._lock:
-            unreserved = max(0.0, self._available - self._reserved)
-            if unreserved < c:
-                return False
-            self._reserved = float(self._reserved) + c
-            self._persist()
-            return True
-
-    def confirm(self, cost: float) -> None:
-        try:
-            c = float(cost or 0.0)
-        except Exception:
-            return
-        if c <= 0:
-            return
-        with self._lock:
-            consume = min(self._reserved, c)
-            self._reserved = max(0.0, self._reserved - consume)
-            # 予約分からの消費が足りない場合は available から差し引く
-            remain = max(0.0, c - consume)
-            if remain > 0:
-                self._available = max(0.0, self._available - remain)
-            self._persist()
-
-    def release(self, cost: float) -> None:
-        try:
-            c = float(cost or 0.0)
-        except Exception:
-            return
-        if c <= 0:
-            return
-        with self._lock:
-            dec = min(self._reserved, c)
-            self._reserved = max(0.0, self._reserved - dec)
-            self._persist()
-
-    # --- 互換性のための旧 API ---
-    def place_order(self, cost: float) -> bool:
-        """Legacy: attempt to deduct cost immediately from available funds.
-
-        This behaves as an immediate consumption of funds (no reservation).
-        Returns True if deduction succeeded (sufficient unreserved funds), False otherwise.
-        """
-        try:
-            c = float(cost or 0.0)
-        except Exception:
-            return False
-        if c <= 0:
-            return False
-        with self._lock:
-            unreserved = max(0.0, self._available - self._reserved)
-            if unreserved < c:
-                return False
-            # deduct immediately from available (consume funds)
-            self._available = max(0.0, float(self._available) - c)
-            # persist new state
-            self._persist()
-            return True
-
-    def __repr__(self) -> str:
-        with self._lock:
-            return f"<FundManager available={self._available:.2f} reserved={self._reserved:.2f} file={str(self._state_file)}>"
-
-
-def check_and_notify(fund: FundManager, threshold: float, notifier: Optional[Callable[[str, str], bool]] = None) -> bool:
-    """資金が閾値を下回ったら通知。
-
-    notifier(subject, body) を渡せばそれを使う。無ければ標準出力に警告を出す。
-    """
-    try:
-        available = fund.available_fund()
-    except Exception:
-        return False
-    if available < float(threshold):
-        subject = "⚠️ 資金警告"
-        body = f"資金が少なくなっています：残り {available:,.0f} 円"
-        if notifier:
-            try:
-                return bool(notifier(subject, body))
-            except Exception:
-                return False
-        else:
-            print(subject)
-            print(body)
-            return True
-    return False
-
-
-if __name__ == '__main__':
-    fm = FundManager(initial_fund=10000)
-    print('initial:', fm)
-    print('avail:', fm.available_fund())
-    ok = fm.reserve(2000)
-    print('reserve 2000 ->', ok, 'avail_after:', fm.available_fund(), fm)
-    fm.confirm(2000)
-    print('confirm 2000 ->', fm)
-    fm.add_funds(500)
-    print('add 500 ->', fm)
-    ok2 = fm.place_order(300)
+"""FundManager: シンプルな資金管理クラス
+
+このモジュールは `ninibo1127.py` と互換性のある資金管理を提供します。
+提供するメソッド:
+  - available_fund() -> float
+  - place_order(cost) -> bool            # 旧 API（即時差し引き）
+  - add_funds(amount)
+  - reserve(cost) -> bool                # 予約 API
+  - confirm(cost)                        # 予約確定（消費）
+  - release(cost)                        # 予約取消（返金）
+  - pay_fee(fee, order_id)               # 取引手数料の差し引き（残高不足でも差し引く）
+  - flush() / close()                    # write-behind モードで未書き込み分を確定
+  - record_realized_pnl(pnl, order_id)   # 確定損益を台帳に記録
+  - ledger -> Ledger                     # 複式簿記の入出金台帳（FUND_LEDGER=1 のとき）
+create_fund_manager() は FUND_BACKEND=sqlite のとき複数プロセス対応の
+`sqlite_funds.SqliteFundManager` を返します。
+
+内部的にはスレッドロックと簡易的な JSON 永続化を行います。
+永続化の方式（durability / FUND_DURABILITY 環境変数）:
+  - sync  : 変更のたびにロック内で funds_state.json を書き直す（従来どおり、既定）
+  - group : 変更は WAL（funds_state.json.wal）に積み、バックグラウンドの書き込みスレッドが
+            まとめて fsync（グループコミット）。呼び出し元は fsync 完了を待ってから戻る
+  - async : group と同じだが fsync 完了を待たない（落ちると直近 flush_interval 秒分を失う）
+write-behind モードではスナップショットに seq を持たせ、起動時に WAL の seq が
+それより新しいレコードを再生して復元します。
+実運用では正しい会計・監査システムを用いてください。
+"""
+
+from typing import Dict, List, Optional, Callable
+from array import array
+import atexit
+import bisect
+import os
+import threading
+import json
+import time
+from pathlib import Path
+
+from position_journal import read_jsonl
+
+try:
+    from metrics import timed as _timed
+except ImportError:
+    from contextlib import nullcontext as _nullcontext
+
+    def _timed(name, **labels):
+        return _nullcontext()
+
+try:
+    from tracing import traced
+except ImportError:
+    def traced(name=None):
+        return lambda fn: fn
+
+
+DURABILITY_MODES = ('sync', 'group', 'async')
+
+# 台帳の勘定科目。cash:* が FundManager の残高（free = available - reserved）に対応する
+ACCOUNT_FREE = 'cash:free'
+ACCOUNT_RESERVED = 'cash:reserved'
+ACCOUNT_DEPOSIT = 'external:deposit'
+ACCOUNT_EXCHANGE = 'external:exchange'
+ACCOUNT_OPENING = 'equity:opening'
+ACCOUNT_ADJUSTMENT = 'equity:adjustment'
+ACCOUNT_PNL = 'income:realized_pnl'
+ACCOUNT_COST_BASIS = 'equity:cost_basis'
+ACCOUNT_FEES = 'expense:fees'
+
+
+class Ledger:
+    """複式簿記の入出金台帳。
+
+    1 件の仕訳は debit 勘定を amount 増やし、credit 勘定を amount 減らすので、
+    全勘定の残高の合計は常に 0 になります（verify()）。
+    勘定ごとに (時刻, 残高) の配列を持つため balance_at(account, ts) は二分探索で O(log n)、
+    注文 id ごとの仕訳一覧は辞書の索引で引けます。仕訳は JSONL に追記して永続化します。
+    """
+
+    def __init__(self, path: Optional[str] = None, clock: Callable[[], float] = time.time):
+        self._path = Path(path) if path else None
+        self._clock = clock
+        self._entries: List[dict] = []
+        self._ts = array('d')
+        self._balances: Dict[str, float] = {}
+        # account -> (時刻の配列, 仕訳後の残高の配列)
+        self._history: Dict[str, tuple] = {}
+        self._by_order: Dict[str, List[int]] = {}
+        self._fh = None
+        if self._path is not None:
+            self._load()
+            self._fh = open(str(self._path), 'a', encoding='utf-8')
+
+    def _load(self) -> None:
+        try:
+            # 書き込み途中で落ちた最後の行は切り詰めてから追記を再開する
+            for entry in read_jsonl(self._path, repair=True):
+                self._index(entry)
+        except Exception as e:
+            print(f"⚠️ 台帳の読み込みエラー: {e}")
+
+    def _index(self, entry: dict) -> None:
+        i = len(self._entries)
+        ts = float(entry['ts'])
+        amount = float(entry['amount'])
+        self._entries.append(entry)
+        self._ts.append(ts)
+        for account, delta in ((entry['debit'], amount), (entry['credit'], -amount)):
+            balance = self._balances.get(account, 0.0) + delta
+            self._balances[account] = balance
+            hist = self._history.get(account)
+            if hist is None:
+                hist = self._history[account] = (array('d'), array('d'))
+            hist[0].append(ts)
+            hist[1].append(balance)
+        if entry.get('order_id') is not None:
+            self._by_order.setdefault(str(entry['order_id']), []).append(i)
+
+    def post(self, kind: str, debit: str, credit: str, amount: float,
+             order_id: Optional[str] = None, ts: Optional[float] = None) -> Optional[dict]:
+        """仕訳を 1 件記録する（amount が 0 以下なら何もしない）。呼び出し側でロックすること。"""
+        amount = float(amount)
+        if amount <= 0:
+            return None
+        ts = float(ts if ts is not None else self._clock())
+        if self._ts and ts < self._ts[-1]:
+            # 時刻の索引を単調に保つ（時計が戻った場合は直前の時刻に揃える）
+            ts = self._ts[-1]
+        entry = {'seq': len(self._entries) + 1, 'ts': ts, 'kind': kind, 'order_id': order_id,
+                 'debit': debit, 'credit': credit, 'amount': amount}
+        self._index(entry)
+        if self._fh is not None:
+            try:
+                self._fh.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+                self._fh.flush()
+            except Exception as e:
+                print(f"⚠️ 台帳の書き込みエラー: {e}")
+        return entry
+
+    # --- 照会 ---
+    def balance(self, account: str) -> float:
+        return self._balances.get(account, 0.0)
+
+    def balances(self) -> Dict[str, float]:
+        return dict(self._balances)
+
+    def balance_at(self, account: str, ts: float) -> float:
+        """時刻 ts 時点（ts ちょうどの仕訳を含む）の勘定残高。"""
+        hist = self._history.get(account)
+        if hist is None:
+            return 0.0
+        i = bisect.bisect_right(hist[0], float(ts))
+        return hist[1][i - 1] if i > 0 else 0.0
+
+    def entries_for_order(self, order_id) -> List[dict]:
+        return [self._entries[i] for i in self._by_order.get(str(order_id), [])]
+
+    def entries_between(self, start_ts: float, end_ts: float) -> List[dict]:
+        lo = bisect.bisect_left(self._ts, float(start_ts))
+        hi = bisect.bisect_right(self._ts, float(end_ts))
+        return self._entries[lo:hi]
+
+    def verify(self, tolerance: float = 1e-6) -> bool:
+        """全勘定の残高合計が 0（借方と貸方が一致）しているか。"""
+        return abs(sum(self._balances.values())) <= tolerance
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def sync(self) -> None:
+        if self._fh is not None:
+            try:
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+            except Exception:
+                pass
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self.sync()
+            self._fh.close()
+            self._fh = None
+
+    def __repr__(self) -> str:
+        return f"<Ledger entries={len(self._entries)} file={str(self._path) if self._path else None}>"
+
+
+class FundManager:
+    """資金管理クラス。state は簡易 JSON で永続化されます。"""
+
+    def __init__(self, initial_fund: float = 0.0, state_file: Optional[str] = None,
+                 durability: Optional[str] = None, flush_interval: float = 0.05, snapshot_every: int = 1000,
+                 ledger_file: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._state_file = Path(state_file) if state_file else Path('funds_state.json')
+        self._wal_file = self._state_file.with_name(self._state_file.name + '.wal')
+        self._available = 0.0
+        self._reserved = 0.0
+        self._seq = 0
+        mode = str(durability or os.getenv('FUND_DURABILITY', 'sync')).lower()
+        self._durability = mode if mode in DURABILITY_MODES else 'sync'
+        self._flush_interval = float(flush_interval)
+        self._snapshot_every = max(1, int(snapshot_every))
+        self._flusher = None
+        if self._durability != 'sync':
+            self._cond = threading.Condition()
+            self._pending = []
+            self._durable_seq = 0
+            self._stopping = False
+        self._load_or_init(float(initial_fund or 0.0))
+        if self._durability == 'sync' and self._wal_file.exists():
+            # write-behind モードから戻した場合: 再生済みの WAL をスナップショットに取り込んで消す
+            with self._lock:
+                self._persist()
+            try:
+                self._wal_file.unlink()
+            except Exception:
+                pass
+        self.ledger: Optional[Ledger] = None
+        if ledger_file is None and str(os.getenv('FUND_LEDGER', '0')).lower() in ('1', 'true', 'yes', 'on'):
+            ledger_file = str(self._state_file.with_name(self._state_file.stem + '.ledger.jsonl'))
+        if ledger_file:
+            self._open_ledger(ledger_file)
+        if self._durability != 'sync':
+            if not self._state_file.exists():
+                # 初期状態はスナップショットとして同期的に書いておく（WAL の再生起点になる）
+                try:
+                    self._write_snapshot()
+                except Exception:
+                    pass
+            self._flusher = threading.Thread(target=self._flush_loop, name='funds-flusher', daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def _load_or_init(self, initial: float) -> None:
+        try:
+            if self._state_file.exists():
+                raw = json.loads(self._state_file.read_text(encoding='utf-8'))
+                self._available = float(raw.get('available', initial))
+                self._reserved = float(raw.get('reserved', 0.0))
+                self._seq = int(raw.get('seq', 0))
+                self._replay_wal()
+            else:
+                self._available = float(initial)
+                self._reserved = 0.0
+                self._persist()
+        except Exception:
+            # フォールバック
+            self._available = float(initial)
+            self._reserved = 0.0
+            try:
+                self._persist()
+            except Exception:
+                pass
+
+    def _open_ledger(self, path: str) -> None:
+        try:
+            self.ledger = Ledger(path)
+        except Exception as e:
+            print(f"⚠️ 台帳を開けませんでした: {e}")
+            self.ledger = None
+            return
+        # 台帳の cash 勘定を現在の残高に合わせる（初回は開始残高、以降は差分を調整仕訳として記録）
+        with self._lock:
+            kind = 'opening' if len(self.ledger) == 0 else 'adjustment'
+            source = ACCOUNT_OPENING if kind == 'opening' else ACCOUNT_ADJUSTMENT
+            targets = ((ACCOUNT_FREE, self._available - self._reserved), (ACCOUNT_RESERVED, self._reserved))
+            for account, target in targets:
+                diff = float(target) - self.ledger.balance(account)
+                if diff > 1e-9:
+                    self.ledger.post(kind, account, source, diff)
+                elif diff < -1e-9:
+                    self.ledger.post(kind, source, account, -diff)
+
+    def _post(self, kind: str, debit: str, credit: str, amount: float, order_id=None) -> None:
+        if self.ledger is not None:
+            self.ledger.post(kind, debit, credit, amount, order_id=order_id)
+
+    def _persist(self) -> int:
+        """状態の変更を記録する（ロック内で呼ぶ）。write-behind では WAL 待ち行列に積むだけ。"""
+        if self._durability == 'sync':
+            try:
+                obj = {'available': float(self._available), 'reserved': float(self._reserved)}
+                with _timed('persist_write_duration_seconds', store='funds'):
+                    self._state_file.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding='utf-8')
+            except Exception:
+                pass
+            return 0
+        self._seq += 1
+        record = {'seq': self._seq, 'available': float(self._available), 'reserved': float(self._reserved)}
+        with self._cond:
+            self._pending.append(record)
+            self._cond.notify_all()
+        return self._seq
+
+    def _commit(self, seq: int) -> None:
+        """group モードでは seq が fsync されるまで待つ（ロックの外で呼ぶ）。"""
+        if seq <= 0 or self._durability != 'group':
+            return
+        with self._cond:
+            while self._durable_seq < seq and self._flusher is not None and self._flusher.is_alive():
+                self._cond.wait(1.0)
+
+    # --- write-behind ---
+    def _replay_wal(self) -> None:
+        # 各レコードは変更後の状態そのものなので、スナップショットより新しい最後のレコードを採用する。
+        # 書き込み途中で落ちた末尾は切り詰める（残すと書き込みスレッドがその続きに追記してしまう）
+        try:
+            for rec in read_jsonl(self._wal_file, repair=True):
+                if int(rec.get('seq', 0)) > self._seq:
+                    self._seq = int(rec['seq'])
+                    self._available = float(rec['available'])
+                    self._reserved = float(rec['reserved'])
+        except Exception as e:
+            print(f"⚠️ 資金 WAL の再生エラー: {e}")
+
+    def _write_snapshot(self) -> int:
+        with _timed('persist_write_duration_seconds', store='funds_snapshot'):
+            return self._write_snapshot_files()
+
+    def _write_snapshot_files(self) -> int:
+        with self._lock:
+            obj = {'available': float(self._available), 'reserved': float(self._reserved), 'seq': self._seq}
+        tmp_path = self._state_file.with_name(self._state_file.name + '.tmp')
+        with open(str(tmp_path), 'w', encoding='utf-8') as fh:
+            fh.write(json.dumps(obj, ensure_ascii=False, indent=2))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(str(tmp_path), str(self._state_file))
+        # スナップショットに含まれたレコードは不要なので WAL を空にする
+        with open(str(self._wal_file), 'w', encoding='utf-8') as fh:
+            fh.flush()
+            os.fsync(fh.fileno())
+        return obj['seq']
+
+    def _flush_loop(self) -> None:
+        since_snapshot = 0
+        wal = open(str(self._wal_file), 'a', encoding='utf-8')
+        try:
+            while True:
+                with self._cond:
+                    if not self._pending and not self._stopping:
+                        self._cond.wait(self._flush_interval)
+                    batch, self._pending = self._pending, []
+                    stopping = self._stopping
+                if batch:
+                    try:
+                        # 待ち行列に溜まった変更をまとめて 1 回の fsync で確定する
+                        with _timed('persist_write_duration_seconds', store='funds_wal'):
+                            wal.write(''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in batch))
+                            wal.flush()
+                            os.fsync(wal.fileno())
+                        since_snapshot += len(batch)
+                        durable = batch[-1]['seq']
+                        if since_snapshot >= self._snapshot_every or stopping:
+                            wal.close()
+                            durable = max(durable, self._write_snapshot())
+                            wal = open(str(self._wal_file), 'a', encoding='utf-8')
+                            since_snapshot = 0
+                    except Exception as e:
+                        print(f"⚠️ 資金状態の書き込みエラー: {e}")
+                        durable = batch[-1]['seq']
+                    with self._cond:
+                        self._durable_seq = max(self._durable_seq, durable)
+                        self._cond.notify_all()
+                if stopping and not batch:
+                    if since_snapshot:
+                        wal.close()
+                        self._write_snapshot()
+                        wal = open(str(self._wal_file), 'a', encoding='utf-8')
+                    return
+        finally:
+            wal.close()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """write-behind モードで、ここまでの変更がディスクに書かれるまで待つ。"""
+        if self.ledger is not None:
+            with self._lock:
+                self.ledger.sync()
+        if self._durability == 'sync':
+            return True
+        with self._lock:
+            target = self._seq
+        deadline = time.monotonic() + float(timeout)
+        with self._cond:
+            self._cond.notify_all()
+            while self._durable_seq < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._flusher is None or not self._flusher.is_alive():
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self) -> None:
+        """書き込みスレッドを止める。未書き込みの変更は WAL とスナップショットに書いてから終了する。"""
+        if self.ledger is not None:
+            with self._lock:
+                self.ledger.close()
+        if self._flusher is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._flusher.join(timeout=10.0)
+        self._flusher = None
+        try:
+            atexit.unregister(self.close)
+        except Exception:
+            pass
+
+    # --- 基本 API ---
+    def available_fund(self) -> float:
+        with self._lock:
+            try:
+                return float(max(0.0, self._available - self._reserved))
+            except Exception:
+                return 0.0
+
+    @traced('FundManager.add_funds')
+    def add_funds(self, amount: float, order_id: Optional[str] = None) -> None:
+        try:
+            a = float(amount or 0.0)
+        except Exception:
+            return
+        if a <= 0:
+            return
+        with self._lock:
+            self._available = float(self._available) + a
+            self._post('deposit', ACCOUNT_FREE, ACCOUNT_DEPOSIT if order_id is None else ACCOUNT_EXCHANGE, a, order_id)
+            seq = self._persist()
+        self._commit(seq)
+
+    # Legacy wrapper
+    def add_fund(self, amount: float, order_id: Optional[str] = None) -> None:
+        return self.add_funds(amount, order_id=order_id)
+
+    # --- 予約 API ---
+    @traced('FundManager.reserve')
+    def reserve(self, cost: float, order_id: Optional[str] = None) -> bool:
+        try:
+            c = float(cost or 0.0)
+        except Exception:
+            return False
+        if c <= 0:
+            return False
+        with self._lock:
+            unreserved = max(0.0, self._available - self._reserved)
+            if unreserved < c:
+                return False
+            self._reserved = float(self._reserved) + c
+            self._post('reserve', ACCOUNT_RESERVED, ACCOUNT_FREE, c, order_id)
+            seq = self._persist()
+        self._commit(seq)
+        return True
+
+    @traced('FundManager.confirm')
+    def confirm(self, cost: float, order_id: Optional[str] = None) -> None:
+        try:
+            c = float(cost or 0.0)
+        except Exception:
+            return
+        if c <= 0:
+            return
+        with self._lock:
+            consume = min(self._reserved, c)
+            self._reserved = max(0.0, self._reserved - consume)
+            # 予約分からの消費が足りない場合は available から差し引く
+            remain = max(0.0, c - consume)
+            if remain > 0:
+                remain = min(remain, max(0.0, self._available))
+                self._available = max(0.0, self._available - remain)
+            # confirm は予約を外すだけで available は減らさないので、台帳上も予約分は free に戻る
+            self._post('confirm', ACCOUNT_FREE, ACCOUNT_RESERVED, consume, order_id)
+            self._post('confirm', ACCOUNT_EXCHANGE, ACCOUNT_FREE, remain, order_id)
+            seq = self._persist()
+        self._commit(seq)
+
+    @traced('FundManager.release')
+    def release(self, cost: float, order_id: Optional[str] = None) -> None:
+        try:
+            c = float(cost or 0.0)
+        except Exception:
+            return
+        if c <= 0:
+            return
+        with self._lock:
+            dec = min(self._reserved, c)
+            self._reserved = max(0.0, self._reserved - dec)
+            self._post('release', ACCOUNT_FREE, ACCOUNT_RESERVED, dec, order_id)
+            seq = self._persist()
+        self._commit(seq)
+
+    # --- 互換性のための旧 API ---
+    @traced('FundManager.place_order')
+    def place_order(self, cost: float, order_id: Optional[str] = None) -> bool:
+        """Legacy: attempt to deduct cost immediately from available funds.
+
+        This behaves as an immediate consumption of funds (no reservation).
+        Returns True if deduction succeeded (sufficient unreserved funds), False otherwise.
+        """
+        try:
+            c = float(cost or 0.0)
+        except Exception:
+            return False
+        if c <= 0:
+            return False
+        with self._lock:
+            unreserved = max(0.0, self._available - self._reserved)
+            if unreserved < c:
+                return False
+            # deduct immediately from available (consume funds)
+            self._available = max(0.0, float(self._available) - c)
+            self._post('order', ACCOUNT_EXCHANGE, ACCOUNT_FREE, c, order_id)
+            # persist new state
+            seq = self._persist()
+        self._commit(seq)
+        return True
+
+    @traced('FundManager.pay_fee')
+    def pay_fee(self, fee: float, order_id: Optional[str] = None) -> float:
+        """約定済みの注文の手数料を差し引き、差し引いた額を返す。
+
+        手数料は約定した時点で取られているので、place_order と違い予約分に食い込んでも差し引く
+        （available は 0 未満にしない）。台帳には 'fee' として記録する。
+        """
+        try:
+            f = float(fee or 0.0)
+        except Exception:
+            return 0.0
+        if f <= 0:
+            return 0.0
+        with self._lock:
+            charged = min(f, max(0.0, float(self._available)))
+            self._available = float(self._available) - charged
+            self._post('fee', ACCOUNT_FEES, ACCOUNT_FREE, charged, order_id)
+            seq = self._persist()
+        self._commit(seq)
+        return charged
+
+    @traced('FundManager.record_realized_pnl')
+    def record_realized_pnl(self, pnl: float, order_id: Optional[str] = None) -> None:
+        """売却で確定した損益を台帳に記録する（残高は add_funds で反映済みなので変えない）。"""
+        try:
+            p = float(pnl or 0.0)
+        except Exception:
+            return
+        with self._lock:
+            if p > 0:
+                self._post('realized_pnl', ACCOUNT_COST_BASIS, ACCOUNT_PNL, p, order_id)
+            elif p < 0:
+                self._post('realized_pnl', ACCOUNT_PNL, ACCOUNT_COST_BASIS, -p, order_id)
+
+    def __repr__(self) -> str:
+        with self._lock:
+            return (f"<FundManager available={self._available:.2f} reserved={self._reserved:.2f} "
+                    f"file={str(self._state_file)} durability={self._durability}>")
+
+
+def create_fund_manager(initial_fund: float = 0.0, state_file: Optional[str] = None, backend: Optional[str] = None):
+    """FUND_BACKEND（json / sqlite）に応じた FundManager を返す。
+
+    複数のプロセス（bot と run_once.py など）が同じ資金を使う場合は sqlite を選んでください。
+    """
+    backend = str(backend or os.getenv('FUND_BACKEND', 'json')).lower()
+    if backend == 'sqlite':
+        from sqlite_funds import SqliteFundManager
+        return SqliteFundManager(initial_fund=initial_fund, state_file=state_file)
+    return FundManager(initial_fund=initial_fund, state_file=state_file)
+
+
+def check_and_notify(fund: FundManager, threshold: float, notifier: Optional[Callable[[str, str], bool]] = None) -> bool:
+    """資金が閾値を下回ったら通知。
+
+    notifier(subject, body) を渡せばそれを使う。無ければ標準出力に警告を出す。
+    """
+    try:
+        available = fund.available_fund()
+    except Exception:
+        return False
+    if available < float(threshold):
+        subject = "⚠️ 資金警告"
+        body = f"資金が少なくなっています：残り {available:,.0f} 円"
+        if notifier:
+            try:
+                return bool(notifier(subject, body))
+            except Exception:
+                return False
+        else:
+            print(subject)
+            print(body)
+            return True
+    return False
+
+
+if __name__ == '__main__':
+    fm = FundManager(initial_fund=10000)
+    print('initial:', fm)
+    print('avail:', fm.available_fund())
+    ok = fm.reserve(2000)
+    print('reserve 2000 ->', ok, 'avail_after:', fm.available_fund(), fm)
+    fm.confirm(2000)
+    print('confirm 2000 ->', fm)
+    fm.add_funds(500)
+    print('add 500 ->', fm)
+    ok2 = fm.place_order(300)
     print('place_order 300 ->', ok2, fm)
\ No newline at end of file
@@ -0,0 +1,482 @@
+"""IndicatorSink: 指標の記録をメモリに溜めて、日付ごとのバイナリ列指向ファイルにまとめて書き出す
+
+`write_indicators_csv` は 1 行ごとに `indicators.csv` を開き直して追記しており、ファイルは
+際限なく大きくなり、分析のたびに全体を CSV として読む必要がありました。このモジュールは
+  - 行をメモリに溜め、flush_rows 行または flush_sec 秒ごとに 1 回だけ書き出す
+  - 書き出し先は日付（JST）ごとのファイル indicators/indicators-YYYY-MM-DD.icol。
+    1 回の書き出しが 1 つのチャンク（行グループ）で、チャンク内は列ごとに
+    時刻 int64・数値 float64（欠損は NaN）・ペア/シグナルは辞書 + uint16 のコードで並べる
+  - retention_days より古い日付のファイルは削除する（0 なら残す）
+  - CSV は任意の出力先として残す（csv_path を指定したときだけ、書き出しと同時に追記）
+を行います。
+  - IndicatorSink.append(indicators, pair, signal='NONE', ts=None)
+  - IndicatorSink.flush() / close()
+  - load(start, end, pairs=None, base_dir='indicators', as_frame=True)   # 期間を読む（研究用）
+  - export_csv(start, end, out_path, ...) / import_csv(csv_path, ...)    # CSV との相互変換
+
+ファイル形式（チャンクの繰り返し）:
+  b'ICOL' + uint32 ヘッダー長 + ヘッダー JSON {'rows', 'columns', 'pairs', 'signals', 'codec', 'size'}
+  + 本体（ts[int64 * rows] + 各列[float64 * rows] + pair[uint16 * rows] + signal[uint16 * rows]。
+    ヘッダーの codec が 'zlib' なら本体全体を zlib で圧縮し、'size' は本体のバイト数）
+書き込み途中で落ちた末尾のチャンクは、読み込み時に長さが足りないので捨てられます。
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from array import array
+import atexit
+import bisect
+import datetime
+import json
+import math
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+
+try:
+    from metrics import timed as _timed
+except ImportError:
+    from contextlib import nullcontext as _nullcontext
+
+    def _timed(name, **labels):
+        return _nullcontext()
+
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+MAGIC = b'ICOL'
+FILE_SUFFIX = '.icol'
+FILE_PREFIX = 'indicators-'
+JST = datetime.timezone(datetime.timedelta(hours=9))
+
+# 従来の indicators.csv と同じ列（'price' は indicators['latest_close']）
+DEFAULT_COLUMNS = ('price', 'sma_short_50', 'sma_long_200', 'ema_12', 'ema_26', 'atr_14', 'rsi_14',
+                   'recent_high_20')
+CSV_HEADER = ['timestamp', 'pair'] + list(DEFAULT_COLUMNS) + ['signal']
+
+_LITTLE = sys.byteorder == 'little'
+
+
+def _to_bytes(arr: array) -> bytes:
+    # ファイル上は常にリトルエンディアン
+    if not _LITTLE:
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_bytes(typecode: str, data: bytes) -> array:
+    arr = array(typecode)
+    arr.frombytes(data)
+    if not _LITTLE:
+        arr.byteswap()
+    return arr
+
+
+def _day_of(ts_ms: int, tz: datetime.tzinfo) -> datetime.date:
+    return datetime.datetime.fromtimestamp(ts_ms / 1000.0, tz).date()
+
+
+def _float(value) -> float:
+    try:
+        return float(value) if value is not None else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _to_ms(value, tz: datetime.tzinfo) -> int:
+    """エポック秒/ミリ秒・datetime・date・'YYYY-MM-DD[THH:MM:SS]' をエポックミリ秒にする。"""
+    if isinstance(value, (int, float)):
+        return int(value if value > 1e11 else value * 1000)
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.strip())
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=tz)
+        return int(value.timestamp() * 1000)
+    if isinstance(value, datetime.date):
+        return int(datetime.datetime(value.year, value.month, value.day, tzinfo=tz).timestamp() * 1000)
+    raise TypeError(f"unsupported time value: {value!r}")
+
+
+def encode_chunk(ts: List[int], columns: Dict[str, List[float]], pairs: List[str], signals: List[str],
+                 compress: bool = True) -> bytes:
+    """1 チャンク分の行を列ごとのバイト列にする。"""
+    rows = len(ts)
+    pair_dict = sorted(set(pairs))
+    signal_dict = sorted(set(signals))
+    pair_code = {p: i for i, p in enumerate(pair_dict)}
+    signal_code = {s: i for i, s in enumerate(signal_dict)}
+    names = list(columns)
+    parts = [_to_bytes(array('q', ts))]
+    for name in names:
+        parts.append(_to_bytes(array('d', columns[name])))
+    parts.append(_to_bytes(array('H', (pair_code[p] for p in pairs))))
+    parts.append(_to_bytes(array('H', (signal_code[s] for s in signals))))
+    body = b''.join(parts)
+    codec = 'raw'
+    if compress:
+        # 列ごとに並んでいるので、同じ値・欠損の続く列はよく縮む
+        body = zlib.compress(body, 1)
+        codec = 'zlib'
+    header = json.dumps({'rows': rows, 'columns': names, 'pairs': pair_dict, 'signals': signal_dict,
+                         'codec': codec, 'size': len(body)},
+                        ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header, body])
+
+
+def read_chunks(path) -> Iterable[dict]:
+    """ファイル内のチャンクを {'ts': array, 'columns': {名前: array}, 'pair': [...], 'signal': [...]} で返す。"""
+    try:
+        data = Path(path).read_bytes()
+    except FileNotFoundError:
+        return
+    pos = 0
+    end = len(data)
+    while pos + 8 <= end:
+        if data[pos:pos + 4] != MAGIC:
+            print(f"⚠️ 指標ファイルが壊れています（{path} の {pos} バイト目以降を無視します）")
+            return
+        (hlen,) = struct.unpack_from('<I', data, pos + 4)
+        try:
+            header = json.loads(data[pos + 8:pos + 8 + hlen].decode('utf-8'))
+        except ValueError:
+            return
+        rows = int(header['rows'])
+        names = header['columns']
+        body = pos + 8 + hlen
+        size = int(header.get('size', rows * 8 * (1 + len(names)) + rows * 2 * 2))
+        if body + size > end:
+            # 書き込み途中で落ちた末尾のチャンク
+            return
+        pos = body + size
+        raw = data[body:pos]
+        if header.get('codec') == 'zlib':
+            raw = zlib.decompress(raw)
+        off = 0
+        ts = _from_bytes('q', raw[off:off + rows * 8])
+        off += rows * 8
+        cols = {}
+        for name in names:
+            cols[name] = _from_bytes('d', raw[off:off + rows * 8])
+            off += rows * 8
+        pair_codes = _from_bytes('H', raw[off:off + rows * 2])
+        off += rows * 2
+        signal_codes = _from_bytes('H', raw[off:off + rows * 2])
+        pair_dict = header['pairs']
+        signal_dict = header['signals']
+        yield {'ts': ts, 'columns': cols, 'pair': [pair_dict[c] for c in pair_codes],
+               'signal': [signal_dict[c] for c in signal_codes]}
+
+
+def partition_path(base_dir, day: datetime.date) -> Path:
+    return Path(base_dir) / f"{FILE_PREFIX}{day.isoformat()}{FILE_SUFFIX}"
+
+
+def list_partitions(base_dir) -> List[Tuple[datetime.date, Path]]:
+    out = []
+    try:
+        entries = list(Path(base_dir).iterdir())
+    except FileNotFoundError:
+        return out
+    for p in entries:
+        name = p.name
+        if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX):
+            try:
+                day = datetime.date.fromisoformat(name[len(FILE_PREFIX):-len(FILE_SUFFIX)])
+            except ValueError:
+                continue
+            out.append((day, p))
+    out.sort()
+    return out
+
+
+class IndicatorSink:
+    """指標の行を溜めて、日付ごとの列指向ファイルにまとめて追記するクラス。"""
+
+    def __init__(self, base_dir: str = 'indicators', flush_rows: int = 500, flush_sec: float = 300.0,
+                 csv_path: Optional[str] = None, retention_days: int = 0, fsync: bool = False,
+                 compress: bool = True, tz: datetime.tzinfo = JST, clock=time.time):
+        """
+        Args:
+            flush_rows: この行数が溜まったら書き出す
+            flush_sec: 最初の未書き出し行からこの秒数が経ったら書き出す（0 なら行数だけで判断）
+            csv_path: 指定すると書き出しのたびに同じ行を CSV にも追記する
+            retention_days: この日数より古い日付ファイルを削除する（0 なら削除しない）
+            compress: チャンク本体を zlib で圧縮する
+        """
+        self.base_dir = Path(base_dir)
+        self.flush_rows = max(1, int(flush_rows))
+        self.flush_sec = float(flush_sec)
+        self.csv_path = csv_path
+        self.retention_days = int(retention_days)
+        self.fsync = bool(fsync)
+        self.compress = bool(compress)
+        self.tz = tz
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._rows: List[Tuple[int, str, str, Dict[str, float]]] = []
+        self._first_buffered: Optional[float] = None
+        self._pruned_day: Optional[datetime.date] = None
+        self.stats = {'rows': 0, 'flushes': 0, 'bytes': 0}
+        atexit.register(self.close)
+
+    def append(self, indicators: dict, pair: str, signal: str = 'NONE', ts=None) -> None:
+        """1 行をメモリに積む（必要なら書き出す）。例外は投げない。"""
+        try:
+            now = self._clock()
+            ts_ms = _to_ms(ts, self.tz) if ts is not None else int(now * 1000)
+            values = {'price': _float(indicators.get('latest_close', indicators.get('price')))}
+            for key, value in indicators.items():
+                if key in ('latest_close', 'price'):
+                    continue
+                if value is None or isinstance(value, (int, float)):
+                    values[key] = _float(value)
+            with self._lock:
+                self._rows.append((ts_ms, str(pair), str(signal), values))
+                if self._first_buffered is None:
+                    self._first_buffered = now
+                due = len(self._rows) >= self.flush_rows or (
+                    self.flush_sec > 0 and now - self._first_buffered >= self.flush_sec)
+                if due:
+                    self._flush_locked()
+        except Exception as e:
+            print(f"⚠️ 指標記録エラー: {e}")
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        self.flush()
+        try:
+            atexit.unregister(self.close)
+        except Exception:
+            pass
+
+    def _flush_locked(self) -> None:
+        rows, self._rows = self._rows, []
+        self._first_buffered = None
+        if not rows:
+            return
+        with _timed('persist_write_duration_seconds', store='indicators'):
+            self._write_rows(rows)
+
+    def _write_rows(self, rows) -> None:
+        try:
+            by_day: Dict[datetime.date, list] = {}
+            for row in rows:
+                by_day.setdefault(_day_of(row[0], self.tz), []).append(row)
+            self.base_dir.mkdir(parents=True, exist_ok=True)
+            for day, day_rows in sorted(by_day.items()):
+                day_rows.sort(key=lambda r: r[0])
+                names = list(DEFAULT_COLUMNS) + sorted({k for r in day_rows for k in r[3]} - set(DEFAULT_COLUMNS))
+                columns = {name: [r[3].get(name, math.nan) for r in day_rows] for name in names}
+                blob = encode_chunk([r[0] for r in day_rows], columns, [r[1] for r in day_rows],
+                                    [r[2] for r in day_rows], compress=self.compress)
+                # チャンクは 1 回の write で追記する（途中で落ちても読み込み時に末尾ごと捨てられる）
+                fd = os.open(str(partition_path(self.base_dir, day)), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                try:
+                    os.write(fd, blob)
+                    if self.fsync:
+                        os.fsync(fd)
+                finally:
+                    os.close(fd)
+                self.stats['bytes'] += len(blob)
+            if self.csv_path:
+                self._append_csv(rows)
+            self.stats['rows'] += len(rows)
+            self.stats['flushes'] += 1
+            self._prune(max(by_day))
+        except Exception as e:
+            print(f"⚠️ 指標ファイル書き出しエラー: {e}")
+
+    def _append_csv(self, rows) -> None:
+        import csv
+        file_exists = os.path.exists(self.csv_path)
+        with open(self.csv_path, 'a', newline='', encoding='utf-8') as fh:
+            writer = csv.writer(fh)
+            if not file_exists:
+                writer.writerow(CSV_HEADER)
+            for ts_ms, pair, signal, values in rows:
+                stamp = datetime.datetime.fromtimestamp(ts_ms / 1000.0, self.tz).isoformat()
+                writer.writerow([stamp, pair] + [_csv_value(values.get(c)) for c in DEFAULT_COLUMNS] + [signal])
+
+    def _prune(self, latest_day: datetime.date) -> None:
+        if self.retention_days <= 0 or self._pruned_day == latest_day:
+            return
+        self._pruned_day = latest_day
+        cutoff = latest_day - datetime.timedelta(days=self.retention_days)
+        for day, path in list_partitions(self.base_dir):
+            if day < cutoff:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def __repr__(self) -> str:
+        return f"<IndicatorSink dir={str(self.base_dir)} buffered={len(self._rows)} written={self.stats['rows']}>"
+
+
+def _csv_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    return value
+
+
+def load(start=None, end=None, pairs: Optional[Iterable[str]] = None, base_dir: str = 'indicators',
+         as_frame: bool = True, tz: datetime.tzinfo = JST):
+    """[start, end) の行を読む。該当する日付のファイルだけを開き、チャンク内は時刻で二分探索する。
+
+    Returns:
+        as_frame=True で pandas があれば DataFrame（index は JST の時刻）、
+        それ以外は {'timestamp': [ms...], 'pair': [...], 'signal': [...], 列名: [...]} の辞書
+    """
+    start_ms = _to_ms(start, tz) if start is not None else None
+    end_ms = _to_ms(end, tz) if end is not None else None
+    first_day = _day_of(start_ms, tz) if start_ms is not None else None
+    last_day = _day_of(end_ms - 1, tz) if end_ms is not None else None
+    wanted = set(pairs) if pairs is not None else None
+    ts_out = array('q')
+    pair_out: List[str] = []
+    signal_out: List[str] = []
+    cols_out: Dict[str, array] = {name: array('d') for name in DEFAULT_COLUMNS}
+    for day, path in list_partitions(base_dir):
+        if (first_day is not None and day < first_day) or (last_day is not None and day > last_day):
+            continue
+        for chunk in read_chunks(path):
+            ts = chunk['ts']
+            lo = bisect.bisect_left(ts, start_ms) if start_ms is not None else 0
+            hi = bisect.bisect_left(ts, end_ms) if end_ms is not None else len(ts)
+            if lo >= hi:
+                continue
+            if wanted is None:
+                idx = None
+            else:
+                idx = [i for i in range(lo, hi) if chunk['pair'][i] in wanted]
+                if not idx:
+                    continue
+            n_before = len(ts_out)
+            if idx is None:
+                ts_out.extend(ts[lo:hi])
+                pair_out.extend(chunk['pair'][lo:hi])
+                signal_out.extend(chunk['signal'][lo:hi])
+            else:
+                ts_out.extend(ts[i] for i in idx)
+                pair_out.extend(chunk['pair'][i] for i in idx)
+                signal_out.extend(chunk['signal'][i] for i in idx)
+            added = len(ts_out) - n_before
+            for name, values in chunk['columns'].items():
+                out = cols_out.get(name)
+                if out is None:
+                    # 途中から増えた列は、それまでの行を NaN で埋める
+                    out = cols_out[name] = array('d', [math.nan]) * n_before
+                out.extend(values[lo:hi] if idx is None else (values[i] for i in idx))
+            for name, out in cols_out.items():
+                if len(out) < n_before + added:
+                    out.extend([math.nan] * (n_before + added - len(out)))
+    if as_frame and pd is not None:
+        data = {'pair': pair_out}
+        for name, values in cols_out.items():
+            data[name] = np.frombuffer(values, dtype=np.float64) if np is not None else list(values)
+        data['signal'] = signal_out
+        index = pd.to_datetime(np.frombuffer(ts_out, dtype=np.int64) if np is not None else list(ts_out),
+                               unit='ms', utc=True).tz_convert(tz)
+        frame = pd.DataFrame(data, index=index)
+        frame.index.name = 'timestamp'
+        # 同じ時刻の行は書き出し単位の順なので、全体を時刻で安定ソートしておく
+        return frame.sort_index(kind='stable')
+    out = {'timestamp': list(ts_out), 'pair': pair_out, 'signal': signal_out}
+    out.update({name: list(values) for name, values in cols_out.items()})
+    return out
+
+
+def export_csv(start, end, out_path: str, pairs: Optional[Iterable[str]] = None, base_dir: str = 'indicators',
+               tz: datetime.tzinfo = JST) -> int:
+    """期間の行を従来の indicators.csv と同じ列で書き出し、行数を返す。"""
+    import csv
+    data = load(start, end, pairs=pairs, base_dir=base_dir, as_frame=False, tz=tz)
+    rows = sorted(range(len(data['timestamp'])), key=lambda i: data['timestamp'][i])
+    with open(out_path, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(CSV_HEADER)
+        for i in rows:
+            stamp = datetime.datetime.fromtimestamp(data['timestamp'][i] / 1000.0, tz).isoformat()
+            writer.writerow([stamp, data['pair'][i]] + [_csv_value(data[c][i]) for c in DEFAULT_COLUMNS]
+                            + [data['signal'][i]])
+    return len(rows)
+
+
+def import_csv(csv_path: str, base_dir: str = 'indicators', tz: datetime.tzinfo = JST) -> int:
+    """既存の indicators.csv を日付ファイルへ取り込み、行数を返す（読めない行は飛ばす）。"""
+    import csv
+    sink = IndicatorSink(base_dir=base_dir, flush_rows=10 ** 9, flush_sec=0, tz=tz)
+    count = 0
+    seen = set()
+    with open(csv_path, 'r', newline='', encoding='utf-8') as fh:
+        # マージの衝突マーカーなどヘッダーより前の行は飛ばす
+        lines = [line for line in fh if not line.startswith(('<<<<<<<', '=======', '>>>>>>>'))]
+    start = next((i for i, line in enumerate(lines) if line.startswith('timestamp,')), None)
+    if start is None:
+        return 0
+    for row in csv.DictReader(lines[start:]):
+        try:
+            ts = _to_ms(row['timestamp'], tz)
+        except Exception:
+            continue
+        key = (ts, row.get('pair'))
+        if key in seen:
+            continue
+        seen.add(key)
+        values = {c: row.get(c) or None for c in DEFAULT_COLUMNS}
+        values['latest_close'] = values.pop('price')
+        sink.append(values, row.get('pair') or '', row.get('signal') or 'NONE', ts=ts)
+        count += 1
+    sink.close()
+    return count
+
+
+def main(argv) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(prog='indicator_sink.py', description='指標ファイル（.icol）の変換・確認')
+    parser.add_argument('--dir', default=os.getenv('INDICATORS_DIR', 'indicators'))
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_exp = sub.add_parser('export', help='期間を CSV に書き出す')
+    p_exp.add_argument('--start')
+    p_exp.add_argument('--end')
+    p_exp.add_argument('--pair', action='append')
+    p_exp.add_argument('--out', default='indicators_export.csv')
+    p_imp = sub.add_parser('import', help='indicators.csv を取り込む')
+    p_imp.add_argument('csv_path')
+    sub.add_parser('ls', help='日付ファイルの一覧')
+    args = parser.parse_args(argv[1:])
+    if args.cmd == 'export':
+        n = export_csv(args.start, args.end, args.out, pairs=args.pair, base_dir=args.dir)
+        print(f"{n} 行を {args.out} に書き出しました")
+    elif args.cmd == 'import':
+        n = import_csv(args.csv_path, base_dir=args.dir)
+        print(f"{n} 行を {args.dir} に取り込みました")
+    else:
+        for day, path in list_partitions(args.dir):
+            rows = sum(len(c['ts']) for c in read_chunks(path))
+            print(f"{day.isoformat()}  {rows:8d} 行  {path.stat().st_size:10d} bytes  {path.name}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv))
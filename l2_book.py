@@ -0,0 +1,350 @@
+"""L2Book: 差分更新で維持する板（L2）と、記録済みフィードの再生ツール
+
+毎ティック `fetch_order_book` で板全体を取り直す代わりに、板の差分（価格・数量の組、
+数量 0 は削除）を手元の整列済みの板に適用します。
+  - 各価格は二分探索（bisect）で位置を求めるので、1 件の更新は O(log n) の探索で済む
+  - シーケンス番号の飛びを検知すると板を stale にし、スナップショットを取り直して
+    （resync）、その間に届いた差分のうち新しいものだけを適用し直す。取得に失敗したり
+    スナップショットが溜めた差分より古くて追いつけなかった場合は、次の差分で取り直す
+  - FeedRecorder / FeedReplayer で受信したメッセージを JSONL に記録・再生でき、
+    オフラインで駆動・ベンチマークできる
+  - L2BookExchange は同期中の板を fetch_order_book として返す取引所ラッパー
+
+メッセージ形式:
+  snapshot: {'bids': [[price, size], ...], 'asks': [...], 'sequence': n, 'timestamp': ms}
+  diff    : {'bids': [[price, size], ...], 'asks': [...], 'sequence': n, 'timestamp': ms}
+
+使い方:
+  python l2_book.py bench [--levels 200] [--updates 100000]
+  python l2_book.py replay feed.jsonl [--depth 10]
+"""
+
+from typing import Callable, Dict, Iterator, List, Optional
+import bisect
+import json
+import sys
+import time
+
+
+class _Side:
+    """片側の板。価格は昇順のキー配列（買い板は符号を反転）と価格→数量の辞書で持つ。"""
+
+    def __init__(self, descending: bool):
+        self._sign = -1.0 if descending else 1.0
+        self._keys: List[float] = []
+        self._sizes: Dict[float, float] = {}
+
+    def clear(self) -> None:
+        self._keys = []
+        self._sizes = {}
+
+    def set(self, price: float, size: float) -> None:
+        price = float(price)
+        size = float(size)
+        key = self._sign * price
+        if size <= 0:
+            if price in self._sizes:
+                del self._sizes[price]
+                i = bisect.bisect_left(self._keys, key)
+                if i < len(self._keys) and self._keys[i] == key:
+                    del self._keys[i]
+            return
+        if price not in self._sizes:
+            bisect.insort(self._keys, key)
+        self._sizes[price] = size
+
+    def load(self, levels) -> None:
+        self._sizes = {float(lv[0]): float(lv[1]) for lv in levels if float(lv[1]) > 0}
+        self._keys = sorted(self._sign * p for p in self._sizes)
+
+    def best(self) -> Optional[float]:
+        return self._sign * self._keys[0] if self._keys else None
+
+    def levels(self, depth: Optional[int] = None) -> List[List[float]]:
+        keys = self._keys if depth is None else self._keys[:depth]
+        sign = self._sign
+        sizes = self._sizes
+        return [[sign * k, sizes[sign * k]] for k in keys]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class L2Book:
+    """スナップショット + 差分で維持する 1 ペア分の板。"""
+
+    def __init__(self, pair: str = 'BTC/JPY', snapshot_fetcher: Optional[Callable[[], dict]] = None,
+                 contiguous: bool = True, max_buffer: int = 10000, resync_interval: float = 1.0):
+        """
+        Args:
+            snapshot_fetcher: resync 時に板全体を返す関数（例: lambda: exchange.fetch_order_book(pair)）
+            contiguous: True なら sequence は 1 ずつ増える前提で飛びを検知する。
+                        False なら古い（<=）差分を捨てるだけにする（bitbank の depth_diff など）
+            resync_interval: resync で同期できなかったとき（取得失敗・溜めた差分より古いスナップショット）、
+                             次の差分で取り直すまでの最短間隔（秒）
+        """
+        self.pair = pair
+        self.bids = _Side(descending=True)
+        self.asks = _Side(descending=False)
+        self.sequence: Optional[int] = None
+        self.timestamp: Optional[int] = None
+        self.updated_at: Optional[float] = None
+        self.synced = False
+        self._fetch_snapshot = snapshot_fetcher
+        self._contiguous = bool(contiguous)
+        self._buffer: List[dict] = []
+        self._resyncing = False
+        self._max_buffer = int(max_buffer)
+        self._resync_interval = float(resync_interval)
+        self._last_resync: Optional[float] = None
+        self.stats = {'snapshots': 0, 'diffs': 0, 'stale_diffs': 0, 'gaps': 0, 'resyncs': 0}
+
+    # --- 適用 ---
+    def apply_snapshot(self, snapshot: dict) -> None:
+        self.bids.load(snapshot.get('bids', []))
+        self.asks.load(snapshot.get('asks', []))
+        seq = snapshot.get('sequence', snapshot.get('nonce'))
+        self.sequence = int(seq) if seq is not None else None
+        self.timestamp = snapshot.get('timestamp')
+        self.updated_at = time.time()
+        self.synced = True
+        self.stats['snapshots'] += 1
+        # resync 中に溜めた差分のうち、スナップショットより新しいものを適用し直す
+        pending, self._buffer = self._buffer, []
+        for diff in pending:
+            self.apply_diff(diff)
+
+    def apply_diff(self, diff: dict) -> bool:
+        """差分を適用する。適用したら True、古い・同期待ちで保留したら False。"""
+        seq = diff.get('sequence')
+        seq = int(seq) if seq is not None else None
+        if not self.synced:
+            self._hold(diff)
+            if self._resync_due():
+                # 前回の resync で追いつけなかった。待っているだけでは同期に戻らないので取り直す
+                self.resync()
+            return False
+        if seq is not None and self.sequence is not None:
+            if seq <= self.sequence:
+                self.stats['stale_diffs'] += 1
+                return False
+            if self._contiguous and seq != self.sequence + 1:
+                self.stats['gaps'] += 1
+                self.synced = False
+                self._hold(diff)
+                if not self._resyncing:
+                    self.resync()
+                return False
+        for price, size in (lv[:2] for lv in diff.get('bids', ())):
+            self.bids.set(price, size)
+        for price, size in (lv[:2] for lv in diff.get('asks', ())):
+            self.asks.set(price, size)
+        if seq is not None:
+            self.sequence = seq
+        self.timestamp = diff.get('timestamp', self.timestamp)
+        self.updated_at = time.time()
+        self.stats['diffs'] += 1
+        return True
+
+    def _hold(self, diff: dict) -> None:
+        self._buffer.append(diff)
+        if len(self._buffer) > self._max_buffer:
+            del self._buffer[0]
+
+    def _resync_due(self) -> bool:
+        # 一度も同期していない板は、従来どおり最初のスナップショットを待つ
+        if self._fetch_snapshot is None or self._resyncing or self.sequence is None:
+            return False
+        return self._last_resync is None or time.monotonic() - self._last_resync >= self._resync_interval
+
+    def resync(self) -> bool:
+        """スナップショットを取り直す。取得関数が無ければ次の apply_snapshot を待つ。"""
+        if self._fetch_snapshot is None:
+            return False
+        self._last_resync = time.monotonic()
+        try:
+            snapshot = self._fetch_snapshot()
+        except Exception as e:
+            print(f"⚠️ 板スナップショットの再取得エラー ({self.pair}): {e}")
+            return False
+        self.stats['resyncs'] += 1
+        # 取り直した直後にまた飛びがあっても再帰せず、次の resync / スナップショットを待つ
+        self._resyncing = True
+        try:
+            self.apply_snapshot(snapshot)
+        finally:
+            self._resyncing = False
+        return self.synced
+
+    # --- 参照 ---
+    def best_bid(self) -> Optional[float]:
+        return self.bids.best()
+
+    def best_ask(self) -> Optional[float]:
+        return self.asks.best()
+
+    def mid(self) -> Optional[float]:
+        bid, ask = self.best_bid(), self.best_ask()
+        if bid is None or ask is None:
+            return None
+        return (bid + ask) / 2.0
+
+    def to_ccxt(self, depth: Optional[int] = None) -> dict:
+        """ccxt の fetch_order_book と同じ形式で返す。"""
+        return {
+            'symbol': self.pair,
+            'bids': self.bids.levels(depth),
+            'asks': self.asks.levels(depth),
+            'timestamp': self.timestamp,
+            'nonce': self.sequence,
+        }
+
+    def __repr__(self) -> str:
+        return (f"<L2Book {self.pair} bids={len(self.bids)} asks={len(self.asks)} "
+                f"seq={self.sequence} synced={self.synced}>")
+
+
+class L2BookExchange:
+    """同期済みで新しい L2Book があればそれを fetch_order_book として返す取引所ラッパー。"""
+
+    def __init__(self, exchange, books: Dict[str, L2Book], max_age: float = 5.0):
+        self._exchange = exchange
+        self._books = books
+        self._max_age = float(max_age)
+
+    def fetch_order_book(self, pair, limit=None, *args, **kwargs):
+        book = self._books.get(pair)
+        fresh = book is not None and book.synced and book.updated_at is not None \
+            and time.time() - book.updated_at <= self._max_age
+        if fresh and not args and not kwargs:
+            return book.to_ccxt(limit)
+        if limit is not None:
+            args = (limit,) + args
+        return self._exchange.fetch_order_book(pair, *args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._exchange, name)
+
+
+# --- 記録と再生 ---
+class FeedRecorder:
+    """受信したスナップショット・差分を JSONL に追記する。"""
+
+    def __init__(self, path: str):
+        self._fh = open(path, 'a', encoding='utf-8')
+
+    def record(self, kind: str, message: dict) -> None:
+        self._fh.write(json.dumps({'t': time.time(), 'type': kind, 'data': message}, separators=(',', ':')) + '\n')
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class FeedReplayer:
+    """FeedRecorder で記録したフィードを L2Book に流し込む。"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def messages(self) -> Iterator[dict]:
+        with open(self.path, 'r', encoding='utf-8') as fh:
+            for line in fh:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    def drive(self, book: L2Book, realtime: bool = False) -> Iterator[L2Book]:
+        """メッセージを順に適用し、1 件ごとに板を返す。realtime=True なら記録時の間隔で待つ。"""
+        prev_t = None
+        for msg in self.messages():
+            if realtime and prev_t is not None:
+                time.sleep(max(0.0, msg['t'] - prev_t))
+            prev_t = msg['t']
+            if msg['type'] == 'snapshot':
+                book.apply_snapshot(msg['data'])
+            else:
+                book.apply_diff(msg['data'])
+            yield book
+
+
+def synthetic_feed(levels: int = 200, updates: int = 10000, seed: int = 1, mid: float = 10_000_000.0,
+                   tick: float = 1.0) -> Iterator[tuple]:
+    """ベンチマーク用の決まった板フィード（最初にスナップショット、以降は 1 段ずつの差分）。"""
+    import random
+    rng = random.Random(seed)
+    bids = {mid - tick * (i + 1): rng.uniform(0.01, 2.0) for i in range(levels)}
+    asks = {mid + tick * (i + 1): rng.uniform(0.01, 2.0) for i in range(levels)}
+    yield 'snapshot', {'bids': [[p, s] for p, s in bids.items()], 'asks': [[p, s] for p, s in asks.items()],
+                       'sequence': 0}
+    for seq in range(1, updates + 1):
+        side = bids if rng.random() < 0.5 else asks
+        sign = -1 if side is bids else 1
+        price = mid + sign * tick * rng.randint(1, levels + 20)
+        size = 0.0 if (price in side and rng.random() < 0.3) else rng.uniform(0.01, 2.0)
+        if size > 0:
+            side[price] = size
+        else:
+            side.pop(price, None)
+        key = 'bids' if side is bids else 'asks'
+        yield 'diff', {key: [[price, size]], 'sequence': seq}
+
+
+def benchmark(levels: int = 200, updates: int = 100000) -> dict:
+    """差分適用と、毎回スナップショットから作り直す方式の 1 更新あたりのコストを比べる。"""
+    feed = list(synthetic_feed(levels, updates))
+    book = L2Book()
+    started = time.perf_counter()
+    for kind, msg in feed:
+        if kind == 'snapshot':
+            book.apply_snapshot(msg)
+        else:
+            book.apply_diff(msg)
+    diff_sec = time.perf_counter() - started
+    snapshot = book.to_ccxt()
+    rebuilds = max(1, min(updates, 2000))
+    started = time.perf_counter()
+    for _ in range(rebuilds):
+        L2Book().apply_snapshot(snapshot)
+    rebuild_sec = (time.perf_counter() - started) / rebuilds
+    return {
+        'levels': levels,
+        'updates': updates,
+        'diff_us': diff_sec / max(1, updates) * 1e6,
+        'snapshot_rebuild_us': rebuild_sec * 1e6,
+        'final_bids': len(book.bids),
+        'final_asks': len(book.asks),
+    }
+
+
+def main(argv: list) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(description='Incremental L2 order book tools')
+    sub = ap.add_subparsers(dest='cmd')
+    b = sub.add_parser('bench')
+    b.add_argument('--levels', type=int, default=200)
+    b.add_argument('--updates', type=int, default=100000)
+    r = sub.add_parser('replay')
+    r.add_argument('feed')
+    r.add_argument('--pair', default='BTC/JPY')
+    r.add_argument('--depth', type=int, default=5)
+    r.add_argument('--realtime', action='store_true')
+    args = ap.parse_args(argv[1:])
+    if args.cmd == 'bench':
+        print(json.dumps(benchmark(args.levels, args.updates), indent=2))
+        return 0
+    if args.cmd == 'replay':
+        book = L2Book(args.pair)
+        for _ in FeedReplayer(args.feed).drive(book, realtime=args.realtime):
+            pass
+        print(book)
+        print(json.dumps(book.to_ccxt(args.depth), ensure_ascii=False, indent=2))
+        print(json.dumps(book.stats))
+        return 0
+    ap.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,218 @@
+"""CachedExchange: エンドポイント別 TTL キャッシュとリクエスト合流（coalescing）付きの取引所ラッパー
+
+同じティック内で `get_latest_price` が 2 回呼ばれたり、板情報を別の関数が取り直したり
+すると、同じ REST 呼び出しが重複します。このラッパーは
+  - エンドポイントごとの TTL（秒）で結果をキャッシュ
+  - 同じ引数の同時リクエストは 1 回だけ取引所に送り、結果を全員で共有
+  - begin_tick() 〜 end_tick() の間は市場データを期限切れにしない（全員が同じ価格を見る）。
+    固定されるのはそのティック中に取得した値だけで、前のティックの値は TTL が切れていれば取り直す。
+    入れ子にでき、複数ペアをまとめて取得した外側のティックの中で各ペアの run_bot を回せる
+  - ヒット/ミス/合流の回数を数える（stats()）
+を行います。キャッシュ対象外のメソッドはそのまま元の取引所へ委譲し、
+create_order / cancel_order の後は残高・注文系のキャッシュを破棄します。
+"""
+
+from typing import Any, Callable, Dict, Optional, Tuple
+import os
+import threading
+import time
+
+
+DEFAULT_TTL = {
+    'fetch_ticker': 2.0,
+    'fetch_tickers': 2.0,
+    'fetch_order_book': 2.0,
+    'fetch_trades': 5.0,
+    'fetch_ohlcv': 30.0,
+    'fetch_balance': 5.0,
+    'fetch_open_orders': 5.0,
+    'fetch_orders': 5.0,
+}
+
+# ティック中は期限切れにしない市場データ系エンドポイント
+TICK_PINNED = ('fetch_ticker', 'fetch_tickers', 'fetch_order_book')
+
+# 注文操作で内容が変わるエンドポイント
+ACCOUNT_ENDPOINTS = ('fetch_balance', 'fetch_open_orders', 'fetch_orders')
+
+
+def parse_ttl_env(text: Optional[str]) -> Dict[str, float]:
+    """"fetch_ticker=2,fetch_order_book=1.5" 形式を辞書にする。"""
+    out: Dict[str, float] = {}
+    for part in (text or '').split(','):
+        if '=' not in part:
+            continue
+        name, value = part.split('=', 1)
+        try:
+            out[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return out
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class _Pending:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class CachedExchange:
+    """取引所オブジェクトを包み、読み取り系 API をキャッシュするラッパー。"""
+
+    def __init__(self, exchange, ttl: Optional[Dict[str, float]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self._exchange = exchange
+        self._ttl = dict(DEFAULT_TTL)
+        if ttl:
+            self._ttl.update(ttl)
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (期限, 値, 取得したティックの世代)
+        self._entries: Dict[Tuple, Tuple[float, Any, int]] = {}
+        self._inflight: Dict[Tuple, _Pending] = {}
+        self._pin_depth = 0
+        self._generation = 0
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    # --- 統計 ---
+    def _count(self, endpoint: str, kind: str) -> None:
+        st = self._stats.setdefault(endpoint, {'hits': 0, 'misses': 0, 'coalesced': 0})
+        st[kind] += 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+    # --- キャッシュ本体 ---
+    def _fresh(self, key: Tuple, now: float) -> bool:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if self._pin_depth > 0 and key[0] in TICK_PINNED:
+            # 固定するのは今のティックで取得した値だけ（前のティックの価格を使い回さない）
+            return entry[2] == self._generation
+        return entry[0] > now
+
+    def cached_call(self, endpoint: str, *args, **kwargs):
+        key = (endpoint, _freeze(args), _freeze(kwargs))
+        with self._lock:
+            now = self._clock()
+            if self._fresh(key, now):
+                self._count(endpoint, 'hits')
+                return self._entries[key][1]
+            pending = self._inflight.get(key)
+            if pending is not None:
+                self._count(endpoint, 'coalesced')
+                owner = False
+            else:
+                self._count(endpoint, 'misses')
+                pending = _Pending()
+                self._inflight[key] = pending
+                owner = True
+        if not owner:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+        try:
+            value = getattr(self._exchange, endpoint)(*args, **kwargs)
+            pending.value = value
+            with self._lock:
+                self._store(key, endpoint, value)
+            return value
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.event.set()
+
+    def prime(self, endpoint: str, args: tuple, value, kwargs: Optional[dict] = None) -> None:
+        """取得済みの値をキャッシュに入れる（まとめて取得したデータの配布用）。"""
+        key = (endpoint, _freeze(tuple(args)), _freeze(kwargs or {}))
+        with self._lock:
+            self._store(key, endpoint, value)
+
+    def _store(self, key: Tuple, endpoint: str, value) -> None:
+        self._entries[key] = (self._clock() + self._ttl.get(endpoint, 0.0), value, self._generation)
+
+    def invalidate(self, endpoint: Optional[str] = None) -> None:
+        with self._lock:
+            if endpoint is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == endpoint]:
+                    del self._entries[key]
+
+    # --- ティック ---
+    def begin_tick(self, pair: Optional[str] = 'BTC/JPY') -> None:
+        with self._lock:
+            self._pin_depth += 1
+            outermost = self._pin_depth == 1
+            if outermost:
+                self._generation += 1
+        # 入れ子のティックでは外側で取得済みのデータを使う
+        inner = getattr(self._exchange, 'begin_tick', None)
+        if outermost and pair is not None and callable(inner):
+            snap = inner(pair)
+            if isinstance(snap, dict):
+                if 'ticker' in snap:
+                    self.prime('fetch_ticker', (pair,), snap['ticker'])
+                if 'order_book' in snap:
+                    self.prime('fetch_order_book', (pair,), snap['order_book'])
+                if 'balance' in snap:
+                    self.prime('fetch_balance', (), snap['balance'])
+
+    def end_tick(self) -> None:
+        with self._lock:
+            self._pin_depth = max(0, self._pin_depth - 1)
+            outermost = self._pin_depth == 0
+        inner = getattr(self._exchange, 'end_tick', None)
+        if outermost and callable(inner):
+            inner()
+
+    # --- 書き込み系（キャッシュしない） ---
+    def create_order(self, *args, **kwargs):
+        try:
+            return self._exchange.create_order(*args, **kwargs)
+        finally:
+            for endpoint in ACCOUNT_ENDPOINTS:
+                self.invalidate(endpoint)
+
+    def cancel_order(self, *args, **kwargs):
+        try:
+            return self._exchange.cancel_order(*args, **kwargs)
+        finally:
+            for endpoint in ACCOUNT_ENDPOINTS:
+                self.invalidate(endpoint)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._ttl:
+            # 元の取引所に無いメソッドはキャッシュ経由でも提供しない
+            getattr(self._exchange, name)
+            return lambda *args, **kwargs: self.cached_call(name, *args, **kwargs)
+        return getattr(self._exchange, name)
+
+    def __repr__(self) -> str:
+        return f"<CachedExchange exchange={type(self._exchange).__name__} entries={len(self._entries)}>"
+
+
+def wrap_from_env(exchange):
+    """MARKET_CACHE / MARKET_CACHE_TTL 環境変数に従ってラップする（無効なら元のまま返す）。"""
+    if str(os.getenv('MARKET_CACHE', '1')).lower() not in ('1', 'true', 'yes', 'on'):
+        return exchange
+    if isinstance(exchange, CachedExchange):
+        return exchange
+    return CachedExchange(exchange, ttl=parse_ttl_env(os.getenv('MARKET_CACHE_TTL')))
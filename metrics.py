@@ -0,0 +1,377 @@
+"""metrics: プロセス内のメトリクス（レイテンシのヒストグラム・カウンター・ゲージ）と Prometheus 形式の公開
+
+取引所の呼び出しやティック、状態ファイルの書き込みにどれだけ時間がかかっているかを
+記録する仕組みが無かったので、このモジュールで
+  - 名前 + ラベルごとのヒストグラム（累積バケット・合計・件数）を記録する（observe は
+    バケットの二分探索とロック 1 回だけ）
+  - InstrumentedExchange で取引所 API の呼び出し時間を method / outcome ごとに記録する
+  - start_http_server() で 127.0.0.1 の HTTP エンドポイント（/metrics: Prometheus テキスト形式、
+    /healthz: 最後のティックからの経過秒）を別スレッドで公開する
+を行います。
+  - observe(name, seconds, **labels) / timed(name, **labels)   # 既定のレジストリに記録
+  - inc(name, amount=1, **labels) / set_gauge(name, value, **labels)
+  - Registry.render() -> str                                  # Prometheus テキスト形式
+  - InstrumentedExchange(exchange) / instrument_from_env(exchange)
+  - start_http_server(port, addr='127.0.0.1') / start_from_env()
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+
+# 1ms 〜 60s（取引所 API・ティック・ファイル書き込み・メール送信をまとめて扱える範囲）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 既知のメトリクスの説明（/metrics の # HELP 行）
+HELP = {
+    'exchange_request_duration_seconds': '取引所 API 呼び出しの所要時間',
+    'tick_duration_seconds': 'スケジューラのジョブ 1 回の所要時間',
+    'persist_write_duration_seconds': '状態ファイル・ジャーナル・DB への書き込み時間',
+    'notification_send_duration_seconds': 'メール 1 通の送信時間',
+    'notification_queue_delay_seconds': '通知をキューに積んでから送信し終わるまでの時間',
+    'exchange_request_errors_total': '取引所 API 呼び出しの失敗回数',
+    'last_tick_timestamp_seconds': '最後にティックが終わった時刻（UNIX 秒）',
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = ('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    """累積バケット付きのヒストグラム（ラベルの組み合わせごとに系列を持つ）。"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str = '', buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help or HELP.get(name, '')
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        self._lock = threading.Lock()
+        # key -> [バケットごとの件数..., +Inf の件数], 合計, 件数
+        self._series: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels) if labels else ()
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels) -> '_Timer':
+        return _Timer(self, labels)
+
+    def snapshot(self) -> Dict[LabelKey, dict]:
+        with self._lock:
+            items = [(k, list(s[0]), s[1], s[2]) for k, s in self._series.items()]
+        out = {}
+        for key, counts, total, count in items:
+            out[key] = {'counts': counts, 'sum': total, 'count': count}
+        return out
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """バケットから線形補間した q 分位点（目安。系列が無ければ None）。"""
+        series = self.snapshot().get(_label_key(labels))
+        if not series or not series['count']:
+            return None
+        rank = q * series['count']
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(self.buckets + (math.inf,), series['counts']):
+            if n and seen + n >= rank:
+                if bound == math.inf:
+                    return lower
+                return lower + (bound - lower) * ((rank - seen) / n)
+            seen += n
+            lower = bound if bound != math.inf else lower
+        return lower
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, s in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), s['counts']):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(s['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {s['count']}")
+        return lines
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str = ''):
+        self.name = name
+        self.help = help or HELP.get(name, '')
+        self._lock = threading.Lock()
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels) if labels else ()
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = _label_key(labels) if labels else ()
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class _Timer:
+    __slots__ = ('_hist', '_labels', '_start', 'elapsed')
+
+    def __init__(self, hist: Histogram, labels: dict):
+        self._hist = hist
+        self._labels = labels
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self._start
+        self._hist.observe(self.elapsed, **self._labels)
+        return False
+
+
+class Registry:
+    """メトリクスを名前で管理し、Prometheus テキスト形式で出力する。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, object] = {}
+
+    def _get(self, cls, name: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, **kwargs)
+        if not isinstance(metric, cls) or (cls is Counter and isinstance(metric, Gauge)):
+            raise ValueError(f"metric {name} is already registered as {metric.kind}")
+        return metric
+
+    def histogram(self, name: str, help: str = '', buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help=help, buckets=buckets)
+
+    def counter(self, name: str, help: str = '') -> Counter:
+        return self._get(Counter, name, help=help)
+
+    def gauge(self, name: str, help: str = '') -> Gauge:
+        return self._get(Gauge, name, help=help)
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            if metric.help:
+                lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self) -> None:
+        with self._lock:
+            self._metrics.clear()
+
+
+REGISTRY = Registry()
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    REGISTRY.histogram(name).observe(seconds, **labels)
+
+
+def timed(name: str, **labels) -> _Timer:
+    """with timed('persist_write_duration_seconds', store='positions'): ... の形で所要時間を記録する。"""
+    return REGISTRY.histogram(name).time(**labels)
+
+
+def inc(name: str, amount: float = 1.0, **labels) -> None:
+    REGISTRY.counter(name).inc(amount, **labels)
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    REGISTRY.gauge(name).set(value, **labels)
+
+
+def timed_call(name: str, fn: Callable, **labels) -> Callable:
+    """fn を呼ぶたびに所要時間を記録する関数を返す（スケジューラのジョブ用）。"""
+    hist = REGISTRY.histogram(name)
+
+    def wrapper(*args, **kwargs):
+        with hist.time(**labels):
+            return fn(*args, **kwargs)
+    wrapper.__name__ = getattr(fn, '__name__', 'timed_call')
+    return wrapper
+
+
+# --- 取引所ラッパー ---
+INSTRUMENTED_METHODS = ('fetch_ticker', 'fetch_tickers', 'fetch_order_book', 'fetch_ohlcv', 'fetch_trades',
+                        'fetch_balance', 'fetch_open_orders', 'fetch_orders', 'fetch_order', 'create_order',
+                        'cancel_order', 'load_markets')
+
+
+class InstrumentedExchange:
+    """取引所 API の呼び出し時間を exchange_request_duration_seconds{method, outcome} に記録するラッパー。"""
+
+    def __init__(self, exchange, registry: Optional[Registry] = None):
+        self._exchange = exchange
+        registry = registry or REGISTRY
+        self._hist = registry.histogram('exchange_request_duration_seconds')
+        self._errors = registry.counter('exchange_request_errors_total')
+
+    def _call(self, name: str, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._hist.observe(time.perf_counter() - start, method=name, outcome='error')
+            self._errors.inc(method=name, error=type(e).__name__)
+            raise
+        self._hist.observe(time.perf_counter() - start, method=name, outcome='ok')
+        return result
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self._exchange, name)
+        if callable(attr) and name in INSTRUMENTED_METHODS:
+            return lambda *args, **kwargs: self._call(name, attr, *args, **kwargs)
+        return attr
+
+    def __repr__(self) -> str:
+        return f"<InstrumentedExchange exchange={type(self._exchange).__name__}>"
+
+
+def enabled() -> bool:
+    return str(os.getenv('METRICS', '1')).lower() in ('1', 'true', 'yes', 'on')
+
+
+def instrument_from_env(exchange):
+    """METRICS=0 でなければ InstrumentedExchange で包む。"""
+    if not enabled() or isinstance(exchange, InstrumentedExchange):
+        return exchange
+    return InstrumentedExchange(exchange)
+
+
+# --- HTTP エンドポイント ---
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port: int, addr: str = '127.0.0.1', registry: Optional[Registry] = None):
+    """/metrics と /healthz を返す HTTP サーバーをデーモンスレッドで起動する（起動済みならそれを返す）。"""
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    registry = registry or REGISTRY
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?', 1)[0]
+            if path == '/metrics':
+                body = registry.render().encode('utf-8')
+                ctype = 'text/plain; version=0.0.4; charset=utf-8'
+            elif path == '/healthz':
+                last = registry.get('last_tick_timestamp_seconds')
+                values = last._values if last is not None else {}
+                ts = max(values.values()) if values else None
+                payload = {'last_tick_age_sec': None if ts is None else round(time.time() - ts, 3)}
+                body = json.dumps(payload).encode('utf-8')
+                ctype = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # スクレイプのたびにアクセスログを出さない
+            pass
+
+    with _server_lock:
+        if _server is not None:
+            return _server
+        server = ThreadingHTTPServer((addr, int(port)), Handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+        thread.start()
+        _server = server
+    return server
+
+
+def start_from_env():
+    """METRICS_PORT（0 で無効）/ METRICS_ADDR に従って HTTP サーバーを起動する。失敗しても bot は止めない。"""
+    if not enabled():
+        return None
+    try:
+        port = int(os.getenv('METRICS_PORT', '9108'))
+    except ValueError:
+        port = 0
+    if port <= 0:
+        return None
+    addr = os.getenv('METRICS_ADDR', '127.0.0.1')
+    try:
+        server = start_http_server(port, addr)
+        print(f"📈 メトリクス: http://{addr}:{server.server_address[1]}/metrics")
+        return server
+    except OSError as e:
+        print(f"⚠️ メトリクスの HTTP サーバーを起動できません（{addr}:{port}）: {e}")
+        return None
+
+
+def stop_http_server() -> None:
+    global _server
+    with _server_lock:
+        server, _server = _server, None
+    if server is not None:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,95 @@
+"""MultiPairEngine: 複数の取引ペアで同じ戦略を回すエンジン
+
+`run_bot` を 1 ペアずつ呼ぶと、ペア数に比例してティックの待ち時間が増えます。
+このエンジンはティックの最初に全ペアの ticker（fetchTickers が使えれば 1 回）と
+板情報を並行取得して `CachedExchange` に載せ、その中で各ペアの `run_bot` を順に実行します。
+  - ポジションはペアごとのファイル（`positions_file_for(pair)`）
+  - 資金は 1 つの FundManager を全ペアで共有（ペアは順番に処理するので予算の取り合いは起きない）
+  - 注文数量は MIN_ORDER_AMOUNTS 環境変数（`get_min_order_amount(pair)`）
+
+使い方:
+  engine = MultiPairEngine(exchange, fund_manager, ['BTC/JPY', 'ETH/JPY', 'XRP/JPY'])
+  engine.tick()
+"""
+
+from typing import Dict, List, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MultiPairEngine:
+    """複数ペア分の市場データを一括取得し、ペアごとに run_bot を実行する。"""
+
+    def __init__(self, exchange, fund_manager, pairs: List[str], dry_run: bool = False,
+                 min_orders: Optional[Dict[str, float]] = None, notify: bool = True, max_workers: int = 8):
+        from market_cache import CachedExchange
+        if not pairs:
+            raise ValueError("pairs must not be empty")
+        self.pairs = list(dict.fromkeys(pairs))
+        self.fund_manager = fund_manager
+        self.dry_run = bool(dry_run)
+        self.min_orders = dict(min_orders or {})
+        self.notify = bool(notify)
+        self.exchange = exchange if isinstance(exchange, CachedExchange) else CachedExchange(exchange)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pairs')
+        self.last_fetch_sec: Optional[float] = None
+
+    def _supports_fetch_tickers(self) -> bool:
+        has = getattr(self.exchange, 'has', None)
+        if isinstance(has, dict):
+            return bool(has.get('fetchTickers'))
+        return False
+
+    def prefetch(self) -> None:
+        """全ペアの ticker と板情報を 1 回の並行パスで取得し、キャッシュに載せる。
+
+        begin_tick の後に呼ぶこと。新しいティックでは前のティックの値は固定されないので、
+        ここで取り直した値がそのティック中の全ペアの判定に使われる。
+        """
+        from ninibo1127 import log_warn
+        started = time.perf_counter()
+        futures = []
+        if len(self.pairs) > 1 and self._supports_fetch_tickers():
+            futures.append(self._executor.submit(self.exchange.fetch_tickers, self.pairs))
+        else:
+            futures += [self._executor.submit(self.exchange.fetch_ticker, p) for p in self.pairs]
+        futures += [self._executor.submit(self.exchange.fetch_order_book, p) for p in self.pairs]
+        results = []
+        for fut in futures:
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                # 取れなかったペアは run_bot 側の通常の取得・エラー処理に任せる
+                log_warn(f"⚠️ 市場データ一括取得エラー: {e}")
+                results.append(None)
+        if len(self.pairs) > 1 and self._supports_fetch_tickers() and isinstance(results[0], dict):
+            for pair in self.pairs:
+                ticker = results[0].get(pair)
+                if ticker is not None:
+                    self.exchange.prime('fetch_ticker', (pair,), ticker)
+        self.last_fetch_sec = time.perf_counter() - started
+
+    def tick(self) -> Dict[str, str]:
+        """1 ティック分（全ペア）を実行し、ペアごとの結果を返す。"""
+        import ninibo1127 as bot
+        results: Dict[str, str] = {}
+        self.exchange.begin_tick(None)
+        try:
+            self.prefetch()
+            for pair in self.pairs:
+                try:
+                    results[pair] = bot.run_bot(self.exchange, self.fund_manager, self.dry_run,
+                                                notify=self.notify, pair=pair,
+                                                min_order=self.min_orders.get(pair))
+                except Exception as e:
+                    bot.log_warn(f"⚠️ {pair} の判定中にエラー: {e}", pair=pair)
+                    results[pair] = f"error: {e}"
+        finally:
+            self.exchange.end_tick()
+        return results
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def __repr__(self) -> str:
+        return f"<MultiPairEngine pairs={self.pairs} last_fetch={self.last_fetch_sec}>"
@@ -1,52 +1,11 @@
-class FundAdapter:
-    def __init__(self, fund_manager=None, initial_fund=0.0, dry_run=True):
-        self.fund = initial_fund
-
-    def add_funds(self, amount):
-        # 指定額をfundに加算
-        self.fund += amount
-        return True
-
-# --- 注文実行ユーティティ ---
-def execute_order(exchange, pair, order_type, amount, price=None):
-
-    # Place order on Bitbank (ccxt)
-    try:
-        order = None
-
-        # 本番注文のみ実行
-
-        if order_type == 'buy':
-            if price:
-                order = exchange.create_order(pair, 'limit', 'buy', amount, price)
-            else:
-                order = exchange.create_order(pair, 'market', 'buy', amount)
-            print(f"💰 買い注文: {amount:.4f} {pair.split('/')[0]} @ {price if price else '（成行）'}")
-
-        elif order_type == 'sell':
-            if price:
-                order = exchange.create_order(pair, 'limit', 'sell', amount, price)
-            else:
-                order = exchange.create_order(pair, 'market', 'sell', amount)
-            print(f"💸 売り注文: {amount:.4f} {pair.split('/')[0]} @ {price if price else '（成行）'}")
+# 区間トレース（tracing.py）。無い環境では何もしないデコレーターにする
+try:
+    from tracing import traced
+except ImportError:
+    def traced(name=None):
+        return lambda fn: fn
 
-        else:
-            print(f"無効な注文タイプです: {order_type}")
-            
-            # return None  # ← 関数外のため削除
 
-        if order and isinstance(order, dict) and 'id' in order:
-            print(f"注文成功: {order.get('id')}")
-            return order
-        else:
-            print(f"注文に失敗しました: {order}")
-            # return None  # ← 関数外のため削除
-
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print(f"❌ 注文実行中にエラーが発生しました: {e}")
-        # return None  # ← 関数外のため削除
 # --- DI対応版のエントリーポイント ---
 import os
 def run_bot_di(dry_run=False, exchange_override=None):
@@ -72,18 +31,55 @@ def run_bot_di(dry_run=False, exchange_override=None):
         exchange = connect_to_bitbank()
         if not exchange:
             return {"status": "error", "message": "取引所接続に失敗"}
+        if str(os.getenv('ASYNC_EXCHANGE', '0')).lower() in ('1', 'true', 'yes', 'on'):
+            from async_exchange import AsyncExchangeFacade
+            include_private = str(os.getenv('ASYNC_EXCHANGE_PRIVATE', '0')).lower() in ('1', 'true', 'yes', 'on')
+            exchange = AsyncExchangeFacade(exchange, include_private=include_private)
+    # 取引所 API の所要時間を記録し（キャッシュに当たらなかった呼び出しだけ）、/metrics で公開する
+    import metrics
+    exchange = metrics.instrument_from_env(exchange)
+    metrics.start_from_env()
+    # SIGUSR1 で次のティックの終わりにトレースを書き出す
+    from tracing import get_tracer
+    get_tracer().install_signal()
+    # SIGUSR2 か bot_state.profile（PROFILE_CONTROL_FILE で変更可）でサンプリングプロファイラを
+    # PROFILE_SECONDS 秒だけ動かす。STATE_FILE は資金の状態ファイルなので、その隣の bot_state.json を基準にする
+    if str(os.getenv('PROFILER', '1')).lower() in ('1', 'true', 'yes', 'on'):
+        from profiler import control_from_env
+        profiler_control = control_from_env(str(STATE_FILE.with_name('bot_state.json')))
+        profiler_control.install_signal()
+        profiler_control.start_watcher()
+    # ティック内の重複 REST 呼び出しを共有する（MARKET_CACHE=0 で無効）
+    from market_cache import wrap_from_env
+    exchange = wrap_from_env(exchange)
 
     # FundManager の準備
     initial_fund = float(os.getenv('INITIAL_FUND', '20000'))
     from pathlib import Path
-    _raw_fm = FundManager(initial_fund=initial_fund, state_file=os.getenv('FUND_STATE_FILE', 'funds_state.json'))
+    fund_state_file = os.getenv('FUND_STATE_FILE', 'funds_state.json')
+    # FUND_BACKEND=sqlite なら複数プロセス（run_once.py など）と同じ資金を安全に共有する
+    from funds import create_fund_manager
+    _raw_fm = create_fund_manager(initial_fund=initial_fund, state_file=fund_state_file)
     import time
+    pairs = get_trading_pairs()
+    if len(pairs) > 1:
+        from multi_pair import MultiPairEngine
+        engine = MultiPairEngine(exchange, _raw_fm, pairs, dry_run=dry_run)
+        run_tick = engine.tick
+    else:
+        run_tick = lambda: run_bot(exchange, _raw_fm, dry_run, pair=pairs[0])
+    # 足の確定時刻に揃えてティックを実行し、その合間は価格だけを見て利確・ナンピン水準を監視する
+    from scheduler import AlignedScheduler
+    scheduler = AlignedScheduler()
+    scheduler.add_job('tick', os.getenv('TICK_TIMEFRAME', '5m'), _timed_job('tick', run_tick),
+                      offset=_env_float('TICK_OFFSET_SEC', 2), late_policy=os.getenv('TICK_LATE_POLICY', 'skip'))
+    price_check_sec = _env_float('PRICE_CHECK_SEC', 30)
+    if price_check_sec > 0:
+        check = lambda: [quick_price_check(exchange, _raw_fm, dry_run, pair=p) for p in pairs]
+        scheduler.add_job('price_check', price_check_sec, _timed_job('price_check', check), superseded_by='tick')
     try:
-        while True:
-            result = run_bot(exchange, _raw_fm, dry_run)
-            print("5分待機します...")
-            import time
-            time.sleep(300)  # 5分ごとに判定
+        print(f"⏱️ {os.getenv('TICK_TIMEFRAME', '5m')} の区切りごとに判定します（価格チェック: {price_check_sec:g}秒ごと）")
+        scheduler.run_forever()
         # returnはループ外（通常到達しない）
         # return {"status": "success", "message": "Bot実行完了", "result": result}
     except Exception as e:
@@ -93,6 +89,7 @@ def run_bot_di(dry_run=False, exchange_override=None):
         return {"status": "error", "message": f"Bot実行中にエラー: {e}"}
     # return None  # ← 関数外のため削除
 # --- 価格取得のユーティリティ ---
+@traced()
 def get_latest_price(exchange, pair='BTC/JPY'):
     try:
         ticker = exchange.fetch_ticker(pair)
@@ -109,10 +106,12 @@ def get_latest_price(exchange, pair='BTC/JPY'):
 
 
 # --- メール通知関数の定義（未定義エラー対策） ---
-import smtplib
-from email.mime.text import MIMEText
+@traced()
 def send_notification(smtp_host, smtp_port, smtp_user, smtp_password, email_to, subject, message):
     try:
+        # smtplib / email は ssl ごと読み込むと起動が重いので、実際に送るときだけ import する
+        import smtplib
+        from email.mime.text import MIMEText
         msg = MIMEText(message)
         msg['Subject'] = subject
         msg['From'] = smtp_user
@@ -289,59 +288,75 @@ import logging
 # データ取得間隔（秒）
 interval_seconds = 300
 # --- ロギング関数の再定義 ---
-def log_debug(*args, **kwargs):
-    msg = ' '.join(str(a) for a in args)
+# メッセージは structured_logging のキューに積むだけで、整形と書き出し（JSON ファイル・標準出力）は
+# 別スレッドで行う。レベルが無効なら引数を文字列にする前に戻る（LOG_LEVEL=DEBUG で DEBUG も出る）
+try:
+    from structured_logging import setup_from_env as _setup_logging, log_file_paths as _log_file_paths
+    logger = _setup_logging('ninibo')
+    LOG_FILE_PATH = _log_file_paths.get('ninibo')
+except Exception as _e:
+    logger = logging.getLogger('ninibo')
+    LOG_FILE_PATH = None
+    print(f"⚠️ ログ設定エラー: {_e}")
+
+_PRINT_KWARGS = ('sep', 'end', 'file', 'flush')
+
+
+def _log(level, args, kwargs):
+    if not logger.isEnabledFor(level):
+        return
     try:
-        logging.getLogger().debug(msg)
+        sep = kwargs.get('sep')
+        msg = (' ' if sep is None else str(sep)).join(str(a) for a in args)
+        # print 由来の引数以外はそのまま JSON の付加フィールドにする
+        fields = {k: v for k, v in kwargs.items() if k not in _PRINT_KWARGS}
+        try:
+            logger.log(level, msg, extra=fields or None)
+        except KeyError:
+            # LogRecord の属性と同じ名前のフィールドは付けずに記録する
+            logger.log(level, msg)
     except Exception:
         pass
-    try:
-        print(msg, **kwargs)
-    except Exception:
-        print(msg)
+
+
+def log_debug(*args, **kwargs):
+    _log(logging.DEBUG, args, kwargs)
+
 
 def log_error(*args, **kwargs):
-    msg = ' '.join(str(a) for a in args)
-    try:
-        logging.getLogger().error(msg)
-    except Exception:
-        pass
-    try:
-        print(msg, **kwargs)
-    except Exception:
-        print(msg)
+    _log(logging.ERROR, args, kwargs)
+
+
 def log_info(*args, **kwargs):
-    msg = ' '.join(str(a) for a in args)
-    try:
-        logging.getLogger().info(msg)
-    except Exception:
-        pass
-    try:
-        print(msg, **kwargs)
-    except Exception:
-        print(msg)
+    _log(logging.INFO, args, kwargs)
+
 
 def log_warn(*args, **kwargs):
-    msg = ' '.join(str(a) for a in args)
-    try:
-        logging.getLogger().warning(msg)
-    except Exception:
-        pass
-    try:
-        print(msg, **kwargs)
-    except Exception:
-        print(msg)
+    _log(logging.WARNING, args, kwargs)
 
 
 # === DI対応版のエントリーポイント ===
 
 # --- 未定義グローバル変数・定数・関数のダミー定義・import ---
 import os
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass
+
+
+def _load_dotenv():
+    # python-dotenv は .env が見つかったときだけ import する（このファイルの場所から上へ探す）
+    here = os.path.dirname(os.path.abspath(__file__))
+    while not os.path.isfile(os.path.join(here, '.env')):
+        parent = os.path.dirname(here)
+        if parent == here:
+            return
+        here = parent
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(here, '.env'))
+    except ImportError:
+        pass
+
+
+_load_dotenv()
 
 # Add FileLock import for file locking
 try:
@@ -353,7 +368,10 @@ DYN_OHLCV_DAYS = 30
 DYN_THRESHOLD_BUFFER_JPY = 1000
 DYN_THRESHOLD_BUFFER_PCT = 0.01
 env_loaded = False
-DYN_THRESHOLD_RATIO = 1.0
+try:
+    DYN_THRESHOLD_RATIO = float(os.getenv('DYN_THRESHOLD_RATIO', '1.0'))
+except Exception:
+    DYN_THRESHOLD_RATIO = 1.0
 pair = 'BTC/JPY'
 days = 30
 buffer_jpy = int(os.getenv('BALANCE_BUFFER', 1000))
@@ -372,42 +390,25 @@ BREAKOUT_SMA_LONG = 25
 initial_cost = 0
 MAX_SLIPPAGE_PCT = 5.0  # スリッページ許容率（例: 5%）
 
+# --- run_bot / generate_signals の戦略パラメータ（環境変数で上書き可、sweep.py で探索） ---
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return float(default)
+
+PROFIT_TAKE_PCT = _env_float('PROFIT_TAKE_PCT', 10.0)      # 取得価格からの利確率（%）
+BUY_MORE_PCT = _env_float('BUY_MORE_PCT', 10.0)            # 前回高値からの下落率で買う（%）
+MAX_NAMPIN = int(_env_float('MAX_NAMPIN', 3))              # ナンピン回数の上限
+NAMPIN_INTERVAL = _env_float('NAMPIN_INTERVAL', 0.10)      # ナンピン間隔（通常の板）
+NAMPIN_INTERVAL_THIN = _env_float('NAMPIN_INTERVAL_THIN', 0.20)  # ナンピン間隔（薄い板）
+RSI_BUY_LEVEL = _env_float('RSI_BUY_LEVEL', 30.0)
+RSI_SELL_LEVEL = _env_float('RSI_SELL_LEVEL', 70.0)
+
 # --- STATE_FILEのグローバル定義 ---
 from pathlib import Path
 STATE_FILE = Path('funds_state.json')
 
-class FundAdapter:
-    def __init__(self, fund_manager=None, initial_fund=0.0, dry_run=True):
-        self.fund = initial_fund
-
-    def available_fund(self):
-        return self.fund
-
-    def reserve(self, amount):
-            # 注文後に1000円以上残る場合のみ許可
-            if self.fund - amount < 1000:
-                return False
-            self.fund -= amount
-            return True
-
-    def place_order(self, amount):
-        return self.reserve(amount)
-
-    def add_funds(self, amount):
-        self.fund += amount
-        return True
-
-    def reserve(self, amount):
-        # ダミー: 指定額をfundから減算
-        if amount > self.fund:
-            return False
-        self.fund -= amount
-        return True
-
-    def place_order(self, amount):
-        # reserveと同じ動作
-        return self.reserve(amount)
-
 import logging
 
 # --- ロギング関数の再定義 ---
@@ -429,43 +430,22 @@ def connect_to_bitbank():
     import ccxt
     api_key = os.getenv("API_KEY")
     secret_key = os.getenv("SECRET_KEY")
-    return ccxt.bitbank({
+    exchange = ccxt.bitbank({
         'apiKey': api_key or "",
         'secret': secret_key or "",
     })
+    # 他のプロセス（ツール類・2台目の bot）とレート制限の予算を共有する（RATE_LIMIT=0 で無効）
+    if str(os.getenv('RATE_LIMIT', '1')).lower() in ('1', 'true', 'yes', 'on'):
+        from rate_limiter import RateLimitedExchange
+        exchange = RateLimitedExchange(exchange)
+    return exchange
 
         # ...existing code...
 
 
 
-# --- メイン実行部 ---
-# run_bot_diの定義より後ろで呼び出すように修正
-if __name__ == "__main__":
-    try:
-        log_info("Bot起動中...")
-        run_bot_di()
-    except Exception as e:
-        print(f"Bot実行中にエラー: {e}")
-        # 関数外のためreturn文は削除
-
-# ccxt がインストールされていない環境でもファイルが読み込めるよう、フォールバックのスタブを用意します。
-try:
-    import ccxt  # type: ignore
-    # ...existing code...
-except Exception:
-    # 最低限のインターフェースを持つスタブ実装
-    class AuthenticationError(Exception):
-            try:
-                log_info("Bot起動中...")
-                run_bot_di()
-            except Exception as e:
-                log_error(f"Bot起動時に例外: {e}")
 # 日本標準時 (JST) のタイムゾーンオブジェクトを作成
-try:
-    pass  # ← ここに必要な処理があれば記述
-# 例外処理が不要なら except で何もしない
-except Exception:
-    JST = datetime.timezone(datetime.timedelta(hours=9))
+JST = datetime.timezone(datetime.timedelta(hours=9))
 
 # DRY_RUN時のデフォルト価格
 DRY_RUN_PRICE = 4000000.0  # 例: 400万円
@@ -484,13 +464,15 @@ class ExchangeStub:
     def fetch_ticker(self, pair):
         return {'last': self._price}
 
-    def fetch_ohlcv(self, pair, timeframe='1h', limit=250):
+    def fetch_ohlcv(self, pair, timeframe='1h', since=None, limit=250):
         # Return dummy OHLCV data for dry-run/testing
         now = int(time.time() * 1000)
         ohlcv = []
         price = self._price
         for i in range(limit):
             ts = now - (limit - i) * 60 * 60 * 1000  # 1h intervals
+            if since is not None and ts < since:
+                continue
             open_ = price
             high = price * 1.01
             low = price * 0.99
@@ -498,30 +480,6 @@ class ExchangeStub:
             volume = 0.1
             ohlcv.append([ts, open_, high, low, close, volume])
         return ohlcv
-      
-    # Dry-run adapter
-    try:
-        da = FundAdapter(fund_manager=None, initial_fund=1000.0, dry_run=True)
-        try:
-            log_info("dry initial available:", da.available_fund())
-            ok2 = da.reserve(300)
-            log_info(f"dry reserve(300) -> {ok2} available-> {da.available_fund()}")
-        except Exception:
-                    # 例外時は何もしない
-                    pass
-        try:
-            log_info("✅ bitbankにccxtで認証接続しました。")
-        except Exception:
-            pass
-
-    except Exception as e:
-        try:
-            log_error(f"❌ bitbankへの接続中にエラーが発生しました: {e}")
-        except Exception:
-            log_error(f"❌ bitbankへの接続中にエラーが発生しました: {e}")
-        # return None  # ← 関数外のため削除
-
-
 
 
 # === プライベートAPI関数群（認証必須） ===
@@ -690,52 +648,20 @@ def compute_dynamic_threshold(exchange, pair='BTC/JPY', days=DYN_OHLCV_DAYS,
                               buffer_jpy=DYN_THRESHOLD_BUFFER_JPY, buffer_pct=DYN_THRESHOLD_BUFFER_PCT):
     # Compute dynamic threshold from past OHLCV data
     try:
-        import pandas as pd
-        def get_ohlcv(exchange, pair='BTC/JPY', timeframe='1d', limit=100):
-            try:
-                raw = exchange.fetch_ohlcv(pair, timeframe=timeframe, limit=limit)
-                if not raw or len(raw) == 0:
-                    return None
-                df = pd.DataFrame(raw, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-                df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-                return df
-            except Exception as e:
-                print(f"⚠️ OHLCV取得エラー: {e}")
-                return None
-        # Define get_ohlcv if not already defined
-        def get_ohlcv(exchange, pair='BTC/JPY', timeframe='1d', limit=100):
-            try:
-                raw = exchange.fetch_ohlcv(pair, timeframe=timeframe, limit=limit)
-                if not raw or len(raw) == 0:
-                    return None
-                import pandas as pd
-                df = pd.DataFrame(raw, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-                df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-                return df
-            except Exception as e:
-                print(f"⚠️ OHLCV取得エラー: {e}")
-                return None
-
-        df = get_ohlcv(exchange, pair, timeframe='1d', limit=max(10, days + 5))
-        if df is None or len(df) == 0:
+        rows = get_ohlcv_rows(exchange, pair, timeframe='1d', limit=max(10, days + 5))
+        if not rows:
             return None, None, None
         closes = []
-        try:
-            closes = [float(v) for v in df['close'] if v is not None]
-        except Exception:
-            for i in range(len(df)):
-                try:
-                    closes.append(float(df.iloc[i]['close']))
-                except Exception:
-                    pass
+        for r in rows:
+            try:
+                closes.append(float(r[4]))
+            except Exception:
+                pass
         if not closes:
             return None, None, None
         min_close = min(closes)
         max_close = max(closes)
-        try:
-            ratio = float(os.environ.get('DYN_THRESHOLD_RATIO', DYN_THRESHOLD_RATIO))
-        except Exception:
-            ratio = float(DYN_THRESHOLD_RATIO)
+        ratio = float(DYN_THRESHOLD_RATIO)
         if ratio and float(ratio) > 0:
             threshold = float(min_close) + (float(max_close) - float(min_close)) * float(ratio)
         elif buffer_jpy and float(buffer_jpy) > 0:
@@ -751,11 +677,28 @@ def compute_dynamic_threshold(exchange, pair='BTC/JPY', days=DYN_OHLCV_DAYS,
         return None, None, None
 
 
+def _use_candle_store():
+    return str(os.getenv('OHLCV_CACHE', '1')).lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_ohlcv_rows(exchange, pair='BTC/JPY', timeframe='1d', limit=100):
+    # Return OHLCV rows ([ts, o, h, l, c, v]) served from the local candle store (delta fetch only).
+    try:
+        if _use_candle_store():
+            from candle_store import get_default_store
+            return get_default_store().get_rows(exchange, pair, timeframe=timeframe, limit=limit)
+        raw = exchange.fetch_ohlcv(pair, timeframe=timeframe, limit=limit)
+        return [list(r) for r in (raw or []) if r and len(r) >= 6]
+    except Exception as e:
+        print(f"⚠️ OHLCV取得エラー: {e}")
+        return []
+
+
 def get_ohlcv(exchange, pair='BTC/JPY', timeframe='1d', limit=100):
     # Fetch OHLCV data and return as DataFrame
     try:
         import pandas as pd
-        raw = exchange.fetch_ohlcv(pair, timeframe=timeframe, limit=limit)
+        raw = get_ohlcv_rows(exchange, pair, timeframe=timeframe, limit=limit)
         if not raw or len(raw) == 0:
             return None
         df = pd.DataFrame(raw, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
@@ -767,13 +710,13 @@ def get_ohlcv(exchange, pair='BTC/JPY', timeframe='1d', limit=100):
 
 def compute_sma_from_ohlcv(exchange, pair='BTC/JPY', days=30):
     # Calculate simple moving average (SMA) from daily OHLCV. Return None on failure.
-    df = get_ohlcv(exchange, pair, timeframe='1d', limit=max(10, days + 5))
-    if df is None or len(df) < days:
+    rows = get_ohlcv_rows(exchange, pair, timeframe='1d', limit=max(10, days + 5))
+    if not rows or len(rows) < days:
         return None
     vals = []
     try:
-        for i in range(-days, 0):
-            vals.append(float(df['close'].iloc[i]))
+        for r in rows[-days:]:
+            vals.append(float(r[4]))
     except Exception:
         pass
     return sum(vals) / len(vals) if vals else None
@@ -781,11 +724,11 @@ def compute_sma_from_ohlcv(exchange, pair='BTC/JPY', days=30):
 
 def get_recent_high(exchange, pair='BTC/JPY', days=30):
     # Return max high value in last N days. Return None on failure.
-    df = get_ohlcv(exchange, pair, timeframe='1d', limit=max(10, days + 5))
-    if df is None or len(df) == 0:
+    rows = get_ohlcv_rows(exchange, pair, timeframe='1d', limit=max(10, days + 5))
+    if not rows:
         return None
     try:
-        highs = [float(v) for v in df['high'] if v is not None]
+        highs = [float(r[2]) for r in rows if r[2] is not None]
     except Exception:
         highs = []
     return max(highs) if highs else None
@@ -816,10 +759,12 @@ def compute_atr(ohlcv_rows, period=14):
             return None
         # If it's a DataFrame-like object
         if hasattr(ohlcv_rows, 'iloc'):
-            for i in range(len(ohlcv_rows)):
+            # 列単位で取り出す（.iloc で 1 行ずつ Series を作ると非常に遅い）
+            cols = zip(ohlcv_rows['open'].tolist(), ohlcv_rows['high'].tolist(),
+                       ohlcv_rows['low'].tolist(), ohlcv_rows['close'].tolist())
+            for o, h, l, c in cols:
                 try:
-                    row = ohlcv_rows.iloc[i]
-                    rows.append((float(row['open']), float(row['high']), float(row['low']), float(row['close'])))
+                    rows.append((float(o), float(h), float(l), float(c)))
                 except Exception:
                     pass
         else:
@@ -860,22 +805,11 @@ def compute_rsi(values, period=14, exchange=None, pair='BTC/JPY', days=30):
         if len(vals) < period + 1:
             return None
         if exchange is not None:
-            df = get_ohlcv(exchange, pair, timeframe='1d', limit=max(10, days + 5))
-            if df is None or len(df) == 0:
+            rows = get_ohlcv_rows(exchange, pair, timeframe='1d', limit=max(10, days + 5))
+            if not rows:
                 return None, None, None
-            closes = []
-            try:
-                closes = [float(v) for v in df['close'] if v is not None]
-            except Exception:
-                for i in range(len(df)):
-                    try:
-                        closes.append(float(df.iloc[i]['close']))
-                    except Exception:
-                        pass
-            try:
-                ratio = float(os.environ.get('DYN_THRESHOLD_RATIO', DYN_THRESHOLD_RATIO))
-            except Exception:
-                ratio = float(DYN_THRESHOLD_RATIO)
+            closes = [float(r[4]) for r in rows if r[4] is not None]
+            ratio = float(DYN_THRESHOLD_RATIO)
             buffer_jpy = float(os.environ.get('DYN_THRESHOLD_BUFFER_JPY', DYN_THRESHOLD_BUFFER_JPY))
             buffer_pct = float(os.environ.get('DYN_THRESHOLD_BUFFER_PCT', DYN_THRESHOLD_BUFFER_PCT))
             min_close = min(closes)
@@ -932,30 +866,13 @@ def get_recent_trades(exchange, pair='BTC/JPY', limit=100):
 
 
 def analyze_orderbook_pressure(orderbook_data):
-    # Analyze buy/sell pressure from order book.
+    # Analyze buy/sell pressure from order book (an OrderBook or a ccxt order book dict).
     try:
-        bids = orderbook_data.get('bids', [])
-        asks = orderbook_data.get('asks', [])
-        
-        buy_volume = sum(float(bid[1]) for bid in bids if len(bid) >= 2)
-        sell_volume = sum(float(ask[1]) for ask in asks if len(ask) >= 2)
-        
-        ratio = None
-        signal = 'NEUTRAL'
-        
-        if sell_volume > 0:
-            ratio = buy_volume / sell_volume
-            if ratio > 1.2:
-                signal = 'BULLISH'  # 買い圧力が強い
-            elif ratio < 0.8:
-                signal = 'BEARISH'  # 売り圧力が強い
-        
-        return {
-            'buy_pressure': buy_volume,
-            'sell_pressure': sell_volume,
-            'pressure_ratio': ratio,
-            'signal': signal
-        }
+        from orderbook import OrderBook
+        if isinstance(orderbook_data, OrderBook):
+            return orderbook_data.pressure()
+        # run_bot が同じティックで集計済みならその結果を使う
+        return OrderBook.shared(orderbook_data).pressure()
     except Exception:
         return {
             'buy_pressure': 0,
@@ -965,11 +882,32 @@ def analyze_orderbook_pressure(orderbook_data):
         }
 
 
+_indicator_engines = {}
+
+
+def _get_indicator_engine(pair, timeframe):
+    # One streaming engine per pair/timeframe, restored from its snapshot on first use.
+    key = (pair, timeframe)
+    engine = _indicator_engines.get(key)
+    if engine is None:
+        from streaming_indicators import IndicatorEngine
+        state_dir = Path(os.getenv('INDICATOR_STATE_DIR', 'indicator_state'))
+        name = pair.replace('/', '_').replace(':', '_')
+        engine = IndicatorEngine(state_file=str(state_dir / f"{name}_{timeframe}.json"))
+        _indicator_engines[key] = engine
+    return engine
+
+
 def compute_indicators(exchange, pair='BTC/JPY', timeframe='1h', limit=1000):
     # Fetch OHLCV and compute a set of indicators. Returns dict of values (may contain None).
     try:
-        # OHLCVデータ取得（ダミー実装）
-        raw = []
+        raw = get_ohlcv_rows(exchange, pair, timeframe=timeframe, limit=limit)
+        if str(os.getenv('STREAMING_INDICATORS', '1')).lower() in ('1', 'true', 'yes', 'on'):
+            # 新しい足だけを O(1) で取り込む（スナップショットは足が確定したときのみ保存）
+            engine = _get_indicator_engine(pair, timeframe)
+            if engine.feed(raw) > 0:
+                engine.save()
+            return engine.values()
         indicators = {}
         # prepare lists
         closes = [float(r[4]) for r in raw if r and len(r) >= 5 and r[4] is not None]
@@ -982,7 +920,7 @@ def compute_indicators(exchange, pair='BTC/JPY', timeframe='1h', limit=1000):
         indicators['ema_12'] = compute_ema(closes, 12)
         indicators['ema_26'] = compute_ema(closes, 26)
         indicators['atr_14'] = compute_atr(raw, period=14)
-        indicators['rsi_14'] = compute_rsi(closes, period=14, exchange=exchange, pair=pair)
+        indicators['rsi_14'] = compute_rsi(closes, period=14)
         # recent high over 20 periods
         try:
             indicators['recent_high_20'] = max(highs[-20:]) if highs and len(highs) >= 1 else None
@@ -1009,29 +947,33 @@ def compute_sma_from_list(values, period):
     return sum(values[-period:]) / period
 
 
-def write_indicators_csv(indicators: dict, pair: str, signal: str = 'NONE', csv_path='indicators.csv'):
-    # Append indicators as a CSV row. Creates header if file does not exist.
+_indicator_sinks = {}
+
+
+def _get_indicator_sink(csv_path=None):
+    # One buffered sink per CSV target; rows go to day-partitioned columnar files under INDICATORS_DIR.
+    sink = _indicator_sinks.get(csv_path)
+    if sink is None:
+        from indicator_sink import IndicatorSink
+        sink = IndicatorSink(
+            base_dir=os.getenv('INDICATORS_DIR', 'indicators'),
+            flush_rows=int(os.getenv('INDICATORS_FLUSH_ROWS', '500')),
+            flush_sec=float(os.getenv('INDICATORS_FLUSH_SEC', '300')),
+            csv_path=csv_path,
+            retention_days=int(os.getenv('INDICATORS_RETENTION_DAYS', '0')),
+            tz=JST,
+        )
+        _indicator_sinks[csv_path] = sink
+    return sink
+
+
+def write_indicators_csv(indicators: dict, pair: str, signal: str = 'NONE', csv_path=None):
+    # Buffer one indicators row; it is written in batches (see indicator_sink.py).
+    # The CSV copy is optional: csv_path, or INDICATORS_CSV (empty = columnar files only).
     try:
-        import csv
-        file_exists = os.path.exists(csv_path)
-        with open(csv_path, 'a', newline='', encoding='utf-8') as fh:
-            writer = csv.writer(fh)
-            if not file_exists:
-                writer.writerow(['timestamp', 'pair', 'price', 'sma_short_50', 'sma_long_200', 'ema_12', 'ema_26', 'atr_14', 'rsi_14', 'recent_high_20', 'signal'])
-            ts = datetime.datetime.now(JST).isoformat()
-            writer.writerow([
-                ts,
-                pair,
-                indicators.get('latest_close'),
-                indicators.get('sma_short_50'),
-                indicators.get('sma_long_200'),
-                indicators.get('ema_12'),
-                indicators.get('ema_26'),
-                indicators.get('atr_14'),
-                indicators.get('rsi_14'),
-                indicators.get('recent_high_20'),
-                signal
-            ])
+        if csv_path is None:
+            csv_path = os.getenv('INDICATORS_CSV', '') or None
+        _get_indicator_sink(csv_path).append(indicators, pair, signal)
     except Exception:
         # never raise from logging function
         pass
@@ -1049,10 +991,8 @@ def round_down_qty(qty: float, step: float) -> float:
     return math.floor(qty * factor) / factor
 
 
-def compute_qty_for_budget_with_fee(reserved_jpy: float, price_jpy: float,
-                                    min_btc: float = 0.0001, step: float = 0.0001,
-                                    available_jpy: float = 0.0, balance_buffer: float = 0.0):
-    # Return (qty, cost_jpy, fee_jpy) for given budget and price.
+def get_fee_params():
+    # Return (fee_rate, fee_fixed_jpy) from FEE_RATE / FEE_FIXED_JPY.
     try:
         fee_rate = float(os.getenv('FEE_RATE', '0.001'))
     except Exception:
@@ -1061,6 +1001,20 @@ def compute_qty_for_budget_with_fee(reserved_jpy: float, price_jpy: float,
         fee_fixed = float(os.getenv('FEE_FIXED_JPY', '0.0'))
     except Exception:
         fee_fixed = 0.0
+    return fee_rate, fee_fixed
+
+
+def compute_fee_jpy(cost_jpy: float) -> float:
+    # Fee for a fill of cost_jpy, same model as compute_qty_for_budget_with_fee.
+    fee_rate, fee_fixed = get_fee_params()
+    return float(cost_jpy) * fee_rate + fee_fixed
+
+
+def compute_qty_for_budget_with_fee(reserved_jpy: float, price_jpy: float,
+                                    min_btc: float = 0.0001, step: float = 0.0001,
+                                    available_jpy: float = 0.0, balance_buffer: float = 0.0):
+    # Return (qty, cost_jpy, fee_jpy) for given budget and price.
+    fee_rate, fee_fixed = get_fee_params()
 
     if price_jpy <= 0 or reserved_jpy <= 0:
         return 0.0, 0.0, 0.0
@@ -1097,7 +1051,7 @@ def compute_qty_for_budget_with_fee(reserved_jpy: float, price_jpy: float,
 
     # コストと手数料を計算
     cost_jpy = qty * price_jpy
-    fee_jpy = cost_jpy * fee_rate + fee_fixed
+    fee_jpy = compute_fee_jpy(cost_jpy)
     return qty, cost_jpy, fee_jpy
 
 
@@ -1111,14 +1065,40 @@ def load_state():
     return {}
 
 
+_last_saved_state = {}
+
+
+def _write_save_marker(info):
+    # The .last_save_ok forensic marker costs an extra file write per save; opt in with SAVE_STATE_MARKER=1
+    if str(os.getenv('SAVE_STATE_MARKER', '0')).lower() not in ('1', 'true', 'yes', 'on'):
+        return
+    try:
+        ok_marker = STATE_FILE.with_name(STATE_FILE.name + '.last_save_ok')
+        ok_marker.write_text(json.dumps(info, ensure_ascii=False), encoding='utf-8')
+    except Exception:
+        pass
+
+
+@traced()
 def save_state(state):
     try:
+        from metrics import timed
+    except ImportError:
+        return _write_state(state)
+    with timed('persist_write_duration_seconds', store='bot_state'):
+        return _write_state(state)
+
+
+def _write_state(state):
+    try:
+        jtxt = json.dumps(state, ensure_ascii=False, indent=2)
+        # Skip the rewrite when nothing changed since the last successful save
+        if _last_saved_state.get(str(STATE_FILE)) == jtxt and STATE_FILE.exists():
+            return
         # Write atomically: write to a temp file then replace to avoid partial writes
         tmp_path = STATE_FILE.with_name(STATE_FILE.name + '.tmp')
         # Use an explicit open+flush+fsync to reduce chance of OS-level caching/AV interference
         try:
-            import io
-            jtxt = json.dumps(state, ensure_ascii=False, indent=2)
             with open(str(tmp_path), 'w', encoding='utf-8') as fh:
                 fh.write(jtxt)
                 fh.flush()
@@ -1130,17 +1110,11 @@ def save_state(state):
         except Exception as e_write_tmp:
             # If writing tmp file failed, attempt direct write and log error
             try:
-                STATE_FILE.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding='utf-8')
-                try:
-                    print(f"DEBUG: save_state direct write fallback succeeded for {STATE_FILE}")
-                except Exception:
-                    pass
+                STATE_FILE.write_text(jtxt, encoding='utf-8')
+                _last_saved_state[str(STATE_FILE)] = jtxt
+                log_debug(f"DEBUG: save_state direct write fallback succeeded for {STATE_FILE}")
                 # write a small success marker for forensic checks
-                try:
-                    ok_marker = STATE_FILE.with_name(STATE_FILE.name + '.last_save_ok')
-                    ok_marker.write_text(json.dumps({'time': int(time.time()), 'method': 'direct_fallback'}), encoding='utf-8')
-                except Exception:
-                    pass
+                _write_save_marker({'time': int(time.time()), 'method': 'direct_fallback'})
                 return
             except Exception as e_direct:
                 # log both failures
@@ -1157,27 +1131,20 @@ def save_state(state):
         try:
             # atomic replace where possible
             os.replace(str(tmp_path), str(STATE_FILE))
+            _last_saved_state[str(STATE_FILE)] = jtxt
             # After successful replace, create a tiny marker file for forensic verification
+            _write_save_marker({'time': int(time.time()), 'size': len(jtxt), 'path': str(STATE_FILE)})
             try:
-                ok_marker = STATE_FILE.with_name(STATE_FILE.name + '.last_save_ok')
-                info = {'time': int(time.time()), 'size': STATE_FILE.stat().st_size, 'path': str(STATE_FILE)}
-                ok_marker.write_text(json.dumps(info, ensure_ascii=False), encoding='utf-8')
-            except Exception:
-                    pass
-            try:
-                log_debug(f"DEBUG: save_state succeeded and replaced {STATE_FILE} (size={STATE_FILE.stat().st_size})")
+                log_debug(f"DEBUG: save_state succeeded and replaced {STATE_FILE} (size={len(jtxt)})")
             except Exception:
                     pass
             return
         except Exception as e_replace:
             # fallback to non-atomic write
             try:
-                STATE_FILE.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
-                try:
-                    ok_marker = STATE_FILE.with_name(STATE_FILE.name + '.last_save_ok')
-                    ok_marker.write_text(json.dumps({'time': int(time.time()), 'method': 'non_atomic_replace'}), encoding='utf-8')
-                except Exception:
-                    pass
+                STATE_FILE.write_text(jtxt, encoding="utf-8")
+                _last_saved_state[str(STATE_FILE)] = jtxt
+                _write_save_marker({'time': int(time.time()), 'method': 'non_atomic_replace'})
                 try:
                     log_debug(f"DEBUG: save_state fallback non-atomic write succeeded for {STATE_FILE}")
                 except Exception:
@@ -1223,23 +1190,28 @@ def set_last_buy_time(state, ts=None):
 
 
 def record_position(state, side, price, qty):
-    print("DEBUG: record_position called", side, price, qty)
-    state.setdefault("positions", [])
-    state["positions"].append({
+    log_debug("DEBUG: record_position called", side, price, qty)
+    entry = {
         "side": side,
         "price": float(price),
         "qty": float(qty),
-        "time": int(time())
-    })
+        "time": int(time.time())
+    }
+    # Full audit trail: one fsynced line per fill, never truncated
+    try:
+        from position_journal import append_jsonl
+        append_jsonl(STATE_FILE.with_name(STATE_FILE.stem + '.trades.jsonl'), entry)
+    except Exception as e:
+        log_warn("WARN: could not append trade journal:", e)
+    state.setdefault("positions", [])
+    state["positions"].append(entry)
+    # state keeps only the most recent entries; the journal above has the full history
     if len(state["positions"]) > 50:
         state["positions"] = state["positions"][-50:]
-    print(f"DEBUG: record_position saving state with positions={state['positions']}")
     save_state(state)
-    print("DEBUG: record_position finished")
 
 
 def is_slippage_too_large(reference_price, latest_price):
-    print("DEBUG: save_state called")
     try:
         if reference_price is None or latest_price is None:
             return False
@@ -1288,13 +1260,13 @@ def generate_signals(df):
     message = None
 
     # RSIによる売買判定
-    if latest_data['rsi'] <= 30:
+    if latest_data['rsi'] <= RSI_BUY_LEVEL:
         signal = 'buy_entry'
-        message = f"✅ RSI買いシグナル: RSI={latest_data['rsi']:.2f} (30以下)"
+        message = f"✅ RSI買いシグナル: RSI={latest_data['rsi']:.2f} ({RSI_BUY_LEVEL:g}以下)"
         return signal, message
-    elif latest_data['rsi'] >= 70:
+    elif latest_data['rsi'] >= RSI_SELL_LEVEL:
         signal = 'sell_all'
-        message = f"❌ RSI売りシグナル: RSI={latest_data['rsi']:.2f} (70以上)"
+        message = f"❌ RSI売りシグナル: RSI={latest_data['rsi']:.2f} ({RSI_SELL_LEVEL:g}以上)"
         return signal, message
 
     # 従来のトレンドフィルターも残す
@@ -1321,20 +1293,14 @@ def generate_signals(df):
 def log_order(action, pair, amount, price=None):
     # Format order log message
     msg = f"{action}注文: {amount:.4f} {pair.split('/')[0]} {'@ ' + str(price) if price else '（成行）'}"
-    try:
-        logging.getLogger().info(msg)
-    except Exception:
-        pass
-    try:
-        print(msg)
-    except Exception:
-        print(msg)
+    log_info(msg, action=action, pair=pair, amount=amount, price=price)
     return msg
 
 # === 5. 注文の実行 ===
 
 
 # --- 注文実行ユーティリティ ---
+@traced()
 def execute_order(exchange, pair, order_type, amount, price=None):
     # Place order on Bitbank (ccxt)
     try:
@@ -1414,10 +1380,7 @@ def _ensure_fund_manager_has_funds(fm, initial_amount=None):
         return
 
     # DEBUG: run_bot entry
-    try:
-        log_debug(f"DEBUG: run_bot start - DRY_RUN={DRY_RUN}, pair={pair}")
-    except Exception:
-        log_debug("DEBUG: run_bot start (print failed)")
+    log_debug("DEBUG: run_bot start -", f"DRY_RUN={DRY_RUN},", f"pair={pair}")
 
     # 実行時チェック: 必要な環境変数は dry_run のときは緩和する
     env_dry_run = os.getenv("DRY_RUN", "").lower() in ["1", "true", "yes", "on"]
@@ -1438,166 +1401,295 @@ def _ensure_fund_manager_has_funds(fm, initial_amount=None):
 
 # ...existing code...
 
-def run_bot(exchange, fund_manager, dry_run=False):
-    # 板情報取得
-    try:
-        orderbook = exchange.fetch_order_book('BTC/JPY')
-        bids = orderbook.get('bids', [])
-        asks = orderbook.get('asks', [])
-        current_price = get_latest_price(exchange, 'BTC/JPY')
-        # 厚い買い板・売り板判定
-        bids_near = [bid for bid in bids if abs(bid[0] - current_price) < current_price * 0.01]
-        asks_near = [ask for ask in asks if abs(ask[0] - current_price) < current_price * 0.01]
-        avg_bid_size = sum([b[1] for b in bids_near]) / len(bids_near) if bids_near else 0
-        avg_ask_size = sum([a[1] for a in asks_near]) / len(asks_near) if asks_near else 0
-        # 買い板が厚い場合（平均の2倍以上）
-        if bids_near and any(b[1] > avg_bid_size * 2 for b in bids_near):
-            try:
-                smtp_host = os.getenv('SMTP_HOST')
-                smtp_port = int(os.getenv('SMTP_PORT', '587'))
-                smtp_user = os.getenv('SMTP_USER')
-                smtp_password = os.getenv('SMTP_PASS')
-                email_to = os.getenv('TO_EMAIL')
-                if smtp_host and email_to:
-                    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    subject = f"厚い買い板付近:資金投入推奨 {now}"
-                    message = f"【板情報】\n時刻: {now}\n現在価格: {current_price} 円\n厚い買い板付近です。資金投入を推奨します。"
-                    send_notification(smtp_host, smtp_port, smtp_user, smtp_password, email_to, subject, message)
-            except Exception as e:
-                print(f"⚠️ 板資金投入通知メール送信エラー: {e}")
-        # 売り板が厚い場合（平均の2倍以上）
-        if asks_near and any(a[1] > avg_ask_size * 2 for a in asks_near):
-            thick_ask_price = max([a[0] for a in asks_near if a[1] > avg_ask_size * 2])
-            custom_take_profit = thick_ask_price
-        else:
-            custom_take_profit = None
-        # 板が薄い場合（買い板・売り板とも平均の半分以下）
-        if (avg_bid_size < 0.5 * (sum([b[1] for b in bids]) / len(bids) if bids else 1)) and (avg_ask_size < 0.5 * (sum([a[1] for a in asks]) / len(asks) if asks else 1)):
-            nampin_interval = 0.20
-        else:
-            nampin_interval = 0.10
-    except Exception as e:
-        print(f"⚠️ 板情報取得・判定エラー: {e}")
-        custom_take_profit = None
-        nampin_interval = 0.10
+def _timed_job(name, fn):
+    # Record each scheduler job run in tick_duration_seconds{job=...} and stamp the last finished tick.
+    # The run is also the root span of a trace, exported when it exceeds TRACE_SLOW_TICK_SEC.
+    import metrics
+    from tracing import get_tracer
+    hist = metrics.REGISTRY.histogram('tick_duration_seconds')
+    last = metrics.REGISTRY.gauge('last_tick_timestamp_seconds')
+    tracer = get_tracer()
+
+    def run():
+        with hist.time(job=name), tracer.tick(name):
+            result = fn()
+        last.set(time.time(), job=name)
+        return result
+    return run
 
-    PAIR = 'BTC/JPY'
-    PROFIT_TAKE_PCT = 10.0
-    BUY_MORE_PCT = 10.0
-    MIN_ORDER_BTC = 0.001
 
-    import json
-    import time
-    positions_file = os.getenv('POSITIONS_FILE', 'positions_state.json')
-    # ポジション情報の読み込み
-    if os.path.exists(positions_file):
+def _notify_trade(subject, message, dedup_key=None, digest=False):
+    # Send a trade/board notification using the SMTP_* / TO_EMAIL settings (no-op if unset).
+    # By default the mail is queued to the background notifier so a slow SMTP server never delays an order.
+    if str(os.getenv('NOTIFY_ASYNC', '1')).lower() in ('1', 'true', 'yes', 'on'):
         try:
-            with open(positions_file, 'r', encoding='utf-8') as f:
-                positions = json.load(f)
-        except Exception:
-            positions = []
-    else:
-        positions = []
+            from notifier import get_notifier
+            notifier = get_notifier()
+            if notifier is not None:
+                notifier.notify(subject, message, dedup_key=dedup_key, digest=digest)
+            return
+        except Exception as e:
+            log_warn(f"⚠️ 通知キューエラー（同期送信します）: {e}")
+    smtp_host = os.getenv('SMTP_HOST')
+    smtp_port = int(os.getenv('SMTP_PORT', '587'))
+    smtp_user = os.getenv('SMTP_USER')
+    smtp_password = os.getenv('SMTP_PASS')
+    email_to = os.getenv('TO_EMAIL')
+    if smtp_host and email_to:
+        started = time.perf_counter()
+        send_notification(smtp_host, smtp_port, smtp_user, smtp_password, email_to, subject, message)
+        try:
+            from metrics import observe
+            observe('notification_send_duration_seconds', time.perf_counter() - started, kind='sync', outcome='ok')
+        except ImportError:
+            pass
 
-    # 初回買いも「前回高値の10%下でのみ買う」
-    current_price = get_latest_price(exchange, PAIR)
-    if positions:
-        prev_high = max([float(pos['price']) for pos in positions])
-    else:
-        prev_high = current_price
-
-    buy_threshold = prev_high * 0.9
-    buy_cost = current_price * MIN_ORDER_BTC
-
-    # --- ここから下の fund_manager, exchange のグローバル初期化・run_bot呼び出しは削除してください ---
-
-    if not positions and current_price <= buy_threshold and fund_manager.available_fund() - buy_cost >= 1000:
-        if fund_manager.place_order(buy_cost):
-            execute_order(exchange, PAIR, 'buy', MIN_ORDER_BTC, current_price)
-            positions.append({'price': current_price, 'amount': MIN_ORDER_BTC, 'timestamp': time.time()})
-            print(f"新規買い: {current_price}円で{MIN_ORDER_BTC}BTC（10%下落条件・残高1000円以上キープ）")
-
-    # 利確判定とナンピン判定
-    current_price = get_latest_price(exchange, PAIR)
-    updated_positions = positions[:]
-    MAX_NAMPIN = 3
-    for pos in positions:
-        buy_price = pos['price']
-        amount = pos['amount']
-        nampin_count = pos.get('nampin_count', 0)
-        take_profit_price = custom_take_profit if custom_take_profit else buy_price * 1.10
-        if current_price >= take_profit_price:
-            order = execute_order(exchange, PAIR, 'sell', amount)
-            fund_manager.add_funds(current_price * amount)
-            updated_positions.remove(pos)
+
+def get_trading_pairs():
+    # TRADING_PAIRS="BTC/JPY,ETH/JPY,XRP/JPY"（未設定なら BTC/JPY のみ）
+    pairs = [p.strip() for p in os.getenv('TRADING_PAIRS', 'BTC/JPY').split(',') if p.strip()]
+    return pairs or ['BTC/JPY']
+
+
+def get_min_order_amount(pair):
+    # MIN_ORDER_AMOUNTS="ETH/JPY=0.01,XRP/JPY=10" でペアごとの注文数量を指定（既定 0.001）
+    for part in os.getenv('MIN_ORDER_AMOUNTS', '').split(','):
+        if '=' not in part:
+            continue
+        name, value = part.split('=', 1)
+        if name.strip() == pair:
             try:
-                smtp_host = os.getenv('SMTP_HOST')
-                smtp_port = int(os.getenv('SMTP_PORT', '587'))
-                smtp_user = os.getenv('SMTP_USER')
-                smtp_password = os.getenv('SMTP_PASS')
-                email_to = os.getenv('TO_EMAIL')
-                if smtp_host and email_to:
-                    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    subject = f"BTC売却通知 {now}"
-                    message = f"【BTC売却】\n時刻: {now}\n数量: {amount} BTC\n価格: {current_price} 円\n取得価格: {buy_price} 円"
-                    send_notification(smtp_host, smtp_port, smtp_user, smtp_password, email_to, subject, message)
-            except Exception as e:
-                print(f"⚠️ 売却通知メール送信エラー: {e}")
-        elif nampin_count < MAX_NAMPIN and current_price <= buy_price * (1 - nampin_interval * (nampin_count + 1)):
-            add_cost = current_price * amount
-            if fund_manager.available_fund() - add_cost >= 1000:
-                if fund_manager.place_order(add_cost):
-                    order = execute_order(exchange, PAIR, 'buy', amount, current_price)
-                    updated_positions.append({'price': current_price, 'amount': amount, 'timestamp': time.time(), 'nampin_count': nampin_count + 1})
-                    try:
-                        smtp_host = os.getenv('SMTP_HOST')
-                        smtp_port = int(os.getenv('SMTP_PORT', '587'))
-                        smtp_user = os.getenv('SMTP_USER')
-                        smtp_password = os.getenv('SMTP_PASS')
-                        email_to = os.getenv('TO_EMAIL')
-                        if smtp_host and email_to:
-                            now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            subject = f"BTCナンピン購入通知 {now}"
-                            message = f"【BTCナンピン購入】\n時刻: {now}\n数量: {amount} BTC\n価格: {current_price} 円\nナンピン回数: {nampin_count + 1}回"
-                            send_notification(smtp_host, smtp_port, smtp_user, smtp_password, email_to, subject, message)
-                    except Exception as e:
-                        print(f"⚠️ ナンピン購入通知メール送信エラー: {e}")
-
-    # ポジションが空のときだけ買い判定
-    if not updated_positions:
-        prev_high = max([float(pos['price']) for pos in positions]) if positions else current_price
-        buy_threshold = prev_high * 0.9
-        buy_cost = current_price * MIN_ORDER_BTC
-        if current_price <= buy_threshold and fund_manager.available_fund() - buy_cost >= 1000:
-            if fund_manager.place_order(buy_cost):
-                order = execute_order(exchange, PAIR, 'buy', MIN_ORDER_BTC, current_price)
-                updated_positions.append({'price': current_price, 'amount': MIN_ORDER_BTC, 'timestamp': time.time()})
-                try:
-                    smtp_host = os.getenv('SMTP_HOST')
-                    smtp_port = int(os.getenv('SMTP_PORT', '587'))
-                    smtp_user = os.getenv('SMTP_USER')
-                    smtp_password = os.getenv('SMTP_PASS')
-                    email_to = os.getenv('TO_EMAIL')
-                    if smtp_host and email_to:
-                        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        subject = f"BTC購入通知 {now}"
-                        message = f"【BTC購入】\n時刻: {now}\n数量: {MIN_ORDER_BTC} BTC\n価格: {current_price} 円"
-                        send_notification(smtp_host, smtp_port, smtp_user, smtp_password, email_to, subject, message)
-                except Exception as e:
-                    print(f"⚠️ 購入通知メール送信エラー: {e}")
+                return float(value)
+            except ValueError:
+                break
+    return 0.001
+
+
+def positions_file_for(pair):
+    # BTC/JPY は従来どおり POSITIONS_FILE（positions_state.json）、他のペアは接尾辞付きのファイル
+    base_file = os.getenv('POSITIONS_FILE', 'positions_state.json')
+    if pair == 'BTC/JPY':
+        return base_file
+    root, ext = os.path.splitext(base_file)
+    return f"{root}_{pair.replace('/', '_').replace(':', '_')}{ext or '.json'}"
+
+
+def _record_sale(fund_manager, proceeds, order, pnl):
+    # Pass the exchange order id through when the fund manager keeps a ledger
+    ledger = getattr(fund_manager, 'ledger', None)
+    order_id = order.get('id') if isinstance(order, dict) else None
+    if ledger is None:
+        fund_manager.add_funds(proceeds)
+        return
+    fund_manager.add_funds(proceeds, order_id=order_id)
+    fund_manager.record_realized_pnl(pnl, order_id=order_id)
+
+
+# pair -> (custom_take_profit, nampin_interval) as decided by the last full tick
+_tick_levels = {}
+_trigger_indexes = {}
+
 
-    # ポジション情報の保存
+@traced()
+def quick_price_check(exchange, fund_manager, dry_run=False, pair='BTC/JPY'):
+    """
+    ティックの合間の軽い確認: ticker だけを取得し、保有ポジションの利確・ナンピン水準を
+    価格が通過したときだけ run_bot の判定を実行する。水準は直前のティックの板判定
+    （厚い売り板の利確価格・薄い板のナンピン間隔）を使い、TriggerIndex で O(log n) で調べる。
+    """
     try:
-        with open(positions_file, 'w', encoding='utf-8') as f:
-            json.dump(updated_positions, f, ensure_ascii=False, indent=2)
+        from triggers import TriggerIndex
+        journal = _get_position_journal(positions_file_for(pair))
+        index = _trigger_indexes.get(pair)
+        if index is None:
+            index = _trigger_indexes[pair] = TriggerIndex()
+        custom_take_profit, nampin_interval = _tick_levels.get(pair, (None, NAMPIN_INTERVAL))
+        version = (journal.seq, custom_take_profit, nampin_interval, PROFIT_TAKE_PCT, MAX_NAMPIN)
+        if index.version != version:
+            index.rebuild(journal.positions(), PROFIT_TAKE_PCT, nampin_interval, MAX_NAMPIN,
+                          custom_take_profit=custom_take_profit, version=version)
+        if not len(index):
+            return None
+        price = get_latest_price(exchange, pair)
+        if price is None:
+            return None
+        hits = index.crossed(price)
+        if hits:
+            kind, _, level = hits[0]
+            log_info(f"⚡ {pair} 価格 {price} が{'利確' if kind == 'take_profit' else 'ナンピン'}水準 {level:.0f} を通過したため判定を実行します")
+            return run_bot(exchange, fund_manager, dry_run, pair=pair)
     except Exception as e:
-        print(f"ポジション保存エラー: {e}")
+        log_warn(f"⚠️ 価格チェックエラー: {e}")
+    return None
 
-    return "run_bot executed"
 
-# ...existing code...
+_position_journals = {}
+
+
+def _get_position_journal(positions_file):
+    # One journal per positions file, kept in memory between ticks.
+    key = os.path.abspath(positions_file)
+    journal = _position_journals.get(key)
+    if journal is None:
+        from position_journal import PositionJournal
+        fsync = str(os.getenv('POSITIONS_FSYNC', '1')).lower() in ('1', 'true', 'yes', 'on')
+        journal = PositionJournal(positions_file, compact_every=int(_env_float('POSITIONS_COMPACT_EVERY', 200)),
+                                  fsync=fsync)
+        _position_journals[key] = journal
+    else:
+        journal.refresh()
+    return journal
 
 
+def forget_position_journal(positions_file):
+    # Drop the cached journal (e.g. after a backtest whose work directory is deleted).
+    return _position_journals.pop(os.path.abspath(positions_file), None)
 
 
+@traced()
+def run_bot(exchange, fund_manager, dry_run=False, positions_file=None, clock=None, notify=True,
+            pair='BTC/JPY', min_order=None):
+    """
+    1ティック分の売買判定を行う。
+    Args:
+        positions_file: ポジション保存先（None の場合は positions_file_for(pair)）
+        clock: 現在時刻（epoch 秒）を返す関数。バックテストでは模擬時計を渡す
+        notify: False の場合はメール通知を行わない
+        pair: 取引ペア（例: 'BTC/JPY', 'ETH/JPY'）
+        min_order: 1回の注文数量（None の場合は MIN_ORDER_AMOUNTS 環境変数、無ければ 0.001）
+    """
+    PAIR = pair
+    BASE = pair.split('/')[0]
+    ORDER_AMOUNT = float(min_order) if min_order else get_min_order_amount(pair)
+    now_ts = clock() if clock else time.time()
+    # 並行取得に対応した取引所（AsyncExchangeFacade など）はティック開始時にまとめて取得
+    begin_tick = getattr(exchange, 'begin_tick', None)
+    if callable(begin_tick):
+        try:
+            begin_tick(PAIR)
+        except Exception as e:
+            log_warn(f"⚠️ 市場スナップショット取得エラー: {e}")
+    # 途中で例外が出ても end_tick() で固定（pin）を外す。外さないと以後のティックが古い価格を見続ける
+    try:
+        # 板情報取得
+        try:
+            orderbook = exchange.fetch_order_book(PAIR)
+            current_price = get_latest_price(exchange, PAIR)
+            # 厚い買い板・売り板・薄い板の判定は OrderBook が 1 回の集計でまとめて行う
+            from orderbook import OrderBook
+            book = OrderBook.shared(orderbook, current_price)
+            # 買い板が厚い場合（平均の2倍以上）
+            if notify and book.has_thick_bid:
+                try:
+                    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    subject = f"厚い買い板付近:資金投入推奨 {PAIR} {now}"
+                    message = f"【板情報】\n時刻: {now}\n現在価格: {current_price} 円\n厚い買い板付近です。資金投入を推奨します。"
+                    # 厚い板は毎ティック続くことが多いので、同じペアの通知はまとめる・間引く
+                    _notify_trade(subject, message, dedup_key=f"thick_bid:{PAIR}", digest=True)
+                except Exception as e:
+                    log_warn(f"⚠️ 板資金投入通知メール送信エラー: {e}")
+            # 売り板が厚い場合（平均の2倍以上）はその最高値を利確価格にする
+            custom_take_profit = book.thick_ask_price
+            # 板が薄い場合（買い板・売り板とも平均の半分以下）
+            if book.is_thin:
+                nampin_interval = NAMPIN_INTERVAL_THIN
+            else:
+                nampin_interval = NAMPIN_INTERVAL
+        except Exception as e:
+            log_warn(f"⚠️ 板情報取得・判定エラー: {e}")
+            custom_take_profit = None
+            nampin_interval = NAMPIN_INTERVAL
+
+        _tick_levels[PAIR] = (custom_take_profit, nampin_interval)
+        if positions_file is None:
+            positions_file = positions_file_for(PAIR)
+        # ポジション情報の読み込み（メモリ上のジャーナルから。変化があったときだけ追記される）
+        journal = _get_position_journal(positions_file)
+        positions = journal.positions()
+
+        # 初回買いも「前回高値の10%下でのみ買う」
+        current_price = get_latest_price(exchange, PAIR)
+        if positions:
+            prev_high = max([float(pos['price']) for pos in positions])
+        else:
+            prev_high = current_price
 
+        buy_threshold = prev_high * (1 - BUY_MORE_PCT / 100.0)
+        buy_cost = current_price * ORDER_AMOUNT
+
+        # --- ここから下の fund_manager, exchange のグローバル初期化・run_bot呼び出しは削除してください ---
+
+        if not positions and current_price <= buy_threshold and fund_manager.available_fund() - buy_cost >= 1000:
+            if fund_manager.place_order(buy_cost):
+                execute_order(exchange, PAIR, 'buy', ORDER_AMOUNT, current_price)
+                positions.append(journal.open(current_price, ORDER_AMOUNT, now_ts))
+                log_info(f"新規買い: {current_price}円で{ORDER_AMOUNT}{BASE}（{BUY_MORE_PCT:g}%下落条件・残高1000円以上キープ）")
+
+        # 利確判定とナンピン判定
+        current_price = get_latest_price(exchange, PAIR)
+        updated_positions = positions[:]
+        for pos in positions:
+            buy_price = pos['price']
+            amount = pos['amount']
+            nampin_count = pos.get('nampin_count', 0)
+            take_profit_price = custom_take_profit if custom_take_profit else buy_price * (1 + PROFIT_TAKE_PCT / 100.0)
+            if current_price >= take_profit_price:
+                order = execute_order(exchange, PAIR, 'sell', amount)
+                _record_sale(fund_manager, current_price * amount, order, (current_price - buy_price) * amount)
+                updated_positions.remove(pos)
+                journal.close(pos, current_price, now_ts)
+                if notify:
+                    try:
+                        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                        subject = f"{BASE}売却通知 {now}"
+                        message = f"【{BASE}売却】\n時刻: {now}\n数量: {amount} {BASE}\n価格: {current_price} 円\n取得価格: {buy_price} 円"
+                        _notify_trade(subject, message)
+                    except Exception as e:
+                        log_warn(f"⚠️ 売却通知メール送信エラー: {e}")
+            elif nampin_count < MAX_NAMPIN and current_price <= buy_price * (1 - nampin_interval * (nampin_count + 1)):
+                add_cost = current_price * amount
+                if fund_manager.available_fund() - add_cost >= 1000:
+                    if fund_manager.place_order(add_cost):
+                        order = execute_order(exchange, PAIR, 'buy', amount, current_price)
+                        updated_positions.append(journal.add(current_price, amount, now_ts, nampin_count + 1))
+                        if notify:
+                            try:
+                                now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                                subject = f"{BASE}ナンピン購入通知 {now}"
+                                message = f"【{BASE}ナンピン購入】\n時刻: {now}\n数量: {amount} {BASE}\n価格: {current_price} 円\nナンピン回数: {nampin_count + 1}回"
+                                _notify_trade(subject, message)
+                            except Exception as e:
+                                log_warn(f"⚠️ ナンピン購入通知メール送信エラー: {e}")
+
+        # ポジションが空のときだけ買い判定
+        if not updated_positions:
+            prev_high = max([float(pos['price']) for pos in positions]) if positions else current_price
+            buy_threshold = prev_high * (1 - BUY_MORE_PCT / 100.0)
+            buy_cost = current_price * ORDER_AMOUNT
+            if current_price <= buy_threshold and fund_manager.available_fund() - buy_cost >= 1000:
+                if fund_manager.place_order(buy_cost):
+                    order = execute_order(exchange, PAIR, 'buy', ORDER_AMOUNT, current_price)
+                    updated_positions.append(journal.open(current_price, ORDER_AMOUNT, now_ts))
+                    if notify:
+                        try:
+                            now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                            subject = f"{BASE}購入通知 {now}"
+                            message = f"【{BASE}購入】\n時刻: {now}\n数量: {ORDER_AMOUNT} {BASE}\n価格: {current_price} 円"
+                            _notify_trade(subject, message)
+                        except Exception as e:
+                            log_warn(f"⚠️ 購入通知メール送信エラー: {e}")
+    finally:
+        end_tick = getattr(exchange, 'end_tick', None)
+        if callable(end_tick):
+            end_tick()
+    return "run_bot executed"
+
+
+# --- メイン実行部 ---
+# run_bot など全ての定義が読み込まれてから起動する（1 ティックだけなら run_once.py を使う）
+if __name__ == "__main__":
+    try:
+        log_info("Bot起動中...")
+        run_bot_di()
+    except Exception as e:
+        print(f"Bot実行中にエラー: {e}")
@@ -0,0 +1,284 @@
+"""Notifier: バックグラウンドでメール通知を送るキュー（SMTP 接続の再利用・ダイジェスト・重複抑制）
+
+`send_notification` は通知のたびに SMTP に接続して STARTTLS・ログインし、売買ループの中で
+同期的に送信していました。メールサーバーが遅いと注文まで遅れます。このモジュールは
+  - 上限付きキューに積んですぐ戻る（満杯のときは捨てて件数を数える）
+  - 送信用スレッドが SMTP セッションを張ったまま使い回す（切れていたら繋ぎ直す、
+    一定時間使わなければ閉じる）
+  - digest=True の通知は NOTIFY_DIGEST_SEC ごとに 1 通にまとめる
+  - dedup_key が同じ通知（厚い板の通知など）は NOTIFY_DEDUP_SEC の間は 1 回だけ送る
+を行います。
+  - get_notifier() -> Notifier          # 環境変数の設定で作る共有インスタンス
+  - Notifier.notify(subject, message, dedup_key=None, digest=False) -> bool
+  - Notifier.flush(timeout) / close()
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+import atexit
+import os
+import queue
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+
+try:
+    from metrics import observe as _observe
+except ImportError:
+    def _observe(name, seconds, **labels):
+        pass
+
+
+class SMTPSession:
+    """SMTP 接続を張ったまま使い回す。送信に失敗したら 1 回だけ繋ぎ直して再送する。"""
+
+    def __init__(self, host: str, port: int = 587, user: Optional[str] = None, password: Optional[str] = None,
+                 use_ssl: bool = False, timeout: float = 30.0, idle_timeout: float = 120.0):
+        self.host = host
+        self.port = int(port)
+        self.user = user
+        self.password = password
+        self.use_ssl = bool(use_ssl)
+        self.timeout = float(timeout)
+        self.idle_timeout = float(idle_timeout)
+        self._server = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _connect(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            server.starttls()
+        if self.user:
+            server.login(self.user, self.password or '')
+        self.connects += 1
+        return server
+
+    def send(self, sender: str, recipients: List[str], msg: str) -> None:
+        for attempt in (0, 1):
+            if self._server is None:
+                self._server = self._connect()
+            try:
+                self._server.sendmail(sender, recipients, msg)
+                self._last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, OSError):
+                # サーバー側で切られていた接続は捨てて繋ぎ直す
+                self.close()
+                if attempt:
+                    raise
+
+    def close_if_idle(self) -> None:
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+
+    def close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+
+class Notifier:
+    """上限付きキューと送信スレッドでメール通知を非同期に送る。"""
+
+    def __init__(self, send: Callable[[str, str], None], queue_size: int = 100, digest_sec: float = 0.0,
+                 dedup_sec: float = 600.0):
+        """
+        Args:
+            send: send(subject, body) で 1 通送る関数（例外は送信スレッドで捕まえて記録する）
+            digest_sec: 0 より大きければ digest=True の通知をこの秒数ごとにまとめて送る
+            dedup_sec: 同じ dedup_key の通知を抑制する秒数
+        """
+        self._send = send
+        self._queue: 'queue.Queue' = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._digest_sec = float(digest_sec)
+        self._dedup_sec = float(dedup_sec)
+        self._dedup: Dict[str, Tuple[float, int]] = {}
+        self._digest: List[Tuple[float, str, str]] = []
+        self._digest_started: Optional[float] = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._force_digest = False
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0, 'dropped': 0, 'deduped': 0, 'digests': 0}
+        self._stopping = False
+        self._worker = threading.Thread(target=self._run, name='notifier', daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    # --- 呼び出し側 ---
+    def notify(self, subject: str, message: str, dedup_key: Optional[str] = None, digest: bool = False) -> bool:
+        """通知をキューに積む。送らない（重複・満杯）ときは False。ブロックしない。"""
+        now = time.monotonic()
+        with self._lock:
+            if dedup_key is not None and self._dedup_sec > 0:
+                last = self._dedup.get(dedup_key)
+                if last is not None and now - last[0] < self._dedup_sec:
+                    self._dedup[dedup_key] = (last[0], last[1] + 1)
+                    self.stats['deduped'] += 1
+                    return False
+                suppressed = last[1] if last is not None else 0
+                if suppressed:
+                    message = f"{message}\n\n（前回の通知以降、同様の通知 {suppressed} 件を省略しました）"
+            try:
+                self._queue.put_nowait((time.time(), subject, message, bool(digest)))
+            except queue.Full:
+                self.stats['dropped'] += 1
+                print(f"⚠️ 通知キューが満杯のため破棄しました: {subject}")
+                return False
+            if dedup_key is not None and self._dedup_sec > 0:
+                self._dedup[dedup_key] = (now, 0)
+            self._in_flight += 1
+            self.stats['queued'] += 1
+        return True
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """キューが空になり、ダイジェストも送り終わるまで待つ。"""
+        deadline = time.monotonic() + float(timeout)
+        with self._idle:
+            # 溜まっているダイジェストは間隔を待たずに送る
+            self._force_digest = True
+            try:
+                while self._in_flight > 0 or self._digest:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._worker.is_alive():
+                        return False
+                    self._idle.wait(min(remaining, 0.5))
+            finally:
+                self._force_digest = False
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        if self._stopping:
+            return
+        self.flush(timeout)
+        self._stopping = True
+        self._worker.join(timeout=2.0)
+        closer = getattr(self._send, 'close', None)
+        if callable(closer):
+            try:
+                closer()
+            except Exception:
+                pass
+        try:
+            atexit.unregister(self.close)
+        except Exception:
+            pass
+
+    # --- 送信スレッド ---
+    def _deliver(self, subject: str, body: str, queued_at: Optional[float] = None, kind: str = 'single') -> None:
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            self._send(subject, body)
+            self.stats['sent'] += 1
+            print(f"📧 通知メール送信: {subject}")
+        except Exception as e:
+            outcome = 'error'
+            self.stats['failed'] += 1
+            print(f"⚠️ メール送信エラー: {e}")
+        _observe('notification_send_duration_seconds', time.perf_counter() - started, kind=kind, outcome=outcome)
+        if queued_at is not None:
+            _observe('notification_queue_delay_seconds', max(0.0, time.time() - queued_at), kind=kind)
+
+    def _flush_digest(self) -> None:
+        with self._lock:
+            items = list(self._digest)
+        if not items:
+            return
+        if len(items) == 1:
+            self._deliver(items[0][1], items[0][2], queued_at=items[0][0], kind='digest')
+        else:
+            lines = []
+            for ts, subject, body in items:
+                stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+                lines.append(f"■ {stamp} {subject}\n{body}")
+            self._deliver(f"通知まとめ {len(items)}件", '\n\n'.join(lines), queued_at=items[0][0], kind='digest')
+        self.stats['digests'] += 1
+        with self._idle:
+            # 送信中に追加された分は次のダイジェストに回す
+            self._digest = self._digest[len(items):]
+            self._digest_started = time.monotonic() if self._digest else None
+            self._idle.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                ts, subject, body, digest = item
+                if digest and self._digest_sec > 0:
+                    with self._lock:
+                        self._digest.append((ts, subject, body))
+                        if self._digest_started is None:
+                            self._digest_started = time.monotonic()
+                else:
+                    self._deliver(subject, body, queued_at=ts)
+                with self._idle:
+                    self._in_flight -= 1
+                    self._idle.notify_all()
+            started = self._digest_started
+            if started is not None and (self._force_digest or time.monotonic() - started >= self._digest_sec):
+                self._flush_digest()
+            if item is None:
+                idle_closer = getattr(self._send, 'close_if_idle', None)
+                if callable(idle_closer):
+                    idle_closer()
+                if self._stopping:
+                    return
+
+
+class SMTPSender:
+    """Notifier に渡す送信関数。1 つの SMTPSession を使い回す。"""
+
+    def __init__(self, session: SMTPSession, sender: str, recipients: List[str]):
+        self.session = session
+        self.sender = sender
+        self.recipients = recipients
+
+    def __call__(self, subject: str, body: str) -> None:
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = ', '.join(self.recipients)
+        self.session.send(self.sender, self.recipients, msg.as_string())
+
+    def close_if_idle(self) -> None:
+        self.session.close_if_idle()
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_notifier: Optional[Notifier] = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier() -> Optional[Notifier]:
+    """SMTP_* / TO_EMAIL / NOTIFY_* 環境変数から共有の Notifier を作る（SMTP 未設定なら None）。"""
+    global _notifier
+    with _notifier_lock:
+        if _notifier is not None:
+            return _notifier
+        host = os.getenv('SMTP_HOST')
+        email_to = os.getenv('TO_EMAIL')
+        if not host or not email_to:
+            return None
+        user = os.getenv('SMTP_USER')
+        use_ssl = str(os.getenv('SMTP_USE_SSL', '0')).lower() in ('1', 'true', 'yes', 'on')
+        session = SMTPSession(host, int(os.getenv('SMTP_PORT', '465' if use_ssl else '587')), user,
+                              os.getenv('SMTP_PASS'), use_ssl=use_ssl,
+                              idle_timeout=float(os.getenv('SMTP_IDLE_SEC', '120')))
+        recipients = [a.strip() for a in email_to.split(',') if a.strip()]
+        _notifier = Notifier(SMTPSender(session, user or recipients[0], recipients),
+                             queue_size=int(os.getenv('NOTIFY_QUEUE_SIZE', '100')),
+                             digest_sec=float(os.getenv('NOTIFY_DIGEST_SEC', '0')),
+                             dedup_sec=float(os.getenv('NOTIFY_DEDUP_SEC', '600')))
+        return _notifier
@@ -0,0 +1,163 @@
+"""OrderBook: 板情報の集計を NumPy の 1 回のベクトル演算でまとめて行うクラス
+
+`run_bot` の厚い板・薄い板の判定と `analyze_orderbook_pressure` の買い/売り圧力は、
+同じ板をそれぞれリスト内包表記で何度も走査していました。このクラスは板を価格・数量の
+配列として一度だけ読み込み、以下をまとめて計算して保持します（NumPy が無ければ純 Python）。
+  - near_bid_avg / near_ask_avg         # 基準価格 ±near_pct の平均数量
+  - has_thick_bid / thick_ask_price     # 平均の thick_factor 倍を超える板（売り板は最高値）
+  - is_thin                             # 付近の板が全体平均の thin_factor 倍未満
+  - buy_volume / sell_volume / pressure_ratio / pressure_signal
+使い方:
+  book = OrderBook.from_ccxt(exchange.fetch_order_book(pair), reference_price=current_price)
+  if book.is_thin: ...
+  OrderBook.shared(orderbook_dict) は同じ板 dict に対する集計結果を使い回します。
+"""
+
+from typing import Optional
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:
+    np = None
+
+
+NEAR_PCT = 0.01
+THICK_FACTOR = 2.0
+THIN_FACTOR = 0.5
+BULLISH_RATIO = 1.2
+BEARISH_RATIO = 0.8
+
+
+def _as_levels(levels):
+    """[[price, size, ...], ...] を (prices, sizes) に変換する。"""
+    if np is not None:
+        n = len(levels or [])
+        try:
+            # 価格・数量の列だけを直接読み込む（np.asarray で 2 次元配列を作るより速い）
+            return (np.fromiter((lv[0] for lv in levels), np.float64, n),
+                    np.fromiter((lv[1] for lv in levels), np.float64, n))
+        except (TypeError, ValueError, IndexError):
+            pass
+        rows = [(float(lv[0]), float(lv[1])) for lv in (levels or []) if len(lv) >= 2]
+        arr = np.asarray(rows, dtype=np.float64).reshape(-1, 2)
+        return arr[:, 0], arr[:, 1]
+    rows = [(float(lv[0]), float(lv[1])) for lv in (levels or []) if len(lv) >= 2]
+    return [r[0] for r in rows], [r[1] for r in rows]
+
+
+class OrderBook:
+    """1 ティック分の板情報と、その集計結果。"""
+
+    def __init__(self, bids, asks, reference_price: Optional[float] = None, near_pct: float = NEAR_PCT,
+                 thick_factor: float = THICK_FACTOR, thin_factor: float = THIN_FACTOR):
+        self.bid_prices, self.bid_sizes = _as_levels(bids)
+        self.ask_prices, self.ask_sizes = _as_levels(asks)
+        self.near_pct = float(near_pct)
+        self.thick_factor = float(thick_factor)
+        self.thin_factor = float(thin_factor)
+        self.reference_price = None
+        self.near_bid_avg = 0.0
+        self.near_ask_avg = 0.0
+        self.near_bid_count = 0
+        self.near_ask_count = 0
+        self.has_thick_bid = False
+        self.thick_ask_price: Optional[float] = None
+        self.is_thin = False
+        self._analyze_totals()
+        if reference_price is not None:
+            self.set_reference(reference_price)
+
+    @classmethod
+    def from_ccxt(cls, orderbook: dict, reference_price: Optional[float] = None, **kwargs) -> 'OrderBook':
+        orderbook = orderbook or {}
+        return cls(orderbook.get('bids', []), orderbook.get('asks', []), reference_price, **kwargs)
+
+    _shared = (None, None)
+
+    @classmethod
+    def shared(cls, orderbook: dict, reference_price: Optional[float] = None) -> 'OrderBook':
+        """同じ板 dict（キャッシュ済みのティック内データなど）の集計結果を使い回す。"""
+        source, book = cls._shared
+        if source is not orderbook or book is None:
+            book = cls.from_ccxt(orderbook)
+            # dict への参照を保持して id の再利用による取り違えを防ぐ
+            cls._shared = (orderbook, book)
+        if reference_price is not None and book.reference_price != float(reference_price):
+            book.set_reference(reference_price)
+        return book
+
+    # --- 集計 ---
+    def _analyze_totals(self) -> None:
+        if np is not None:
+            self.buy_volume = float(self.bid_sizes.sum())
+            self.sell_volume = float(self.ask_sizes.sum())
+        else:
+            self.buy_volume = float(sum(self.bid_sizes))
+            self.sell_volume = float(sum(self.ask_sizes))
+        n_bids, n_asks = len(self.bid_sizes), len(self.ask_sizes)
+        # 板が無い側は 1 を平均とみなす（従来の run_bot の判定と同じ）
+        self.bid_avg = self.buy_volume / n_bids if n_bids else 1.0
+        self.ask_avg = self.sell_volume / n_asks if n_asks else 1.0
+        self.pressure_ratio = self.buy_volume / self.sell_volume if self.sell_volume > 0 else None
+        if self.pressure_ratio is None:
+            self.pressure_signal = 'NEUTRAL'
+        elif self.pressure_ratio > BULLISH_RATIO:
+            self.pressure_signal = 'BULLISH'  # 買い圧力が強い
+        elif self.pressure_ratio < BEARISH_RATIO:
+            self.pressure_signal = 'BEARISH'  # 売り圧力が強い
+        else:
+            self.pressure_signal = 'NEUTRAL'
+
+    def set_reference(self, reference_price: float) -> None:
+        """基準価格（通常は最新約定価格）付近の集計をやり直す。"""
+        ref = float(reference_price)
+        self.reference_price = ref
+        band = ref * self.near_pct
+        if np is not None:
+            bid_near = self.bid_sizes[np.abs(self.bid_prices - ref) < band]
+            ask_mask = np.abs(self.ask_prices - ref) < band
+            ask_near = self.ask_sizes[ask_mask]
+            self.near_bid_count = int(bid_near.size)
+            self.near_ask_count = int(ask_near.size)
+            self.near_bid_avg = float(bid_near.mean()) if bid_near.size else 0.0
+            self.near_ask_avg = float(ask_near.mean()) if ask_near.size else 0.0
+            self.has_thick_bid = bool(bid_near.size and (bid_near > self.near_bid_avg * self.thick_factor).any())
+            thick = ask_near > self.near_ask_avg * self.thick_factor
+            self.thick_ask_price = float(self.ask_prices[ask_mask][thick].max()) if thick.any() else None
+        else:
+            bid_near = [s for p, s in zip(self.bid_prices, self.bid_sizes) if abs(p - ref) < band]
+            ask_near = [(p, s) for p, s in zip(self.ask_prices, self.ask_sizes) if abs(p - ref) < band]
+            self.near_bid_count = len(bid_near)
+            self.near_ask_count = len(ask_near)
+            self.near_bid_avg = sum(bid_near) / len(bid_near) if bid_near else 0.0
+            self.near_ask_avg = sum(s for _, s in ask_near) / len(ask_near) if ask_near else 0.0
+            self.has_thick_bid = any(s > self.near_bid_avg * self.thick_factor for s in bid_near)
+            thick = [p for p, s in ask_near if s > self.near_ask_avg * self.thick_factor]
+            self.thick_ask_price = max(thick) if thick else None
+        self.is_thin = (self.near_bid_avg < self.thin_factor * self.bid_avg
+                        and self.near_ask_avg < self.thin_factor * self.ask_avg)
+
+    def pressure(self) -> dict:
+        """analyze_orderbook_pressure と同じ形式の dict を返す。"""
+        return {
+            'buy_pressure': self.buy_volume,
+            'sell_pressure': self.sell_volume,
+            'pressure_ratio': self.pressure_ratio,
+            'signal': self.pressure_signal,
+        }
+
+    def summary(self) -> dict:
+        out = self.pressure()
+        out.update({
+            'reference_price': self.reference_price,
+            'near_bid_avg': self.near_bid_avg,
+            'near_ask_avg': self.near_ask_avg,
+            'has_thick_bid': self.has_thick_bid,
+            'thick_ask_price': self.thick_ask_price,
+            'is_thin': self.is_thin,
+        })
+        return out
+
+    def __repr__(self) -> str:
+        return (f"<OrderBook bids={len(self.bid_sizes)} asks={len(self.ask_sizes)} "
+                f"ref={self.reference_price} thin={self.is_thin}>")
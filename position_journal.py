@@ -0,0 +1,301 @@
+"""PositionJournal: ポジションの追記専用ジャーナルとスナップショット圧縮
+
+`run_bot` は毎ティック `positions_state.json` 全体を読み込んで書き直していました。
+このモジュールではポジションの変化を 1 行ずつ追記（fsync）し、一定件数ごとに
+スナップショットへ圧縮します。
+  - positions_state.json              スナップショット（従来と同じポジションのリスト）
+  - positions_state.journal.jsonl     スナップショット以降のイベント（open / add / close）
+  - positions_state.history.jsonl     圧縮済みイベントの全履歴（監査用、削除しない）
+提供するメソッド:
+  - positions() -> list                # 現在の保有ポジション（スナップショット + ジャーナルを再生）
+  - open(price, amount, timestamp, **extra) -> dict   # 新規買い
+  - add(price, amount, timestamp, nampin_count, **extra) -> dict  # ナンピン買い
+  - close(position, price, timestamp)  # 売却
+  - compact()                          # スナップショットを書き直してジャーナルを空にする
+  - refresh()                          # 他プロセス・手作業でファイルが変わっていたら読み直す
+
+イベントは位置 id（'id'）単位で冪等に適用するため、圧縮の途中で落ちても
+再起動時にスナップショット + ジャーナルを再生すれば同じ状態に戻ります。
+追記の途中で落ちた最後の行は、起動時に切り詰めてから追記を再開します。
+"""
+
+from typing import Dict, List, Optional
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    from metrics import timed as _timed
+except ImportError:
+    from contextlib import nullcontext as _nullcontext
+
+    def _timed(name, **labels):
+        return _nullcontext()
+
+
+DEFAULT_COMPACT_EVERY = 200
+
+
+def journal_paths(snapshot_path: str):
+    """スナップショットのパスからジャーナル・履歴ファイルのパスを作る。"""
+    p = Path(snapshot_path)
+    stem = p.name[:-len(p.suffix)] if p.suffix else p.name
+    return p.with_name(stem + '.journal.jsonl'), p.with_name(stem + '.history.jsonl')
+
+
+def append_jsonl(path, record: dict, fsync: bool = True) -> None:
+    """1 レコードを JSONL ファイルに追記する（既定で fsync する）。"""
+    line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+    with open(str(path), 'a', encoding='utf-8') as fh:
+        fh.write(line)
+        fh.flush()
+        if fsync:
+            try:
+                os.fsync(fh.fileno())
+            except Exception:
+                pass
+
+
+def read_jsonl(path, repair: bool = False) -> List[dict]:
+    """JSONL ファイルを読み、書き込み途中で落ちた最後の行より前のレコードを返す。
+
+    repair=True なら壊れた末尾をファイルから切り詰める。切り詰めないまま追記すると
+    次のレコードが壊れた行の続きに書かれ、次回の読み込みでそれ以降が全て失われるため、
+    追記する側は起動時に一度 repair=True で読むこと。
+    """
+    out = []
+    try:
+        with open(str(path), 'rb') as fh:
+            data = fh.read()
+    except FileNotFoundError:
+        return out
+    pos = good_end = 0
+    missing_newline = False
+    while pos < len(data):
+        nl = data.find(b'\n', pos)
+        end = len(data) if nl < 0 else nl + 1
+        line = data[pos:end].strip()
+        if line:
+            try:
+                out.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                # 書き込み途中で落ちた最後の行は捨てる
+                break
+            missing_newline = nl < 0
+        good_end = pos = end
+    if repair and (good_end < len(data) or missing_newline):
+        try:
+            with open(str(path), 'r+b') as fh:
+                fh.truncate(good_end)
+                if missing_newline:
+                    fh.seek(good_end)
+                    fh.write(b'\n')
+                fh.flush()
+                os.fsync(fh.fileno())
+            if good_end < len(data):
+                print(f"⚠️ {path} の壊れた末尾 {len(data) - good_end} バイトを切り詰めました")
+        except Exception as e:
+            print(f"⚠️ {path} の末尾を修復できませんでした: {e}")
+    return out
+
+
+def repair_jsonl_tail(path) -> None:
+    """最後の行が改行で終わっていなければ（書き込み途中で落ちていれば）切り詰める。"""
+    try:
+        with open(str(path), 'rb') as fh:
+            fh.seek(0, os.SEEK_END)
+            if fh.tell() == 0:
+                return
+            fh.seek(-1, os.SEEK_END)
+            if fh.read(1) == b'\n':
+                return
+    except FileNotFoundError:
+        return
+    read_jsonl(path, repair=True)
+
+
+def _stat_key(path: Path):
+    try:
+        st = path.stat()
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+class PositionJournal:
+    """ポジションをメモリに保持し、変化だけをジャーナルに追記するクラス。"""
+
+    def __init__(self, snapshot_path: str, compact_every: int = DEFAULT_COMPACT_EVERY, fsync: bool = True):
+        self._snapshot = Path(snapshot_path)
+        self._journal, self._history = journal_paths(snapshot_path)
+        self._compact_every = max(1, int(compact_every))
+        self._fsync = bool(fsync)
+        self._lock = threading.Lock()
+        self._positions: Dict[str, dict] = {}
+        self._seq = 0
+        self._pending = 0
+        self._next_id = 0
+        self._signature = None
+        # 前回の書き込み途中で落ちていたら、追記を始める前に壊れた末尾を切り詰める
+        repair_jsonl_tail(self._history)
+        self._load(repair=True)
+
+    # --- 読み込み ---
+    def _signature_now(self):
+        return (_stat_key(self._snapshot), _stat_key(self._journal))
+
+    def _load(self, repair: bool = False) -> None:
+        positions: Dict[str, dict] = {}
+        migrated = False
+        try:
+            raw = json.loads(self._snapshot.read_text(encoding='utf-8'))
+        except Exception:
+            raw = []
+        if isinstance(raw, dict):
+            raw = raw.get('positions', [])
+        for i, pos in enumerate(raw if isinstance(raw, list) else []):
+            if not isinstance(pos, dict):
+                continue
+            pos = dict(pos)
+            if 'id' not in pos:
+                # 旧形式（id なし）のスナップショットは読み込み時に id を振って書き直す
+                pos['id'] = f"p{int(pos.get('timestamp') or 0)}-{i}"
+                migrated = True
+            positions[str(pos['id'])] = pos
+        events = read_jsonl(self._journal, repair=repair)
+        seq = 0
+        for ev in events:
+            seq = max(seq, int(ev.get('seq', 0)))
+            self._apply(positions, ev)
+        self._positions = positions
+        self._seq = seq
+        self._pending = sum(1 for ev in events if ev.get('op') != 'base')
+        self._signature = self._signature_now()
+        if migrated:
+            self._compact_locked()
+
+    @staticmethod
+    def _apply(positions: Dict[str, dict], ev: dict) -> None:
+        op = ev.get('op')
+        if op in ('open', 'add'):
+            pos = ev.get('position') or {}
+            if 'id' in pos:
+                positions[str(pos['id'])] = dict(pos)
+        elif op == 'close':
+            positions.pop(str(ev.get('id')), None)
+
+    def refresh(self) -> None:
+        """ファイルが自分以外に書き換えられていたら読み直す（stat 2 回だけの軽い確認）。"""
+        with self._lock:
+            if self._signature_now() != self._signature:
+                self._load()
+
+    # --- 参照 ---
+    def positions(self) -> List[dict]:
+        with self._lock:
+            return [dict(p) for p in self._positions.values()]
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    @property
+    def seq(self) -> int:
+        """最後に適用したイベントの番号（ポジションが変わるたびに増える）。"""
+        return self._seq
+
+    # --- 変更 ---
+    def _new_id(self, timestamp) -> str:
+        self._next_id += 1
+        return f"p{int(timestamp or time.time())}-{self._seq + 1}-{self._next_id}"
+
+    def _append(self, ev: dict) -> None:
+        self._seq += 1
+        ev = dict(ev, seq=self._seq, time=time.time())
+        with _timed('persist_write_duration_seconds', store='positions'):
+            append_jsonl(self._journal, ev, fsync=self._fsync)
+        self._apply(self._positions, ev)
+        self._pending += 1
+        self._signature = self._signature_now()
+        if self._pending >= self._compact_every:
+            self._compact_locked()
+
+    def open(self, price: float, amount: float, timestamp: float, **extra) -> dict:
+        with self._lock:
+            pos = dict(extra, price=price, amount=amount, timestamp=timestamp)
+            pos['id'] = self._new_id(timestamp)
+            self._append({'op': 'open', 'position': pos})
+            return dict(pos)
+
+    def add(self, price: float, amount: float, timestamp: float, nampin_count: int = 1, **extra) -> dict:
+        with self._lock:
+            pos = dict(extra, price=price, amount=amount, timestamp=timestamp, nampin_count=nampin_count)
+            pos['id'] = self._new_id(timestamp)
+            self._append({'op': 'add', 'position': pos})
+            return dict(pos)
+
+    def close(self, position: dict, price: Optional[float] = None, timestamp: Optional[float] = None) -> None:
+        with self._lock:
+            pos_id = str(position.get('id'))
+            if pos_id not in self._positions:
+                return
+            self._append({'op': 'close', 'id': pos_id, 'price': price, 'timestamp': timestamp,
+                          'position': self._positions[pos_id]})
+
+    # --- 圧縮 ---
+    def compact(self) -> None:
+        with self._lock:
+            self._compact_locked()
+
+    def _compact_locked(self) -> None:
+        with _timed('persist_write_duration_seconds', store='positions_compact'):
+            self._compact_files()
+
+    def _compact_files(self) -> None:
+        try:
+            events = [ev for ev in read_jsonl(self._journal) if ev.get('op') != 'base']
+            if events:
+                # 1) 履歴へ退避 → 2) スナップショットを原子的に置換 → 3) ジャーナルを空にする。
+                # どこで落ちても再生は冪等なので、最悪でも履歴に同じ行が重複するだけ
+                with open(str(self._history), 'a', encoding='utf-8') as fh:
+                    for ev in events:
+                        fh.write(json.dumps(ev, ensure_ascii=False, separators=(',', ':')) + '\n')
+                    fh.flush()
+                    if self._fsync:
+                        os.fsync(fh.fileno())
+            tmp_path = self._snapshot.with_name(self._snapshot.name + '.tmp')
+            with open(str(tmp_path), 'w', encoding='utf-8') as fh:
+                json.dump(list(self._positions.values()), fh, ensure_ascii=False, indent=2)
+                fh.flush()
+                if self._fsync:
+                    os.fsync(fh.fileno())
+            os.replace(str(tmp_path), str(self._snapshot))
+            # seq を引き継ぐため、空にしたジャーナルの先頭に基点レコードを残す
+            tmp_journal = self._journal.with_name(self._journal.name + '.tmp')
+            with open(str(tmp_journal), 'w', encoding='utf-8') as fh:
+                fh.write(json.dumps({'op': 'base', 'seq': self._seq}) + '\n')
+                fh.flush()
+                if self._fsync:
+                    os.fsync(fh.fileno())
+            os.replace(str(tmp_journal), str(self._journal))
+            self._pending = 0
+            self._signature = self._signature_now()
+        except Exception as e:
+            print(f"⚠️ ポジションジャーナル圧縮エラー: {e}")
+
+    def history(self) -> List[dict]:
+        """圧縮済み + 未圧縮の全イベントを古い順に返す。"""
+        with self._lock:
+            events = read_jsonl(self._history) + read_jsonl(self._journal)
+        seen = set()
+        out = []
+        for ev in events:
+            if ev.get('op') == 'base' or ev.get('seq') in seen:
+                continue
+            seen.add(ev.get('seq'))
+            out.append(ev)
+        return out
+
+    def __repr__(self) -> str:
+        return f"<PositionJournal file={str(self._snapshot)} positions={len(self._positions)} seq={self._seq}>"
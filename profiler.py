@@ -0,0 +1,288 @@
+"""profiler: 動作中の bot に後から有効化できるサンプリングプロファイラ
+
+`ninibo.service` を再起動せずに遅さの原因（pandas や JSON の処理など）を調べるためのものです。
+  - 有効にすると別スレッドが interval ごとに sys._current_frames() で全スレッドのスタックを採取し、
+    指定秒数が経ったら止まる（無効な間はスレッドも動かず、コストはかからない）
+  - 有効化は SIGUSR2（PROFILE_SECONDS 秒）、または control ファイル
+    （既定は bot_state.json の隣の bot_state.profile、PROFILE_CONTROL_FILE で変更可。
+    例: `echo 60 > bot_state.profile` で 60 秒。空なら PROFILE_SECONDS 秒）
+  - 終わったらログディレクトリに
+      profile-YYYYmmdd-HHMMSS.collapsed     折り畳みスタック（flamegraph.pl / speedscope 用）
+      profile-YYYYmmdd-HHMMSS.summary.txt   自己時間・累積時間の上位関数と、パッケージ別の割合
+    を書き出す
+提供するもの:
+  - SamplingProfiler(interval=0.005, out_dir='logs').start(seconds) / stop() / running
+  - ProfilerControl(profiler, control_file, default_seconds).install_signal() / start_watcher()
+  - control_from_env(state_file) -> ProfilerControl
+"""
+
+from typing import Dict, List, Optional, Tuple
+from collections import Counter
+import os
+import sys
+import threading
+import time
+
+
+# 待機中のスレッド（通知・ログ・HTTP サーバーなど）のスタック先端。集計から外して件数だけ数える
+_IDLE_LEAVES = {
+    ('threading', 'wait'), ('threading', '_wait_for_tstate_lock'), ('queue', 'get'),
+    ('selectors', 'select'), ('socketserver', 'serve_forever'),
+}
+
+
+def _package_of(filename: str) -> str:
+    """ファイル名から集計用のパッケージ名（pandas / json / ninibo1127 など）を作る。"""
+    norm = filename.replace('\\', '/')
+    for marker in ('/site-packages/', '/dist-packages/'):
+        if marker in norm:
+            rest = norm.split(marker, 1)[1]
+            return rest.split('/', 1)[0].split('.', 1)[0]
+    parts = norm.rsplit('/', 2)
+    base = parts[-1]
+    if base == '__init__.py' and len(parts) >= 2:
+        return parts[-2]
+    if len(parts) >= 2 and '/lib/python' in norm:
+        # 標準ライブラリのパッケージ（json/encoder.py → json）
+        parent = parts[-2]
+        if not parent.startswith('python'):
+            return parent
+    return base[:-3] if base.endswith('.py') else base
+
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """全スレッドのスタックを一定間隔で採取して集計するプロファイラ。"""
+
+    def __init__(self, interval: float = 0.005, out_dir: str = 'logs', max_depth: int = 128):
+        self.interval = max(0.0005, float(interval))
+        self.out_dir = out_dir
+        self.max_depth = int(max_depth)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stacks: Counter = Counter()
+        self._packages: Counter = Counter()
+        self._samples = 0
+        self._idle = 0
+        self._started_at = 0.0
+        self.last_outputs: Tuple[str, ...] = ()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float = 30.0) -> bool:
+        """seconds 秒だけ採取を始める。すでに動いていれば False。"""
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks = Counter()
+            self._packages = Counter()
+            self._samples = 0
+            self._idle = 0
+            self._stop.clear()
+            self._started_at = time.time()
+            self._thread = threading.Thread(target=self._run, args=(float(seconds),), name='profiler', daemon=True)
+            self._thread.start()
+        print(f"🔬 プロファイラを開始しました（{seconds:g}秒、{self.interval * 1000:g}ms 間隔）")
+        return True
+
+    def stop(self, timeout: float = 5.0) -> Tuple[str, ...]:
+        """採取を止めて結果を書き出すまで待ち、書き出したファイルのパスを返す。"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.last_outputs
+
+    def _run(self, seconds: float) -> None:
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        try:
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                self._sample(me)
+                self._stop.wait(self.interval)
+        finally:
+            try:
+                self.last_outputs = self._write()
+                print(f"🔬 プロファイル結果を書き出しました: {', '.join(self.last_outputs)}")
+            except Exception as e:
+                print(f"⚠️ プロファイル書き出しエラー: {e}")
+
+    def _sample(self, me: int) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            leaf = frame.f_code
+            if (_package_of(leaf.co_filename), leaf.co_name) in _IDLE_LEAVES:
+                self._idle += 1
+                continue
+            labels: List[str] = []
+            leaf_package = None
+            depth = 0
+            while frame is not None and depth < self.max_depth:
+                code = frame.f_code
+                labels.append(_label(code))
+                if leaf_package is None:
+                    leaf_package = _package_of(code.co_filename)
+                frame = frame.f_back
+                depth += 1
+            labels.append(names.get(ident, f"thread-{ident}"))
+            labels.reverse()
+            self._stacks[';'.join(labels)] += 1
+            self._packages[leaf_package or '?'] += 1
+        self._samples += 1
+
+    # --- 集計・書き出し ---
+    def summary(self, top: int = 30) -> str:
+        stacks = self._stacks
+        total = sum(stacks.values()) or 1
+        self_counts: Counter = Counter()
+        cumulative: Counter = Counter()
+        for stack, n in stacks.items():
+            frames = stack.split(';')[1:]
+            if not frames:
+                continue
+            self_counts[frames[-1]] += n
+            for label in set(frames):
+                cumulative[label] += n
+        elapsed = time.time() - self._started_at
+        lines = [
+            f"samples: {self._samples} (stacks {total}, idle threads skipped {self._idle}) over {elapsed:.1f}s, "
+            f"interval {self.interval * 1000:g}ms",
+            '',
+            f"== 自己時間の上位 {top} 関数 ==",
+        ]
+        for label, n in self_counts.most_common(top):
+            lines.append(f"{n / total * 100:6.2f}%  {n:7d}  {label}")
+        lines += ['', f"== 累積時間の上位 {top} 関数 =="]
+        for label, n in cumulative.most_common(top):
+            lines.append(f"{n / total * 100:6.2f}%  {n:7d}  {label}")
+        lines += ['', "== パッケージ別（スタック先端のファイル） =="]
+        for package, n in self._packages.most_common():
+            lines.append(f"{n / total * 100:6.2f}%  {n:7d}  {package}")
+        return '\n'.join(lines) + '\n'
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {n}\n" for stack, n in sorted(self._stacks.items()))
+
+    def _write(self) -> Tuple[str, ...]:
+        os.makedirs(self.out_dir, exist_ok=True)
+        stem = os.path.join(self.out_dir, time.strftime('profile-%Y%m%d-%H%M%S', time.localtime(self._started_at)))
+        collapsed_path = stem + '.collapsed'
+        summary_path = stem + '.summary.txt'
+        with open(collapsed_path, 'w', encoding='utf-8') as fh:
+            fh.write(self.collapsed())
+        with open(summary_path, 'w', encoding='utf-8') as fh:
+            fh.write(self.summary())
+        return (collapsed_path, summary_path)
+
+    def __repr__(self) -> str:
+        return f"<SamplingProfiler running={self.running} samples={self._samples}>"
+
+
+class ProfilerControl:
+    """シグナルと control ファイルでプロファイラを起動する。"""
+
+    def __init__(self, profiler: SamplingProfiler, control_file: Optional[str] = None,
+                 default_seconds: float = 30.0, poll_sec: float = 1.0):
+        self.profiler = profiler
+        self.control_file = control_file
+        self.default_seconds = float(default_seconds)
+        self.poll_sec = float(poll_sec)
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def trigger(self, seconds: Optional[float] = None) -> bool:
+        return self.profiler.start(self.default_seconds if seconds is None else seconds)
+
+    def install_signal(self) -> bool:
+        """SIGUSR2 で default_seconds 秒のプロファイルを開始する（メインスレッドかつ POSIX のみ）。"""
+        try:
+            import signal
+            # ハンドラーではスレッドを起動するだけなので、ティックの処理は止めない
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self.trigger())
+            return True
+        except (AttributeError, ValueError, OSError):
+            return False
+
+    def check_control_file(self) -> bool:
+        """control ファイルがあれば中身の秒数（空なら既定）で開始し、ファイルを消す。"""
+        path = self.control_file
+        if not path or not os.path.exists(path):
+            return False
+        seconds = None
+        try:
+            with open(path, 'r', encoding='utf-8') as fh:
+                text = fh.read().strip()
+            if text:
+                seconds = float(text)
+        except (OSError, ValueError):
+            seconds = None
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return self.trigger(seconds)
+
+    def start_watcher(self) -> None:
+        if not self.control_file or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._watcher = threading.Thread(target=self._watch, name='profiler-control', daemon=True)
+        self._watcher.start()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_sec):
+            try:
+                self.check_control_file()
+            except Exception as e:
+                print(f"⚠️ プロファイラ制御ファイルの確認エラー: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.profiler.stop()
+
+
+def control_from_env(state_file: Optional[str] = None) -> ProfilerControl:
+    """PROFILE_* / LOG_DIR 環境変数から作る。
+
+    control ファイルは PROFILE_CONTROL_FILE、無ければ state_file（bot は bot_state.json を渡す）の
+    拡張子を .profile にしたもの。PROFILE_CONTROL_FILE を空にすると control ファイルを使わない。
+    """
+    log_dir = os.getenv('LOG_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'))
+    try:
+        interval = float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000.0
+        seconds = float(os.getenv('PROFILE_SECONDS', '30'))
+    except ValueError:
+        interval, seconds = 0.005, 30.0
+    control_file = os.getenv('PROFILE_CONTROL_FILE')
+    if control_file is None and state_file:
+        root, _ = os.path.splitext(str(state_file))
+        control_file = root + '.profile'
+    profiler = SamplingProfiler(interval=interval, out_dir=os.getenv('PROFILE_DIR', log_dir))
+    return ProfilerControl(profiler, control_file=control_file or None, default_seconds=seconds)
+
+
+def main(argv) -> int:
+    """`python profiler.py 60 python_script.py args...` のように、スクリプトを実行しながら採取する。"""
+    import runpy
+    if len(argv) < 3:
+        print("usage: python profiler.py SECONDS script.py [args...]")
+        return 2
+    profiler = SamplingProfiler(out_dir=os.getenv('PROFILE_DIR', 'logs'))
+    profiler.start(float(argv[1]))
+    sys.argv = argv[2:]
+    try:
+        runpy.run_path(argv[2], run_name='__main__')
+    finally:
+        profiler.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,330 @@
+"""RateLimiter: プロセス間で共有するトークンバケット型レート制限と適応バックオフ
+
+bot 本体と `check_ccxt.py` のようなツールがそれぞれ bitbank を叩くと、合計で
+レート制限を超えてしまいます。このモジュールは
+  - ローカルの状態ファイル + ファイルロックで複数プロセス間のトークンを共有
+  - コストクラスごとの予算（rate/秒, burst）: public（市場データ）/ private_query（口座照会）/
+    private_update（注文・取消）。エンドポイント名をキーにした予算を渡せばそのエンドポイントだけの
+    バケットになる（RATE_LIMIT_BUDGETS="fetch_ohlcv=1:2,private_update=3:6"）
+  - 共有ファイルの読み書き（ロック付き）は 1 回で数トークンをまとめて借り（lease）、
+    借りた分を使い切るか lease_sec が過ぎるまではプロセス内で消費する。使わなかった分は次に返す
+  - 優先度: 注文（create/cancel）> 口座照会 > 市場データ。低優先度の呼び出しは
+    バケットの残りが予約分を下回ると待つため、読み取りが続いても売り注文は通る
+  - 429 / 5xx（ccxt の例外クラスか HTTP ステータスで判定）を検知したらジッター付き指数バックオフを
+    全プロセスに共有。注文は確実に拒否された 429 のときだけ再送する
+を提供します。
+  - RateLimiter.acquire(endpoint)        # トークンを取得できるまで待つ
+  - RateLimiter.report_throttled(endpoint) / report_success()
+  - RateLimitedExchange(exchange, limiter)  # ccxt オブジェクトのラッパー
+"""
+
+from typing import Callable, Dict, Optional, Tuple
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+try:
+    from filelock import FileLock as _ExtFileLock  # type: ignore
+except ImportError:
+    _ExtFileLock = None
+try:
+    import fcntl  # type: ignore
+except ImportError:
+    fcntl = None
+
+
+PRIORITY_ORDER = 0
+PRIORITY_ACCOUNT = 1
+PRIORITY_MARKET = 2
+
+# コストクラス（bucket 名）-> (補充レート[回/秒], 最大トークン数)
+DEFAULT_BUDGETS: Dict[str, Tuple[float, float]] = {
+    'public': (5.0, 10.0),
+    'private_query': (5.0, 10.0),
+    'private_update': (3.0, 6.0),
+}
+
+# 旧設定の bucket 名 -> 対応するコストクラス
+_BUDGET_ALIASES = {'private': ('private_query', 'private_update')}
+
+# 低優先度の呼び出しが残しておくトークン数（優先度ごと）
+DEFAULT_RESERVE = {PRIORITY_ORDER: 0.0, PRIORITY_ACCOUNT: 1.0, PRIORITY_MARKET: 2.0}
+
+_ORDER_METHODS = ('create_order', 'cancel_order', 'edit_order', 'withdraw')
+_PUBLIC_METHODS = ('fetch_ticker', 'fetch_tickers', 'fetch_order_book', 'fetch_trades', 'fetch_ohlcv',
+                   'fetch_markets', 'load_markets')
+
+# 429/5xx・タイムアウト相当とみなす ccxt 例外クラス名（サブクラスも含む）
+_THROTTLE_ERRORS = ('RateLimitExceeded', 'DDoSProtection', 'ExchangeNotAvailable', 'OnMaintenance',
+                    'RequestTimeout')
+_THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def classify(endpoint: str) -> Tuple[str, int]:
+    """エンドポイント名から (コストクラス, 優先度) を返す。"""
+    if endpoint in _ORDER_METHODS or endpoint.startswith('create_'):
+        return 'private_update', PRIORITY_ORDER
+    if endpoint in _PUBLIC_METHODS:
+        return 'public', PRIORITY_MARKET
+    return 'private_query', PRIORITY_ACCOUNT
+
+
+def parse_budgets_env(text: Optional[str]) -> Dict[str, Tuple[float, float]]:
+    """"fetch_ohlcv=1:2,private_update=3:6" 形式（名前=rate:burst）を辞書にする。"""
+    out: Dict[str, Tuple[float, float]] = {}
+    for part in (text or '').split(','):
+        if '=' not in part or ':' not in part:
+            continue
+        name, value = part.split('=', 1)
+        rate, burst = value.split(':', 1)
+        try:
+            out[name.strip()] = (float(rate), float(burst))
+        except ValueError:
+            continue
+    return out
+
+
+def _is_instance_of(exc: BaseException, names) -> bool:
+    # ccxt を import せずに判定できるよう、クラス名で継承関係をたどる
+    return any(cls.__name__ in names for cls in type(exc).__mro__)
+
+
+def http_status(exc: BaseException) -> Optional[int]:
+    """例外が持つ HTTP ステータス（http_status / status / response.status_code）を返す。無ければ None。
+
+    メッセージ中の数字（注文 ID・価格・数量）を拾わないよう、文字列は解析しない。
+    """
+    for value in (getattr(exc, 'http_status', None), getattr(exc, 'status', None),
+                  getattr(getattr(exc, 'response', None), 'status_code', None)):
+        try:
+            if value is not None:
+                return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """待ってから再試行すれば通る見込みのあるエラー（429 / 5xx / タイムアウト）か。"""
+    if _is_instance_of(exc, _THROTTLE_ERRORS):
+        return True
+    return http_status(exc) in _THROTTLE_STATUSES
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """レート制限（リクエストが処理される前に拒否された）ことが確実なエラーか。"""
+    if _is_instance_of(exc, ('RateLimitExceeded',)):
+        return True
+    return http_status(exc) == 429
+
+
+class _InterProcessLock:
+    """filelock があればそれを、無ければ fcntl.flock を使う。どちらも無ければスレッドロックのみ。"""
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._thread_lock = threading.Lock()
+        self._ext = _ExtFileLock(str(path)) if _ExtFileLock is not None else None
+        self._fh = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            if self._ext is not None:
+                self._ext.acquire()
+            elif fcntl is not None:
+                self._fh = open(str(self._path), 'a+')
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+        except Exception:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if self._ext is not None:
+                self._ext.release()
+            elif self._fh is not None:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+                self._fh.close()
+                self._fh = None
+        finally:
+            self._thread_lock.release()
+        return False
+
+
+class RateLimiter:
+    """状態ファイルを介して複数プロセスでトークンバケットを共有するレートリミッタ。"""
+
+    def __init__(self, state_file: Optional[str] = None, budgets: Optional[Dict[str, Tuple[float, float]]] = None,
+                 reserve: Optional[Dict[int, float]] = None, base_backoff: float = 1.0, max_backoff: float = 60.0,
+                 clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep,
+                 lease_sec: float = 1.0):
+        self._state_file = Path(state_file) if state_file else Path(os.getenv('RATE_LIMIT_STATE', '.ratelimit.json'))
+        self._lock = _InterProcessLock(self._state_file.with_name(self._state_file.name + '.lock'))
+        self._budgets = dict(DEFAULT_BUDGETS)
+        if budgets is None:
+            budgets = parse_budgets_env(os.getenv('RATE_LIMIT_BUDGETS'))
+        for name, budget in (budgets or {}).items():
+            for key in _BUDGET_ALIASES.get(name, (name,)):
+                self._budgets[key] = budget
+        self._reserve = dict(DEFAULT_RESERVE)
+        if reserve:
+            self._reserve.update(reserve)
+        self._base_backoff = float(base_backoff)
+        self._max_backoff = float(max_backoff)
+        self._clock = clock
+        self._sleep = sleep
+        self._lease_sec = max(0.0, float(lease_sec))
+        # bucket -> [借りて未使用のトークン数, 期限]（このプロセス内だけで使う）
+        self._leases: Dict[str, list] = {}
+        self._local_lock = threading.Lock()
+        self._backoff_until = 0.0
+        self.waited_sec = 0.0
+        self.shared_reads = 0
+
+    def bucket_for(self, endpoint: str) -> Tuple[str, int]:
+        """(bucket 名, 優先度)。エンドポイント名の予算があればそれを、無ければコストクラスを使う。"""
+        cost_class, priority = classify(endpoint)
+        return (endpoint if endpoint in self._budgets else cost_class), priority
+
+    # --- 共有状態 ---
+    def _load(self) -> dict:
+        try:
+            return json.loads(self._state_file.read_text(encoding='utf-8'))
+        except Exception:
+            return {}
+
+    def _save(self, state: dict) -> None:
+        try:
+            tmp_path = self._state_file.with_name(self._state_file.name + '.tmp')
+            tmp_path.write_text(json.dumps(state, separators=(',', ':')), encoding='utf-8')
+            os.replace(str(tmp_path), str(self._state_file))
+        except Exception:
+            pass
+
+    def _take_leased(self, bucket: str, priority: int, now: float) -> Optional[float]:
+        """借りているトークンを 1 つ使う（共有ファイルに触れない）。使えたら 0、使えなければ None。"""
+        with self._local_lock:
+            if self._backoff_until > now and priority != PRIORITY_ORDER:
+                return self._backoff_until - now
+            lease = self._leases.get(bucket)
+            if lease is not None and lease[0] >= 1.0 and lease[1] > now:
+                lease[0] -= 1.0
+                return 0.0
+        return None
+
+    def _try_take(self, bucket: str, priority: int) -> float:
+        """共有バケットからトークンを借りる。取れたら 0、取れなければ待つべき秒数を返す。
+
+        1 つは今の呼び出しに使い、残りは lease_sec の間このプロセスで使う（rate * lease_sec 個まで）。
+        期限切れで使わなかった分は共有バケットに返してから借り直す。
+        """
+        rate, burst = self._budgets.get(bucket, DEFAULT_BUDGETS['private_query'])
+        reserve = min(self._reserve.get(priority, 0.0), burst - 1.0)
+        with self._local_lock:
+            lease = self._leases.pop(bucket, None)
+        unused = lease[0] if lease is not None else 0.0
+        with self._lock:
+            self.shared_reads += 1
+            state = self._load()
+            now = self._clock()
+            backoff_until = float(state.get('backoff_until', 0.0))
+            b = state.setdefault('buckets', {}).setdefault(bucket, {'tokens': burst, 'updated': now})
+            tokens = min(burst, float(b['tokens']) + unused + max(0.0, now - float(b['updated'])) * rate)
+            b['updated'] = now
+            if backoff_until > now and priority != PRIORITY_ORDER:
+                b['tokens'] = tokens
+                self._save(state)
+                with self._local_lock:
+                    self._backoff_until = max(self._backoff_until, backoff_until)
+                return backoff_until - now
+            if tokens - 1.0 >= reserve:
+                take = max(1.0, min(float(int(tokens - reserve)), float(int(rate * self._lease_sec))))
+                b['tokens'] = tokens - take
+                self._save(state)
+                if take > 1.0:
+                    with self._local_lock:
+                        self._leases[bucket] = [take - 1.0, now + self._lease_sec]
+                return 0.0
+            b['tokens'] = tokens
+            self._save(state)
+            return (reserve + 1.0 - tokens) / rate
+
+    def acquire(self, endpoint: str) -> float:
+        """トークンが取れるまで待つ。待った秒数を返す。"""
+        bucket, priority = self.bucket_for(endpoint)
+        waited = 0.0
+        while True:
+            wait = self._take_leased(bucket, priority, self._clock())
+            if wait is None:
+                wait = self._try_take(bucket, priority)
+            if wait <= 0:
+                self.waited_sec += waited
+                return waited
+            wait = min(wait, self._max_backoff)
+            self._sleep(wait)
+            waited += wait
+
+    def report_throttled(self, attempt: int) -> float:
+        """429/5xx を受けたときに呼ぶ。全プロセス共通のバックオフ期限を延ばし、その秒数を返す。"""
+        delay = min(self._max_backoff, self._base_backoff * (2 ** max(0, attempt)))
+        delay *= random.uniform(0.5, 1.5)
+        with self._lock:
+            state = self._load()
+            until = self._clock() + delay
+            state['backoff_until'] = max(float(state.get('backoff_until', 0.0)), until)
+            self._save(state)
+        with self._local_lock:
+            # 借りているトークンでバックオフ中に呼び出さないよう、このプロセスの期限も延ばす
+            self._backoff_until = max(self._backoff_until, until)
+        return delay
+
+    def __repr__(self) -> str:
+        return f"<RateLimiter file={str(self._state_file)} waited={self.waited_sec:.2f}s>"
+
+
+class RateLimitedExchange:
+    """ccxt の API 呼び出しの前にトークンを取得し、429/5xx ではバックオフして再試行するラッパー。"""
+
+    def __init__(self, exchange, limiter: Optional[RateLimiter] = None, max_retries: int = 3,
+                 sleep: Optional[Callable[[float], None]] = None):
+        self._exchange = exchange
+        self._limiter = limiter or RateLimiter()
+        self._max_retries = int(max_retries)
+        # 既定ではリミッタと同じ sleep を使う（テストやバックテストで差し替えた時計・sleep に従う）
+        self._sleep = sleep if sleep is not None else self._limiter._sleep
+
+    def _call(self, name: str, fn, *args, **kwargs):
+        _, priority = classify(name)
+        attempt = 0
+        while True:
+            self._limiter.acquire(name)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_throttle_error(e) or attempt >= self._max_retries:
+                    raise
+                # 注文は 5xx やタイムアウトだと受理済みの可能性があるので、確実に拒否された 429 のときだけ再送する
+                if priority == PRIORITY_ORDER and not is_rate_limit_error(e):
+                    raise
+                delay = self._limiter.report_throttled(attempt)
+                attempt += 1
+                from ninibo1127 import log_warn
+                log_warn(f"⚠️ API制限/サーバーエラーのため {delay:.1f}秒待って再試行します ({name}): {e}",
+                         endpoint=name, attempt=attempt)
+                self._sleep(delay)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self._exchange, name)
+        if callable(attr) and (name.startswith('fetch_') or name in _ORDER_METHODS or name == 'load_markets'):
+            return lambda *args, **kwargs: self._call(name, attr, *args, **kwargs)
+        return attr
+
+    def __repr__(self) -> str:
+        return f"<RateLimitedExchange exchange={type(self._exchange).__name__}>"
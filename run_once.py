@@ -1,23 +1,108 @@
-<<<<<<< HEAD
-from ninibo1127 import connect_to_bitbank, FundManager, run_bot
-import os
-
-if __name__ == '__main__':
-    # 仮想環境が有効なシェルで実行してください
-    exchange = connect_to_bitbank()
-    initial = float(os.getenv('INITIAL_FUND', '20000'))
-    fm = FundManager(initial_fund=initial)
-    # run_bot は1回だけ実行するので安全に呼び出せます
-    run_bot(exchange, fm)
-=======
-from ninibo1127 import connect_to_bitbank, FundManager, run_bot
+"""run_once: cron や手動実行で 1 ティックだけ判定する軽量エントリーポイント
+
+`python ninibo1127.py` は常駐用（スケジューラ・/metrics・シグナル）なので、1 回だけ動かすときはこちらを使います。
+  - ccxt・pandas・SMTP は実際に使うときまで import しない
+    （--stub なら ccxt を読まずに ExchangeStub の価格で判定するので、設定の確認やベンチマークに使える）
+  - --import-times（または RUN_ONCE_IMPORT_TIMES=1）で、読み込んだモジュールごとの import 時間
+    （合計・自己）と、接続・ティックの所要時間を標準エラーに出す
+使い方:
+  python run_once.py [--dry-run] [--stub] [--import-times]
+"""
+
+import time
+
+_T0 = time.perf_counter()
+
+import builtins
 import os
+import sys
 
-if __name__ == '__main__':
-    # 仮想環境が有効なシェルで実行してください
-    exchange = connect_to_bitbank()
+
+class ImportTimer:
+    """builtins.__import__ を包み、初めて読み込まれたモジュールの import 時間を記録する。"""
+
+    def __init__(self):
+        self.records = []   # (深さ, 名前, 合計秒, 自己秒)
+        self._stack = []
+        self._original = None
+
+    def __enter__(self):
+        self._original = builtins.__import__
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        builtins.__import__ = self._original
+        return False
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and name in sys.modules:
+            return self._original(name, globals, locals, fromlist, level)
+        # 開始順に並ぶよう先に場所を取っておき、終わったら埋める
+        index = len(self.records)
+        self.records.append(None)
+        self._stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.records[index] = (len(self._stack), '.' * level + name, elapsed, elapsed - children)
+
+    def report(self, min_ms: float = 1.0, top: int = 15) -> str:
+        """読み込み順の木（min_ms 以上のもの）と、自己時間の上位 top 件を文字列にする。"""
+        records = [r for r in self.records if r is not None]
+        total = sum(r[2] for r in records if r[0] == 0)
+        lines = [f"import 合計 {total * 1000:.1f}ms（{len(records)} モジュール）",
+                 "   合計ms    自己ms  モジュール"]
+        for depth, name, elapsed, own in records:
+            if elapsed * 1000 >= min_ms:
+                lines.append(f"{elapsed * 1000:8.1f}  {own * 1000:8.1f}  {'  ' * depth}{name}")
+        lines += ['', f"自己時間の上位 {top} 件"]
+        for depth, name, elapsed, own in sorted(records, key=lambda r: -r[3])[:top]:
+            lines.append(f"{own * 1000:8.1f}ms  {name}")
+        return '\n'.join(lines)
+
+
+def _flag(argv, name, env):
+    return name in argv or str(os.getenv(env, '0')).lower() in ('1', 'true', 'yes', 'on')
+
+
+def main(argv) -> int:
+    if _flag(argv, '--dry-run', 'DRY_RUN'):
+        # ninibo1127 は import 時に DRY_RUN を読む設定もあるので、先に環境変数にしておく
+        os.environ['DRY_RUN'] = '1'
+    show_times = _flag(argv, '--import-times', 'RUN_ONCE_IMPORT_TIMES')
+    timer = ImportTimer()
+    with timer:
+        import ninibo1127 as bot
+    t_import = time.perf_counter()
+
+    if _flag(argv, '--stub', 'RUN_ONCE_STUB'):
+        exchange = bot.ExchangeStub(os.getenv('DRY_RUN_PRICE'))
+    else:
+        # 仮想環境が有効なシェルで実行してください
+        exchange = bot.connect_to_bitbank()
     initial = float(os.getenv('INITIAL_FUND', '20000'))
-    fm = FundManager(initial_fund=initial)
+    # FUND_BACKEND=sqlite なら常駐中の bot と同じ資金を安全に共有する
+    from funds import create_fund_manager
+    fm = create_fund_manager(initial_fund=initial, state_file=os.getenv('FUND_STATE_FILE', 'funds_state.json'))
+    t_connect = time.perf_counter()
+
     # run_bot は1回だけ実行するので安全に呼び出せます
-    run_bot(exchange, fm)
->>>>>>> 74f1ab306ca4f7cbafdafeccf820148ccd40d52d
+    bot.run_bot(exchange, fm)
+    t_tick = time.perf_counter()
+
+    if show_times:
+        print(timer.report(), file=sys.stderr)
+        print(f"\n起動から import 完了まで {(t_import - _T0) * 1000:.1f}ms / 接続 {(t_connect - t_import) * 1000:.1f}ms"
+              f" / ティック {(t_tick - t_connect) * 1000:.1f}ms / 合計 {(t_tick - _T0) * 1000:.1f}ms",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,169 @@
+"""AlignedScheduler: 足の確定時刻（壁時計の区切り）に合わせてジョブを起動するスケジューラ
+
+`run_bot` の後に固定で `time.sleep(300)` すると、実行時間のぶんだけティックが
+ずれていき、5 分足の確定とも揃いません。このスケジューラは
+  - 各ジョブを interval 秒の区切り（例: 5m なら :00, :05, ...）+ offset 秒に起動
+  - 実行が次の区切りを過ぎた場合は late_policy に従う
+      skip : 逃した区切りは飛ばして次の区切りを待つ
+      merge: 逃した区切りの分をまとめて 1 回だけすぐに実行する
+  - superseded_by で「上位のジョブが今回動く、または自分の間隔以内に動いたばかりなら省略」を
+    指定できる（例: 30 秒ごとの価格チェックは 5 分ティックの直後には実行しない）
+を行います。
+  - add_job(name, interval, fn, offset=0, late_policy='skip', superseded_by=None)
+  - run_pending() -> list            # 期限の来たジョブを実行（1 回分）
+  - run_forever() / stop()
+  - stats() -> dict                  # 実行回数・スキップ回数・遅延
+"""
+
+from typing import Callable, Dict, List, Optional
+import math
+import threading
+import time
+
+
+LATE_POLICIES = ('skip', 'merge')
+
+
+def parse_interval(value) -> float:
+    """'5m' / '1h' / '30s' / 300 を秒数にする。"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().lower()
+    if text.endswith('s'):
+        return float(text[:-1])
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    from candle_store import timeframe_to_ms
+    return timeframe_to_ms(text) / 1000.0
+
+
+class Job:
+    def __init__(self, name: str, interval: float, fn: Callable[[], object], offset: float = 0.0,
+                 late_policy: str = 'skip', superseded_by: Optional[str] = None):
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        if late_policy not in LATE_POLICIES:
+            raise ValueError(f"late_policy must be one of {LATE_POLICIES}")
+        self.name = name
+        self.interval = float(interval)
+        self.fn = fn
+        self.offset = float(offset) % self.interval
+        self.late_policy = late_policy
+        self.superseded_by = superseded_by
+        self.next_run: Optional[float] = None
+        self.runs = 0
+        self.skipped = 0
+        self.merged = 0
+        self.superseded = 0
+        self.max_lateness = 0.0
+        self.last_duration = 0.0
+        self.last_run_at: Optional[float] = None
+        self.last_result = None
+
+    def boundary_after(self, t: float) -> float:
+        """t より後の最初の区切り時刻。"""
+        k = math.floor((t - self.offset) / self.interval) + 1
+        return k * self.interval + self.offset
+
+    def __repr__(self) -> str:
+        return f"<Job {self.name} every={self.interval:g}s next={self.next_run}>"
+
+
+class AlignedScheduler:
+    """壁時計の区切りに揃えてジョブを実行する。時計と sleep は差し替え可能（テスト・バックテスト用）。"""
+
+    def __init__(self, clock: Callable[[], float] = time.time, sleep: Optional[Callable[[float], None]] = None,
+                 max_sleep: float = 1.0):
+        self._clock = clock
+        self._stop = threading.Event()
+        self._sleep = sleep or (lambda sec: self._stop.wait(sec))
+        self._max_sleep = float(max_sleep)
+        self._jobs: Dict[str, Job] = {}
+
+    def add_job(self, name: str, interval, fn: Callable[[], object], offset: float = 0.0,
+                late_policy: str = 'skip', superseded_by: Optional[str] = None) -> Job:
+        job = Job(name, parse_interval(interval), fn, offset, late_policy, superseded_by)
+        job.next_run = job.boundary_after(self._clock())
+        self._jobs[name] = job
+        return job
+
+    def next_due(self) -> Optional[float]:
+        return min((j.next_run for j in self._jobs.values()), default=None)
+
+    def run_pending(self) -> List[str]:
+        """期限の来たジョブを登録順に実行し、実行したジョブ名を返す。"""
+        now = self._clock()
+        due = [j for j in self._jobs.values() if j.next_run is not None and j.next_run <= now]
+        due_names = {j.name for j in due}
+        ran = []
+        for job in due:
+            slot = job.next_run
+            missed = int((now - slot) // job.interval)
+            if self._is_superseded(job, now, due_names):
+                # 上位のジョブが今回走る、または走ったばかりなので、このジョブは省略する
+                job.superseded += 1
+                job.next_run = job.boundary_after(max(now, slot))
+                continue
+            if missed > 0:
+                if job.late_policy == 'skip':
+                    # 古い区切りでは実行せず、次の区切りを待つ
+                    job.skipped += missed + 1
+                    job.next_run = job.boundary_after(now)
+                    continue
+                job.merged += missed
+            job.max_lateness = max(job.max_lateness, now - slot)
+            started = time.perf_counter()
+            try:
+                job.last_result = job.fn()
+            finally:
+                job.last_duration = time.perf_counter() - started
+                job.runs += 1
+                # 実行時間に関係なく、次は区切りの時刻に起動する
+                end = self._clock()
+                job.last_run_at = end
+                nxt = job.boundary_after(max(end, slot))
+                passed = max(0, int(round((nxt - slot) / job.interval)) - 1)
+                if passed and job.late_policy == 'merge':
+                    # 実行中に過ぎた区切りの分を 1 回にまとめてすぐに実行する
+                    job.merged += passed
+                    job.next_run = end
+                else:
+                    job.skipped += passed
+                    job.next_run = nxt
+            ran.append(job.name)
+        return ran
+
+    def _is_superseded(self, job: Job, now: float, due_names) -> bool:
+        if not job.superseded_by:
+            return False
+        if job.superseded_by in due_names:
+            return True
+        other = self._jobs.get(job.superseded_by)
+        return bool(other and other.last_run_at is not None and now - other.last_run_at < job.interval)
+
+    def run_forever(self) -> None:
+        while not self._stop.is_set():
+            due = self.next_due()
+            if due is None:
+                return
+            wait = due - self._clock()
+            if wait > 0:
+                self._sleep(min(wait, self._max_sleep))
+                continue
+            self.run_pending()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            name: {'interval': j.interval, 'runs': j.runs, 'skipped': j.skipped, 'merged': j.merged,
+                   'superseded': j.superseded, 'max_lateness': j.max_lateness, 'last_duration': j.last_duration,
+                   'next_run': j.next_run}
+            for name, j in self._jobs.items()
+        }
+
+    def __repr__(self) -> str:
+        return f"<AlignedScheduler jobs={list(self._jobs)}>"
@@ -0,0 +1,413 @@
+"""SqliteFundManager: 複数プロセスから安全に使える FundManager（SQLite WAL モード）
+
+`funds.FundManager` はスレッドロックしか持たないため、bot と `run_once.py` などを同じ
+`funds_state.json` に対して同時に動かすと更新が失われることがあります。
+このクラスは残高を SQLite（WAL モード）に置き、各操作を `BEGIN IMMEDIATE` の
+トランザクションで「読み取り → 判定 → 更新」するので、プロセスをまたいでも
+reserve / confirm が原子的になります。API は FundManager と同じです。
+  - available_fund() -> float
+  - place_order(cost, order_id=None) -> bool
+  - add_funds(amount, order_id=None)
+  - reserve(cost, order_id=None) -> bool
+  - confirm(cost, order_id=None)
+  - release(cost, order_id=None)
+  - pay_fee(fee, order_id=None) -> float
+  - record_realized_pnl(pnl, order_id=None)
+  - movements(order_id=None) -> list      # 入出金の記録（movements テーブル）
+  - ledger -> SqliteLedger                 # 複式簿記の台帳（FUND_LEDGER=1 のとき、ledger テーブル）
+
+DB ファイルは state_file の拡張子を .db にしたもの（funds_state.db）です。
+台帳の仕訳は残高の更新と同じトランザクションで書くので、複数のプロセスが同じ台帳に記録しても
+残高と食い違いません。照会 API は funds.Ledger と同じです。仕訳ごとの勘定残高を
+ledger_balances テーブルに持つので、balance_at は (account, ts) の索引で O(log n) で引けます。
+初回は既存の funds_state.json の残高を取り込みます。FUND_BACKEND=sqlite で有効になります。
+"""
+
+from typing import Callable, Dict, List, Optional
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from funds import (ACCOUNT_ADJUSTMENT, ACCOUNT_COST_BASIS, ACCOUNT_DEPOSIT, ACCOUNT_EXCHANGE, ACCOUNT_FEES,
+                   ACCOUNT_FREE, ACCOUNT_OPENING, ACCOUNT_PNL, ACCOUNT_RESERVED)
+
+try:
+    from metrics import timed as _timed
+except ImportError:
+    from contextlib import nullcontext as _nullcontext
+
+    def _timed(name, **labels):
+        return _nullcontext()
+
+try:
+    from tracing import traced
+except ImportError:
+    def traced(name=None):
+        return lambda fn: fn
+
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS state ("
+    " id INTEGER PRIMARY KEY CHECK (id = 1), available REAL NOT NULL, reserved REAL NOT NULL,"
+    " seq INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS movements ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, kind TEXT NOT NULL, amount REAL NOT NULL,"
+    " order_id TEXT, pid INTEGER)",
+    "CREATE INDEX IF NOT EXISTS movements_order ON movements(order_id)",
+    "CREATE TABLE IF NOT EXISTS ledger ("
+    " seq INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, kind TEXT NOT NULL, order_id TEXT,"
+    " debit TEXT NOT NULL, credit TEXT NOT NULL, amount REAL NOT NULL, pid INTEGER)",
+    "CREATE INDEX IF NOT EXISTS ledger_order ON ledger(order_id)",
+    "CREATE INDEX IF NOT EXISTS ledger_ts ON ledger(ts)",
+    # 仕訳 seq を記帳した直後の勘定残高（balance_at 用。仕訳 1 件につき debit / credit の 2 行）
+    "CREATE TABLE IF NOT EXISTS ledger_balances ("
+    " account TEXT NOT NULL, seq INTEGER NOT NULL, ts REAL NOT NULL, balance REAL NOT NULL,"
+    " PRIMARY KEY (account, seq))",
+    "CREATE INDEX IF NOT EXISTS ledger_balances_ts ON ledger_balances(account, ts, seq)",
+)
+
+_LEDGER_COLUMNS = ('seq', 'ts', 'kind', 'order_id', 'debit', 'credit', 'amount')
+
+
+def _record_balances(conn: sqlite3.Connection, seq: int, ts: float, debit: str, credit: str, amount: float) -> None:
+    """仕訳 seq の後の debit / credit 勘定の残高を ledger_balances に書く（トランザクション内で呼ぶ）。"""
+    for account, delta in ((debit, amount), (credit, -amount)):
+        row = conn.execute('SELECT balance FROM ledger_balances WHERE account = ? ORDER BY seq DESC LIMIT 1',
+                           (account,)).fetchone()
+        conn.execute('INSERT INTO ledger_balances (account, seq, ts, balance) VALUES (?, ?, ?, ?)',
+                     (account, seq, ts, (float(row[0]) if row else 0.0) + delta))
+
+
+class SqliteLedger:
+    """ledger テーブルを funds.Ledger と同じ API で照会するクラス。
+
+    仕訳は SqliteFundManager のトランザクション内で書かれる（post はこのクラスには無い）。
+    """
+
+    def __init__(self, conn: Callable[[], sqlite3.Connection]):
+        self._conn = conn
+
+    def _entries(self, where: str = '', params: tuple = ()) -> List[dict]:
+        rows = self._conn().execute(f"SELECT {', '.join(_LEDGER_COLUMNS)} FROM ledger {where} ORDER BY seq",
+                                    params).fetchall()
+        return [dict(zip(_LEDGER_COLUMNS, r)) for r in rows]
+
+    def balance(self, account: str) -> float:
+        row = self._conn().execute('SELECT balance FROM ledger_balances WHERE account = ? ORDER BY seq DESC LIMIT 1',
+                                   (account,)).fetchone()
+        return float(row[0]) if row else 0.0
+
+    def balances(self) -> Dict[str, float]:
+        out: Dict[str, float] = {}
+        conn = self._conn()
+        for account, total in conn.execute('SELECT debit, SUM(amount) FROM ledger GROUP BY debit'):
+            out[account] = out.get(account, 0.0) + float(total)
+        for account, total in conn.execute('SELECT credit, SUM(amount) FROM ledger GROUP BY credit'):
+            out[account] = out.get(account, 0.0) - float(total)
+        return out
+
+    def balance_at(self, account: str, ts: float) -> float:
+        """時刻 ts 時点（ts ちょうどの仕訳を含む）の勘定残高。"""
+        row = self._conn().execute(
+            'SELECT balance FROM ledger_balances WHERE account = ? AND ts <= ? ORDER BY ts DESC, seq DESC LIMIT 1',
+            (account, float(ts))).fetchone()
+        return float(row[0]) if row else 0.0
+
+    def entries_for_order(self, order_id) -> List[dict]:
+        return self._entries('WHERE order_id = ?', (str(order_id),))
+
+    def entries_between(self, start_ts: float, end_ts: float) -> List[dict]:
+        return self._entries('WHERE ts >= ? AND ts <= ?', (float(start_ts), float(end_ts)))
+
+    def verify(self, tolerance: float = 1e-6) -> bool:
+        """全勘定の残高合計が 0（借方と貸方が一致）しているか。"""
+        return abs(sum(self.balances().values())) <= tolerance
+
+    def __len__(self) -> int:
+        return int(self._conn().execute('SELECT COUNT(*) FROM ledger').fetchone()[0])
+
+    def sync(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __repr__(self) -> str:
+        return f"<SqliteLedger entries={len(self)}>"
+
+
+class SqliteFundManager:
+    """SQLite の 1 行に残高を持ち、トランザクションで更新する FundManager 互換クラス。"""
+
+    def __init__(self, initial_fund: float = 0.0, state_file: Optional[str] = None, db_file: Optional[str] = None,
+                 synchronous: Optional[str] = None, busy_timeout: float = 30.0, record_movements: bool = True,
+                 ledger: Optional[bool] = None):
+        self._state_file = Path(state_file) if state_file else Path('funds_state.json')
+        self._db_file = Path(db_file) if db_file else self._state_file.with_suffix('.db')
+        self._synchronous = str(synchronous or os.getenv('FUND_SQLITE_SYNC', 'NORMAL')).upper()
+        self._busy_timeout = float(busy_timeout)
+        self._record_movements = bool(record_movements)
+        self._local = threading.local()
+        self._init_db(float(initial_fund or 0.0))
+        self.ledger: Optional[SqliteLedger] = None
+        if ledger is None:
+            ledger = str(os.getenv('FUND_LEDGER', '0')).lower() in ('1', 'true', 'yes', 'on')
+        if ledger:
+            self._open_ledger()
+
+    # --- 接続 ---
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            # 接続はスレッド・プロセスごとに持つ（fork 後の接続は使い回さない）
+            conn = sqlite3.connect(str(self._db_file), timeout=self._busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            if self._synchronous in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+                conn.execute(f'PRAGMA synchronous={self._synchronous}')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self, initial: float) -> None:
+        conn = self._conn()
+        for stmt in _SCHEMA:
+            conn.execute(stmt)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM state WHERE id = 1').fetchone() is None:
+                available, reserved = initial, 0.0
+                # 既存の JSON の状態があれば取り込む
+                try:
+                    if self._state_file.exists():
+                        raw = json.loads(self._state_file.read_text(encoding='utf-8'))
+                        available = float(raw.get('available', initial))
+                        reserved = float(raw.get('reserved', 0.0))
+                except Exception as e:
+                    print(f"⚠️ {self._state_file} の取り込みに失敗しました: {e}")
+                conn.execute('INSERT INTO state (id, available, reserved, seq) VALUES (1, ?, ?, 0)',
+                             (available, reserved))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _transaction(self, fn):
+        """BEGIN IMMEDIATE で書き込みロックを取り、fn(available, reserved) の結果を反映する。
+
+        fn は (new_available, new_reserved, result, movements, postings) を返す。
+        postings は台帳の仕訳 (kind, debit, credit, amount, order_id) で、台帳が有効なときだけ書く。
+        """
+        conn = self._conn()
+        while True:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                break
+            except sqlite3.OperationalError as e:
+                # busy_timeout を超えても取れない場合だけここに来る
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                time.sleep(0.01)
+        try:
+            available, reserved = conn.execute('SELECT available, reserved FROM state WHERE id = 1').fetchone()
+            new_available, new_reserved, result, moves, postings = fn(float(available), float(reserved))
+            if (new_available, new_reserved) != (available, reserved):
+                conn.execute('UPDATE state SET available = ?, reserved = ?, seq = seq + 1 WHERE id = 1',
+                             (new_available, new_reserved))
+            if moves and self._record_movements:
+                now = time.time()
+                pid = os.getpid()
+                rows = [(now, kind, amount, None if oid is None else str(oid), pid) for kind, amount, oid in moves]
+                conn.executemany('INSERT INTO movements (ts, kind, amount, order_id, pid) VALUES (?, ?, ?, ?, ?)', rows)
+            if postings and self.ledger is not None:
+                self._post(conn, postings)
+            with _timed('persist_write_duration_seconds', store='funds_sqlite'):
+                conn.execute('COMMIT')
+            return result
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    # --- 台帳 ---
+    def _post(self, conn: sqlite3.Connection, postings) -> None:
+        """仕訳をトランザクション内で ledger テーブルに書く（amount が 0 以下のものは書かない）。"""
+        now = time.time()
+        last = conn.execute('SELECT MAX(ts) FROM ledger').fetchone()[0]
+        if last is not None and now < float(last):
+            # 時刻の索引を単調に保つ（プロセス間で時計がずれた場合は直前の時刻に揃える）
+            now = float(last)
+        pid = os.getpid()
+        for kind, debit, credit, amount, oid in postings:
+            amount = float(amount)
+            if amount <= 0:
+                continue
+            cur = conn.execute('INSERT INTO ledger (ts, kind, order_id, debit, credit, amount, pid)'
+                               ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (now, kind, None if oid is None else str(oid), debit, credit, amount, pid))
+            _record_balances(conn, cur.lastrowid, now, debit, credit, amount)
+
+    def _backfill_balances(self) -> None:
+        """ledger_balances が無かった頃の仕訳の残高を埋める。"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('SELECT seq, ts, debit, credit, amount FROM ledger'
+                                ' WHERE seq > (SELECT COALESCE(MAX(seq), 0) FROM ledger_balances) ORDER BY seq').fetchall()
+            for seq, ts, debit, credit, amount in rows:
+                _record_balances(conn, seq, float(ts), debit, credit, float(amount))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _open_ledger(self) -> None:
+        # 台帳の cash 勘定を現在の残高に合わせる（初回は開始残高、以降は差分を調整仕訳として記録）
+        self.ledger = SqliteLedger(self._conn)
+        self._backfill_balances()
+
+        def apply(av, rs):
+            kind = 'opening' if len(self.ledger) == 0 else 'adjustment'
+            source = ACCOUNT_OPENING if kind == 'opening' else ACCOUNT_ADJUSTMENT
+            postings = []
+            for account, target in ((ACCOUNT_FREE, av - rs), (ACCOUNT_RESERVED, rs)):
+                diff = float(target) - self.ledger.balance(account)
+                if diff > 1e-9:
+                    postings.append((kind, account, source, diff, None))
+                elif diff < -1e-9:
+                    postings.append((kind, source, account, -diff, None))
+            return av, rs, None, [], postings
+        self._transaction(apply)
+
+    @staticmethod
+    def _amount(value) -> float:
+        try:
+            return float(value or 0.0)
+        except Exception:
+            return 0.0
+
+    # --- 基本 API ---
+    def available_fund(self) -> float:
+        try:
+            available, reserved = self._conn().execute('SELECT available, reserved FROM state WHERE id = 1').fetchone()
+            return float(max(0.0, available - reserved))
+        except Exception:
+            return 0.0
+
+    @traced('SqliteFundManager.add_funds')
+    def add_funds(self, amount: float, order_id: Optional[str] = None) -> None:
+        a = self._amount(amount)
+        if a <= 0:
+            return
+        source = ACCOUNT_DEPOSIT if order_id is None else ACCOUNT_EXCHANGE
+        self._transaction(lambda av, rs: (av + a, rs, None, [('deposit', a, order_id)],
+                                          [('deposit', ACCOUNT_FREE, source, a, order_id)]))
+
+    # Legacy wrapper
+    def add_fund(self, amount: float, order_id: Optional[str] = None) -> None:
+        return self.add_funds(amount, order_id=order_id)
+
+    # --- 予約 API ---
+    @traced('SqliteFundManager.reserve')
+    def reserve(self, cost: float, order_id: Optional[str] = None) -> bool:
+        c = self._amount(cost)
+        if c <= 0:
+            return False
+
+        def apply(av, rs):
+            if max(0.0, av - rs) < c:
+                return av, rs, False, [], []
+            return av, rs + c, True, [('reserve', c, order_id)], [('reserve', ACCOUNT_RESERVED, ACCOUNT_FREE, c, order_id)]
+        return self._transaction(apply)
+
+    @traced('SqliteFundManager.confirm')
+    def confirm(self, cost: float, order_id: Optional[str] = None) -> None:
+        c = self._amount(cost)
+        if c <= 0:
+            return
+
+        def apply(av, rs):
+            # FundManager.confirm と同じ: 予約分を外し、足りない分だけ available から差し引く
+            consume = min(rs, c)
+            remain = min(max(0.0, c - consume), max(0.0, av))
+            postings = [('confirm', ACCOUNT_FREE, ACCOUNT_RESERVED, consume, order_id),
+                        ('confirm', ACCOUNT_EXCHANGE, ACCOUNT_FREE, remain, order_id)]
+            return max(0.0, av - remain), max(0.0, rs - consume), None, [('confirm', c, order_id)], postings
+        self._transaction(apply)
+
+    @traced('SqliteFundManager.release')
+    def release(self, cost: float, order_id: Optional[str] = None) -> None:
+        c = self._amount(cost)
+        if c <= 0:
+            return
+
+        def apply(av, rs):
+            dec = min(rs, c)
+            return (av, max(0.0, rs - dec), None, [('release', dec, order_id)],
+                    [('release', ACCOUNT_FREE, ACCOUNT_RESERVED, dec, order_id)])
+        self._transaction(apply)
+
+    # --- 互換性のための旧 API ---
+    @traced('SqliteFundManager.place_order')
+    def place_order(self, cost: float, order_id: Optional[str] = None) -> bool:
+        c = self._amount(cost)
+        if c <= 0:
+            return False
+
+        def apply(av, rs):
+            if max(0.0, av - rs) < c:
+                return av, rs, False, [], []
+            return max(0.0, av - c), rs, True, [('order', c, order_id)], [('order', ACCOUNT_EXCHANGE, ACCOUNT_FREE, c, order_id)]
+        return self._transaction(apply)
+
+    @traced('SqliteFundManager.pay_fee')
+    def pay_fee(self, fee: float, order_id: Optional[str] = None) -> float:
+        f = self._amount(fee)
+        if f <= 0:
+            return 0.0
+
+        def apply(av, rs):
+            # FundManager.pay_fee と同じ: 予約分に食い込んでも差し引く（available は 0 未満にしない）
+            charged = min(f, max(0.0, av))
+            return av - charged, rs, charged, [('fee', charged, order_id)], [('fee', ACCOUNT_FEES, ACCOUNT_FREE, charged, order_id)]
+        return self._transaction(apply)
+
+    @traced('SqliteFundManager.record_realized_pnl')
+    def record_realized_pnl(self, pnl: float, order_id: Optional[str] = None) -> None:
+        p = self._amount(pnl)
+        if p == 0:
+            return
+        if p > 0:
+            posting = ('realized_pnl', ACCOUNT_COST_BASIS, ACCOUNT_PNL, p, order_id)
+        else:
+            posting = ('realized_pnl', ACCOUNT_PNL, ACCOUNT_COST_BASIS, -p, order_id)
+        self._transaction(lambda av, rs: (av, rs, None, [('realized_pnl', p, order_id)], [posting]))
+
+    def movements(self, order_id: Optional[str] = None) -> List[dict]:
+        conn = self._conn()
+        if order_id is None:
+            rows = conn.execute('SELECT ts, kind, amount, order_id, pid FROM movements ORDER BY id').fetchall()
+        else:
+            rows = conn.execute('SELECT ts, kind, amount, order_id, pid FROM movements WHERE order_id = ? ORDER BY id',
+                                (str(order_id),)).fetchall()
+        return [dict(zip(('ts', 'kind', 'amount', 'order_id', 'pid'), r)) for r in rows]
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        return True
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            self._local.conn = None
+
+    def __repr__(self) -> str:
+        try:
+            available, reserved = self._conn().execute('SELECT available, reserved FROM state WHERE id = 1').fetchone()
+        except Exception:
+            available, reserved = 0.0, 0.0
+        return f"<SqliteFundManager available={available:.2f} reserved={reserved:.2f} file={str(self._db_file)}>"
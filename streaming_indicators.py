@@ -0,0 +1,315 @@
+"""ストリーミング指標エンジン: 1本ずつローソク足を受け取り O(1) で更新
+
+`compute_ema` / `compute_rsi` / `compute_atr` / `compute_sma_from_list` は呼び出しの
+たびに全履歴を走査しますが、ここでは状態を持つ指標オブジェクトが新しい足だけを
+取り込みます。提供するクラス:
+  - SMA(period)           # 単純移動平均（リングバッファ + 累積和）
+  - EMA(period)           # 指数移動平均（最初の period 本の SMA で初期化）
+  - WilderRSI(period)     # Wilder 平滑化 RSI
+  - ATR(period)           # Wilder 平滑化 ATR
+  - RollingHigh(period)   # 直近 period 本の高値（単調デック、償却 O(1)）
+  - IndicatorEngine       # 上記をまとめ、タイムスタンプ単位で更新・スナップショット保存
+
+最新の足は未確定のことがあるため、同じタイムスタンプの足が再度来た場合は
+直前の確定状態に戻してから適用し直します。
+"""
+
+from typing import Dict, Iterable, Optional
+from collections import deque
+import json
+import os
+from pathlib import Path
+
+
+class SMA:
+    def __init__(self, period: int):
+        self.period = int(period)
+        self._window: deque = deque()
+        self._sum = 0.0
+        self.value: Optional[float] = None
+
+    def update(self, x: float) -> Optional[float]:
+        self._window.append(x)
+        self._sum += x
+        if len(self._window) > self.period:
+            self._sum -= self._window.popleft()
+        if len(self._window) == self.period:
+            self.value = self._sum / self.period
+        return self.value
+
+    def state(self) -> dict:
+        return {'window': list(self._window), 'value': self.value}
+
+    def load_state(self, st: dict) -> None:
+        self._window = deque(float(v) for v in st.get('window', []))
+        # 累積誤差を持ち越さないよう再計算（period 本程度なので定数時間）
+        self._sum = sum(self._window)
+        self.value = st.get('value')
+
+
+class EMA:
+    def __init__(self, period: int):
+        self.period = int(period)
+        self._k = 2.0 / (self.period + 1)
+        self._count = 0
+        self._seed = 0.0
+        self.value: Optional[float] = None
+
+    def update(self, x: float) -> Optional[float]:
+        self._count += 1
+        if self._count < self.period:
+            self._seed += x
+        elif self._count == self.period:
+            self._seed += x
+            self.value = self._seed / self.period
+        else:
+            self.value = x * self._k + self.value * (1 - self._k)
+        return self.value
+
+    def state(self) -> dict:
+        return {'count': self._count, 'seed': self._seed, 'value': self.value}
+
+    def load_state(self, st: dict) -> None:
+        self._count = int(st.get('count', 0))
+        self._seed = float(st.get('seed', 0.0))
+        self.value = st.get('value')
+
+
+class WilderRSI:
+    def __init__(self, period: int = 14):
+        self.period = int(period)
+        self._prev: Optional[float] = None
+        self._count = 0
+        self._avg_gain = 0.0
+        self._avg_loss = 0.0
+        self.value: Optional[float] = None
+
+    def update(self, close: float) -> Optional[float]:
+        if self._prev is None:
+            self._prev = close
+            return None
+        delta = close - self._prev
+        self._prev = close
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        self._count += 1
+        p = self.period
+        if self._count <= p:
+            # 最初の period 本は単純平均で初期化
+            self._avg_gain += gain / p
+            self._avg_loss += loss / p
+            if self._count < p:
+                return None
+        else:
+            self._avg_gain = (self._avg_gain * (p - 1) + gain) / p
+            self._avg_loss = (self._avg_loss * (p - 1) + loss) / p
+        if self._avg_loss == 0:
+            self.value = 100.0
+        else:
+            rs = self._avg_gain / self._avg_loss
+            self.value = 100 - (100 / (1 + rs))
+        return self.value
+
+    def state(self) -> dict:
+        return {'prev': self._prev, 'count': self._count, 'avg_gain': self._avg_gain,
+                'avg_loss': self._avg_loss, 'value': self.value}
+
+    def load_state(self, st: dict) -> None:
+        self._prev = st.get('prev')
+        self._count = int(st.get('count', 0))
+        self._avg_gain = float(st.get('avg_gain', 0.0))
+        self._avg_loss = float(st.get('avg_loss', 0.0))
+        self.value = st.get('value')
+
+
+class ATR:
+    def __init__(self, period: int = 14):
+        self.period = int(period)
+        self._prev_close: Optional[float] = None
+        self._count = 0
+        self._seed = 0.0
+        self.value: Optional[float] = None
+
+    def update(self, high: float, low: float, close: float) -> Optional[float]:
+        if self._prev_close is None:
+            self._prev_close = close
+            return None
+        pc = self._prev_close
+        self._prev_close = close
+        tr = max(high - low, abs(high - pc), abs(low - pc))
+        self._count += 1
+        p = self.period
+        if self._count < p:
+            self._seed += tr
+        elif self._count == p:
+            self._seed += tr
+            self.value = self._seed / p
+        else:
+            self.value = (self.value * (p - 1) + tr) / p
+        return self.value
+
+    def state(self) -> dict:
+        return {'prev_close': self._prev_close, 'count': self._count, 'seed': self._seed, 'value': self.value}
+
+    def load_state(self, st: dict) -> None:
+        self._prev_close = st.get('prev_close')
+        self._count = int(st.get('count', 0))
+        self._seed = float(st.get('seed', 0.0))
+        self.value = st.get('value')
+
+
+class RollingHigh:
+    def __init__(self, period: int = 20):
+        self.period = int(period)
+        self._index = 0
+        # (index, high) の単調減少デック
+        self._dq: deque = deque()
+        self.value: Optional[float] = None
+
+    def update(self, high: float) -> Optional[float]:
+        i = self._index
+        self._index += 1
+        while self._dq and self._dq[-1][1] <= high:
+            self._dq.pop()
+        self._dq.append((i, high))
+        while self._dq[0][0] <= i - self.period:
+            self._dq.popleft()
+        self.value = self._dq[0][1]
+        return self.value
+
+    def state(self) -> dict:
+        return {'index': self._index, 'dq': [list(e) for e in self._dq], 'value': self.value}
+
+    def load_state(self, st: dict) -> None:
+        self._index = int(st.get('index', 0))
+        self._dq = deque((int(i), float(h)) for i, h in st.get('dq', []))
+        self.value = st.get('value')
+
+
+class IndicatorEngine:
+    """`compute_indicators` と同じキーの指標を足ごとに O(1) で更新するエンジン。"""
+
+    def __init__(self, state_file: Optional[str] = None):
+        self._state_file = Path(state_file) if state_file else None
+        self._ind = {
+            'sma_short_50': SMA(50),
+            'sma_long_200': SMA(200),
+            'ema_12': EMA(12),
+            'ema_26': EMA(26),
+            'atr_14': ATR(14),
+            'rsi_14': WilderRSI(14),
+            'recent_high_20': RollingHigh(20),
+        }
+        self.last_ts: Optional[int] = None
+        self.latest_close: Optional[float] = None
+        # 最新足を適用する直前の状態（未確定足の差し替え用）
+        self._before_last: Optional[dict] = None
+        if self._state_file is not None:
+            self.load()
+
+    # --- 更新 ---
+    def _apply(self, row) -> None:
+        h = float(row[2])
+        l = float(row[3])
+        c = float(row[4])
+        ind = self._ind
+        ind['sma_short_50'].update(c)
+        ind['sma_long_200'].update(c)
+        ind['ema_12'].update(c)
+        ind['ema_26'].update(c)
+        ind['atr_14'].update(h, l, c)
+        ind['rsi_14'].update(c)
+        ind['recent_high_20'].update(h)
+        self.latest_close = c
+
+    def update(self, row) -> bool:
+        """足 [ts, o, h, l, c, v] を 1 本取り込む。新しい足が確定した場合 True を返す。"""
+        ts = int(row[0])
+        if self.last_ts is not None and ts < self.last_ts:
+            return False
+        if self.last_ts is not None and ts == self.last_ts:
+            if self._before_last is not None:
+                self._restore(self._before_last)
+            self._apply(row)
+            # _restore で 1 本前の足の時刻に戻っているので、差し替えた足の時刻に戻す
+            self.last_ts = ts
+            return False
+        self._before_last = self._snapshot()
+        self._apply(row)
+        self.last_ts = ts
+        return True
+
+    def feed(self, rows: Iterable) -> int:
+        """取得したウィンドウから未処理の足だけを取り込む。確定した新しい足の本数を返す。"""
+        rows = list(rows)
+        if not rows:
+            return 0
+        if self.last_ts is not None and int(rows[0][0]) > self.last_ts:
+            # 保存済み状態とウィンドウが連続していない -> ウィンドウから作り直す
+            self.reset()
+        start = len(rows)
+        if self.last_ts is not None:
+            # 末尾から遡って未処理部分の先頭を探す（新しい足の数に比例）
+            while start > 0 and int(rows[start - 1][0]) >= self.last_ts:
+                start -= 1
+        else:
+            start = 0
+        added = 0
+        for row in rows[start:]:
+            if self.update(row):
+                added += 1
+        return added
+
+    def reset(self) -> None:
+        for name, ind in list(self._ind.items()):
+            self._ind[name] = type(ind)(ind.period)
+        self.last_ts = None
+        self.latest_close = None
+        self._before_last = None
+
+    def values(self) -> Dict[str, Optional[float]]:
+        out: Dict[str, Optional[float]] = {name: ind.value for name, ind in self._ind.items()}
+        out['latest_close'] = self.latest_close
+        return out
+
+    # --- スナップショット ---
+    def _snapshot(self) -> dict:
+        return {
+            'last_ts': self.last_ts,
+            'latest_close': self.latest_close,
+            'indicators': {name: ind.state() for name, ind in self._ind.items()},
+        }
+
+    def _restore(self, snap: dict) -> None:
+        self.last_ts = snap.get('last_ts')
+        self.latest_close = snap.get('latest_close')
+        for name, st in snap.get('indicators', {}).items():
+            if name in self._ind:
+                self._ind[name].load_state(st)
+
+    def save(self) -> None:
+        if self._state_file is None:
+            return
+        try:
+            obj = {'current': self._snapshot(), 'before_last': self._before_last}
+            self._state_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._state_file.with_name(self._state_file.name + '.tmp')
+            tmp_path.write_text(json.dumps(obj, separators=(',', ':')), encoding='utf-8')
+            os.replace(str(tmp_path), str(self._state_file))
+        except Exception:
+            pass
+
+    def load(self) -> bool:
+        try:
+            if self._state_file is None or not self._state_file.exists():
+                return False
+            raw = json.loads(self._state_file.read_text(encoding='utf-8'))
+            self._restore(raw.get('current', {}))
+            self._before_last = raw.get('before_last')
+            return True
+        except Exception:
+            self.reset()
+            return False
+
+    def __repr__(self) -> str:
+        return f"<IndicatorEngine last_ts={self.last_ts} file={str(self._state_file)}>"
@@ -0,0 +1,192 @@
+"""structured_logging: キュー経由で書き出す構造化（JSON）ログ
+
+`log_debug` などのヘルパーは 1 件ごとに文字列を組み立てて `logging` と `print` の両方に
+書いていたため、売買ループの中でログの整形とファイル・標準出力への書き込みを待っていました。
+このモジュールでは
+  - 呼び出し側はレベルを確認してからレコードを上限付きキューに積むだけ（ブロックしない。
+    満杯のときは捨てて件数を数える）
+  - 整形と書き込みは QueueListener のスレッドが行う
+  - ファイルには 1 行 1 レコードの JSON（時刻・レベル・メッセージ・付加フィールド）を書き、
+    サイズで自前ローテーションする（外部の logrotate 設定は不要）
+  - 標準出力（systemd の journal）には従来どおりメッセージだけを出す
+を行います。
+  - setup_logging(name='ninibo', ...) -> logging.Logger   # 何度呼んでも 1 回だけ設定する
+  - setup_from_env(name='ninibo') -> logging.Logger       # LOG_* 環境変数から設定する
+  - JsonFormatter / dropped_records() / shutdown()
+"""
+
+from typing import Dict, List, Optional
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+
+DEFAULT_LOG_FILENAME = 'notify_bot.log'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 14
+
+# LogRecord が標準で持つ属性（これ以外は extra= で渡された付加フィールドとして JSON に出す）
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """LogRecord を 1 行の JSON にする。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            'ts': datetime.datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                out[key] = value
+        if record.exc_info:
+            out['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            out['exc'] = record.exc_text
+        if record.stack_info:
+            out['stack'] = record.stack_info
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """レコードを整形せずにキューへ積む。満杯なら捨てて数える。"""
+
+    def __init__(self, q: 'queue.Queue'):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 整形は QueueListener 側で行う（同じプロセス内なので例外情報もそのまま渡せる）
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_lock = threading.Lock()
+_listeners: Dict[str, logging.handlers.QueueListener] = {}
+_queue_handlers: Dict[str, _NonBlockingQueueHandler] = {}
+log_file_paths: Dict[str, Optional[str]] = {}
+
+
+def _level(value) -> int:
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).strip().upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def setup_logging(name: str = 'ninibo', level='INFO', log_file: Optional[str] = None,
+                  max_bytes: int = DEFAULT_MAX_BYTES, backup_count: int = DEFAULT_BACKUP_COUNT,
+                  console: bool = True, console_json: bool = False, queue_size: int = 10000) -> logging.Logger:
+    """name のロガーにキュー経由のハンドラを付ける（2 回目以降は既存のロガーを返す）。
+
+    Args:
+        log_file: JSON ログの出力先（None ならファイルには書かない）
+        max_bytes: このサイズを超えたら log_file.1, .2, ... にずらす（0 でローテーションしない）
+        console: 標準出力にもメッセージを出す
+        queue_size: 書き出し待ちの上限件数（超えた分は捨てる）
+    """
+    logger = logging.getLogger(name)
+    with _lock:
+        if name in _listeners:
+            return logger
+        handlers: List[logging.Handler] = []
+        if log_file:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+                fh = logging.handlers.RotatingFileHandler(log_file, maxBytes=max(0, int(max_bytes)),
+                                                          backupCount=max(0, int(backup_count)),
+                                                          encoding='utf-8', delay=True)
+                fh.setFormatter(JsonFormatter())
+                handlers.append(fh)
+            except Exception as e:
+                print(f"⚠️ ログファイルを開けません（標準出力のみに出します）: {e}")
+                log_file = None
+        if console:
+            sh = logging.StreamHandler(sys.stdout)
+            sh.setFormatter(JsonFormatter() if console_json else logging.Formatter('%(message)s'))
+            handlers.append(sh)
+        q: 'queue.Queue' = queue.Queue(maxsize=max(1, int(queue_size)))
+        qh = _NonBlockingQueueHandler(q)
+        listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=False)
+        for h in list(logger.handlers):
+            logger.removeHandler(h)
+        logger.addHandler(qh)
+        logger.setLevel(_level(level))
+        # ルートロガーの lastResort（stderr）に二重に出さない
+        logger.propagate = False
+        listener.start()
+        _listeners[name] = listener
+        _queue_handlers[name] = qh
+        log_file_paths[name] = log_file
+    return logger
+
+
+def setup_from_env(name: str = 'ninibo') -> logging.Logger:
+    """LOG_LEVEL / LOG_DIR / LOG_FILE / LOG_MAX_BYTES / LOG_BACKUP_COUNT / LOG_CONSOLE / LOG_CONSOLE_JSON から設定する。"""
+    log_file = os.getenv('LOG_FILE')
+    if log_file is None:
+        log_dir = os.getenv('LOG_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'))
+        log_file = os.path.join(log_dir, DEFAULT_LOG_FILENAME)
+    elif log_file.strip().lower() in ('', '0', 'none', 'off'):
+        log_file = None
+    try:
+        max_bytes = int(os.getenv('LOG_MAX_BYTES', str(DEFAULT_MAX_BYTES)))
+        backup_count = int(os.getenv('LOG_BACKUP_COUNT', str(DEFAULT_BACKUP_COUNT)))
+        queue_size = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+    except ValueError:
+        max_bytes, backup_count, queue_size = DEFAULT_MAX_BYTES, DEFAULT_BACKUP_COUNT, 10000
+    return setup_logging(
+        name,
+        level=os.getenv('LOG_LEVEL', 'INFO'),
+        log_file=log_file,
+        max_bytes=max_bytes,
+        backup_count=backup_count,
+        console=str(os.getenv('LOG_CONSOLE', '1')).lower() in ('1', 'true', 'yes', 'on'),
+        console_json=str(os.getenv('LOG_CONSOLE_JSON', '0')).lower() in ('1', 'true', 'yes', 'on'),
+        queue_size=queue_size,
+    )
+
+
+def dropped_records(name: str = 'ninibo') -> int:
+    """キューが満杯で捨てたレコード数。"""
+    qh = _queue_handlers.get(name)
+    return qh.dropped if qh is not None else 0
+
+
+def shutdown() -> None:
+    """キューに残ったレコードを書き出してからリスナーを止める（終了時に自動で呼ばれる）。"""
+    with _lock:
+        listeners = list(_listeners.items())
+        _listeners.clear()
+        _queue_handlers.clear()
+    for name, listener in listeners:
+        try:
+            listener.stop()
+        except Exception:
+            pass
+        for h in listener.handlers:
+            try:
+                h.close()
+            except Exception:
+                pass
+        logger = logging.getLogger(name)
+        for h in list(logger.handlers):
+            if isinstance(h, _NonBlockingQueueHandler):
+                logger.removeHandler(h)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,205 @@
+"""戦略パラメータのスイープ: 全 CPU コアでバックテストを並列実行してランキング表を出力
+
+`ninibo1127.py` の戦略定数（PROFIT_TAKE_PCT, BUY_MORE_PCT, MAX_NAMPIN,
+NAMPIN_INTERVAL, NAMPIN_INTERVAL_THIN）をグリッドまたはランダムに振り、`backtest.Backtester` で評価します。
+振れるのは run_bot が実際に参照する定数だけです。RSI_BUY_LEVEL / RSI_SELL_LEVEL / DYN_THRESHOLD_RATIO は
+generate_signals などのシグナル表示でしか使われず、どの値でも同じ結果になるため受け付けません。
+ローソク足は共有メモリ（multiprocessing.shared_memory）に一度だけ置き、
+各ワーカーは起動時にそこから読み込むため、タスクごとの転送はパラメータだけです。
+  - grid_params(space) -> list          # {"NAME": [v1, v2, ...]} の直積
+  - random_params(space, n, seed) -> list  # {"NAME": (lo, hi)} から一様サンプル
+  - run_sweep(candles, param_sets, ...) -> list  # pnl の降順に並んだ結果
+  - format_table(results) -> str
+
+使い方:
+  python sweep.py candles.csv --grid PROFIT_TAKE_PCT=5,10,15 --grid MAX_NAMPIN=1,3
+  python sweep.py candles.csv --random BUY_MORE_PCT=2:15 --random NAMPIN_INTERVAL=0.02:0.2 -n 200
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+from array import array
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+
+
+# run_bot の売買判定が参照する定数だけを振る
+SWEEPABLE = (
+    'PROFIT_TAKE_PCT', 'BUY_MORE_PCT', 'MAX_NAMPIN', 'NAMPIN_INTERVAL', 'NAMPIN_INTERVAL_THIN',
+)
+
+# ランキングに使う指標と表の列
+TABLE_COLUMNS = ('pnl', 'pnl_pct', 'max_drawdown_pct', 'trades', 'fees_jpy')
+
+
+def grid_params(space: Dict[str, Sequence]) -> List[Dict[str, float]]:
+    names = list(space)
+    return [dict(zip(names, combo)) for combo in itertools.product(*(space[n] for n in names))]
+
+
+def random_params(space: Dict[str, Tuple[float, float]], n: int, seed: Optional[int] = None) -> List[Dict[str, float]]:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(int(n)):
+        params = {}
+        for name, (lo, hi) in space.items():
+            if isinstance(lo, int) and isinstance(hi, int):
+                params[name] = rng.randint(lo, hi)
+            else:
+                params[name] = rng.uniform(float(lo), float(hi))
+        out.append(params)
+    return out
+
+
+# --- ワーカー側 ---
+_worker_candles: List[list] = []
+_worker_books = None
+_worker_options: dict = {}
+
+
+def _init_worker(shm_name: str, n_rows: int, books, options: dict) -> None:
+    global _worker_candles, _worker_books, _worker_options
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        flat = shm.buf.cast('d')
+        try:
+            _worker_candles = [
+                [int(flat[i * 6])] + [flat[i * 6 + j] for j in range(1, 6)] for i in range(n_rows)
+            ]
+        finally:
+            flat.release()
+    finally:
+        shm.close()
+    _worker_books = books
+    _worker_options = options
+    # run_bot の注文ログでワーカーの標準出力が埋まらないようにする
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _run_one(params: Dict[str, float]) -> dict:
+    from backtest import Backtester
+    with tempfile.TemporaryDirectory(prefix='ninibo_sweep_') as work_dir:
+        bt = Backtester(_worker_candles, _worker_books, work_dir=work_dir, params=params, **_worker_options)
+        try:
+            result = bt.run()
+        except Exception as e:
+            result = {'error': str(e)}
+    result['params'] = params
+    return result
+
+
+# --- 親プロセス側 ---
+def run_sweep(candles: List[list], param_sets: List[Dict[str, float]], orderbooks=None,
+              initial_fund: float = 20000.0, tick_sec: int = 300, initial_positions=None,
+              workers: Optional[int] = None, rank_by: str = 'pnl') -> List[dict]:
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    for params in param_sets:
+        unknown = [name for name in params if name not in SWEEPABLE]
+        if unknown:
+            raise ValueError(f"not a sweepable parameter: {', '.join(unknown)}")
+
+    flat = array('d')
+    for r in candles:
+        flat.extend(float(v) for v in r[:6])
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(flat) * flat.itemsize))
+    try:
+        shm.buf[:len(flat) * flat.itemsize] = flat.tobytes()
+        options = {'initial_fund': initial_fund, 'tick_sec': tick_sec, 'initial_positions': initial_positions}
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(shm.name, len(candles), orderbooks, options)) as pool:
+            results = list(pool.map(_run_one, param_sets, chunksize=1))
+    finally:
+        shm.close()
+        shm.unlink()
+    ok = [r for r in results if 'error' not in r]
+    failed = [r for r in results if 'error' in r]
+    ok.sort(key=lambda r: r.get(rank_by, 0.0), reverse=True)
+    return ok + failed
+
+
+def format_table(results: List[dict], top: Optional[int] = None) -> str:
+    rows = results[:top] if top else results
+    names = sorted({name for r in rows for name in r.get('params', {})})
+    header = ['rank'] + names + list(TABLE_COLUMNS)
+    lines = []
+    for i, r in enumerate(rows, 1):
+        if 'error' in r:
+            cells = [str(i)] + [f"{r['params'].get(n, '')}" for n in names] + ['error: ' + r['error']]
+        else:
+            cells = [str(i)] + [f"{r['params'].get(n, ''):.4g}" for n in names]
+            cells += [f"{r[c]:.2f}" if isinstance(r[c], float) else str(r[c]) for c in TABLE_COLUMNS]
+        lines.append(cells)
+    widths = [max(len(h), *(len(c[k]) for c in lines if k < len(c))) for k, h in enumerate(header)]
+    out = ['  '.join(h.rjust(w) for h, w in zip(header, widths))]
+    for cells in lines:
+        out.append('  '.join(c.rjust(w) for c, w in zip(cells, widths)))
+    return '\n'.join(out)
+
+
+def _parse_value(text: str):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def main(argv: list) -> int:
+    import argparse
+    from backtest import load_ohlcv, load_orderbooks
+
+    ap = argparse.ArgumentParser(description='Parallel parameter sweep over run_bot strategy constants')
+    ap.add_argument('candles')
+    ap.add_argument('--orderbooks')
+    ap.add_argument('--positions', help='initial positions (positions_state.json format)')
+    ap.add_argument('--grid', action='append', default=[], help='NAME=v1,v2,...')
+    ap.add_argument('--random', action='append', default=[], help='NAME=lo:hi')
+    ap.add_argument('-n', type=int, default=100, help='number of random samples')
+    ap.add_argument('--seed', type=int)
+    ap.add_argument('--fund', type=float, default=float(os.getenv('INITIAL_FUND', '20000')))
+    ap.add_argument('--tick-sec', type=int, default=300)
+    ap.add_argument('--workers', type=int)
+    ap.add_argument('--rank-by', default='pnl')
+    ap.add_argument('--top', type=int, default=20)
+    ap.add_argument('--out', help='write all results as JSON')
+    args = ap.parse_args(argv[1:])
+
+    grid = {}
+    for spec in args.grid:
+        name, values = spec.split('=', 1)
+        grid[name.strip()] = [_parse_value(v) for v in values.split(',')]
+    space = {}
+    for spec in args.random:
+        name, rng = spec.split('=', 1)
+        lo, hi = rng.split(':', 1)
+        space[name.strip()] = (_parse_value(lo), _parse_value(hi))
+    if not grid and not space:
+        print("Specify at least one --grid or --random parameter")
+        return 2
+    param_sets = grid_params(grid) if grid else [{}]
+    if space:
+        samples = random_params(space, args.n, args.seed)
+        param_sets = [dict(g, **s) for g in param_sets for s in samples]
+
+    positions = None
+    if args.positions:
+        with open(args.positions, 'r', encoding='utf-8') as fh:
+            positions = json.load(fh)
+    candles = load_ohlcv(args.candles)
+    books = load_orderbooks(args.orderbooks) if args.orderbooks else None
+    results = run_sweep(candles, param_sets, books, initial_fund=args.fund, tick_sec=args.tick_sec,
+                        initial_positions=positions, workers=args.workers, rank_by=args.rank_by)
+    print(format_table(results, args.top))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as fh:
+            json.dump(results, fh, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv))
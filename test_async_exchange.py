@@ -0,0 +1,143 @@
+"""async_exchange.AsyncExchangeFacade のスナップショット取得と同期 API のテスト"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from async_exchange import AsyncExchangeFacade
+
+
+class SyncExchange:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.failing = set()
+        self._lock = threading.Lock()
+        self.id = 'fake'
+
+    def _record(self, name):
+        with self._lock:
+            self.calls.append(name)
+        if self.delay:
+            time.sleep(self.delay)
+        if name in self.failing:
+            raise RuntimeError(f"{name} failed")
+
+    def fetch_ticker(self, pair):
+        self._record('fetch_ticker')
+        return {'symbol': pair, 'last': 100.0}
+
+    def fetch_order_book(self, pair, limit=None):
+        self._record('fetch_order_book')
+        return {'bids': [[99.0, 1.0]], 'asks': [[101.0, 1.0]], 'limit': limit}
+
+    def fetch_balance(self):
+        self._record('fetch_balance')
+        return {'free': {'JPY': 1000.0}}
+
+    def fetch_open_orders(self, pair=None):
+        self._record('fetch_open_orders')
+        return []
+
+    def create_order(self, pair, type, side, amount, price=None):
+        self._record('create_order')
+        return {'id': '1'}
+
+
+class AsyncOnlyExchange:
+    def __init__(self):
+        self.calls = []
+
+    async def fetch_ticker(self, pair):
+        self.calls.append('fetch_ticker')
+        await asyncio.sleep(0)
+        return {'symbol': pair, 'last': 200.0}
+
+    async def fetch_order_book(self, pair, limit=None):
+        self.calls.append('fetch_order_book')
+        return {'bids': [], 'asks': []}
+
+    async def fetch_markets(self):
+        return ['BTC/JPY']
+
+
+@pytest.fixture
+def facade_for():
+    made = []
+
+    def make(exchange, **kwargs):
+        facade = AsyncExchangeFacade(exchange, **kwargs)
+        made.append(facade)
+        return facade
+    yield make
+    for facade in made:
+        facade.close()
+
+
+def test_tick_prefetches_only_market_data_by_default(facade_for):
+    raw = SyncExchange()
+    ex = facade_for(raw)
+    snap = ex.begin_tick('BTC/JPY')
+    assert sorted(raw.calls) == ['fetch_order_book', 'fetch_ticker']
+    assert 'balance' not in snap and 'open_orders' not in snap
+    # スナップショットから返すので追加の呼び出しは無い
+    assert ex.fetch_ticker('BTC/JPY')['last'] == 100.0
+    assert ex.fetch_order_book('BTC/JPY')['asks'] == [[101.0, 1.0]]
+    assert len(raw.calls) == 2
+    # 引数付きの呼び出しや取得していないエンドポイントは元の取引所へ
+    assert ex.fetch_order_book('BTC/JPY', 5)['limit'] == 5
+    assert ex.fetch_balance()['free']['JPY'] == 1000.0
+    assert raw.calls[-2:] == ['fetch_order_book', 'fetch_balance']
+    ex.end_tick()
+
+
+def test_private_prefetch_is_opt_in(facade_for):
+    raw = SyncExchange()
+    ex = facade_for(raw, include_private=True)
+    snap = ex.begin_tick('BTC/JPY')
+    assert sorted(raw.calls) == ['fetch_balance', 'fetch_open_orders', 'fetch_order_book', 'fetch_ticker']
+    assert ex.fetch_balance() is snap['balance']
+    assert ex.fetch_open_orders('BTC/JPY') == []
+    assert len(raw.calls) == 4
+    # 注文後は残高・未約定注文を取り直す
+    ex.create_order('BTC/JPY', 'market', 'buy', 0.001)
+    ex.fetch_balance()
+    assert raw.calls[-1] == 'fetch_balance'
+
+
+def test_requests_run_concurrently(facade_for):
+    raw = SyncExchange(delay=0.2)
+    ex = facade_for(raw, include_private=True)
+    ex.begin_tick('BTC/JPY')
+    assert ex.last_tick_sec < 0.6
+
+
+def test_failed_endpoint_falls_back_to_direct_call(facade_for):
+    raw = SyncExchange()
+    raw.failing.add('fetch_order_book')
+    ex = facade_for(raw)
+    snap = ex.begin_tick('BTC/JPY')
+    assert 'order_book' not in snap and 'fetch_order_book failed' in snap['errors']['order_book']
+    raw.failing.clear()
+    assert ex.fetch_order_book('BTC/JPY')['bids'] == [[99.0, 1.0]]
+
+
+def test_end_tick_drops_snapshot(facade_for):
+    raw = SyncExchange()
+    ex = facade_for(raw)
+    ex.begin_tick('BTC/JPY')
+    ex.end_tick()
+    ex.fetch_ticker('BTC/JPY')
+    assert raw.calls.count('fetch_ticker') == 2
+
+
+def test_coroutine_exchange_through_sync_facade(facade_for):
+    raw = AsyncOnlyExchange()
+    ex = facade_for(raw)
+    assert ex.begin_tick('BTC/JPY')['ticker']['last'] == 200.0
+    assert ex.fetch_ticker('BTC/JPY')['last'] == 200.0
+    assert ex.fetch_ticker('ETH/JPY')['symbol'] == 'ETH/JPY'
+    # 委譲された属性のコルーチンも同期的に呼べる
+    assert ex.fetch_markets() == ['BTC/JPY']
@@ -0,0 +1,70 @@
+"""backtest の先読み防止と手数料の差し引きのテスト"""
+
+import pytest
+
+from backtest import BacktestExchange, Backtester, infer_timeframe_ms
+from funds import ACCOUNT_FEES, FundManager
+
+HOUR = 60 * 60 * 1000
+
+
+def candles(n=6, start=1_700_000_000_000):
+    # 終値は足ごとに異なる値にして、どの足の終値を見たか分かるようにする
+    return [[start + i * HOUR, 100.0 + i, 110.0 + i, 90.0 + i, 1000.0 + i, 1.0] for i in range(n)]
+
+
+def test_ticks_only_see_closed_candles():
+    rows = candles()
+    bt = Backtester(rows, tick_sec=300)
+    ex = bt.exchange
+    assert ex.timeframe_ms == HOUR
+    ticks = list(bt._ticks())
+    assert ticks[0][0] == rows[0][0] + HOUR
+    assert ticks[-1][0] == rows[-1][0] + HOUR
+    for now_ms, index in ticks:
+        ex.set_time(now_ms, index)
+        history = ex.fetch_ohlcv('BTC/JPY', limit=1000)
+        assert all(r[0] + HOUR <= now_ms for r in history)
+        assert history[-1][4] == ex.price == ex.fetch_ticker('BTC/JPY')['last']
+        # 1 本先の足（now_ms 時点で確定していない）は含まれない
+        assert len(history) == index + 1
+
+
+def test_candle_opening_at_tick_time_is_not_current():
+    rows = candles()
+    bt = Backtester(rows, tick_sec=300)
+    by_time = dict(bt._ticks())
+    # 足 2 が始まった瞬間のティックは、確定済みの足 1 の終値で判断する
+    assert by_time[rows[2][0]] == 1
+    assert by_time[rows[2][0] + 55 * 60 * 1000] == 1
+    assert by_time[rows[3][0]] == 2
+
+
+def test_infer_timeframe_uses_smallest_gap():
+    rows = candles(4)
+    del rows[2]
+    assert infer_timeframe_ms(rows) == HOUR
+    assert BacktestExchange(rows, timeframe_ms=4 * HOUR).timeframe_ms == 4 * HOUR
+
+
+def test_fee_is_charged_even_when_funds_are_reserved(tmp_path):
+    fm = FundManager(initial_fund=1000.0, state_file=str(tmp_path / 'funds_state.json'),
+                     ledger_file=str(tmp_path / 'funds_state.ledger.jsonl'))
+    bt = Backtester(candles(), initial_fund=1000.0)
+    bt.fund_manager = fm
+    assert fm.reserve(1000.0)
+    bt._on_fill({'id': 'bt-1', 'side': 'buy', 'amount': 0.001, 'fee': 12.5})
+    assert bt.fees_jpy == pytest.approx(12.5)
+    assert fm.ledger.balance(ACCOUNT_FEES) == pytest.approx(12.5)
+    assert [e['kind'] for e in fm.ledger.entries_for_order('bt-1')] == ['fee']
+    assert all(e['kind'] != 'order' for e in fm.ledger.entries_for_order('bt-1'))
+    fm.release(1000.0)
+    assert fm.available_fund() == pytest.approx(987.5)
+    assert fm.ledger.verify()
+    fm.close()
+
+
+def test_run_replays_without_errors(tmp_path):
+    result = Backtester(candles(24), tick_sec=1800, work_dir=str(tmp_path)).run()
+    assert result['ticks'] == 2 * 23 + 1  # 最初の足の確定から最後の足の確定まで 30 分ごと
+    assert result['last_price'] == 1000.0 + 23
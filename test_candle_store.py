@@ -0,0 +1,92 @@
+"""candle_store.CandleStore の差分取得のテスト"""
+
+import pytest
+
+import candle_store
+from candle_store import CandleStore
+
+HOUR = 60 * 60 * 1000
+START = 1_700_000_000_000
+
+
+class FakeExchange:
+    def __init__(self, n):
+        self.rows = [[START + i * HOUR, 1.0, 2.0, 0.5, float(i), 1.0] for i in range(n)]
+        self.calls = []
+
+    def add(self, close=None):
+        i = len(self.rows)
+        self.rows.append([START + i * HOUR, 1.0, 2.0, 0.5, float(i) if close is None else close, 1.0])
+
+    def fetch_ohlcv(self, pair, timeframe='1h', since=None, limit=100):
+        self.calls.append((since, limit))
+        rows = [r for r in self.rows if since is None or r[0] >= since]
+        rows = rows[:limit] if since is not None else rows[-limit:]
+        return [list(r) for r in rows]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {'t': 0.0}
+
+    def set_to_candle(i):
+        # 足 i が始まった直後の時刻
+        now['t'] = (START + i * HOUR) / 1000.0 + 1.0
+    monkeypatch.setattr(candle_store.time, 'time', lambda: now['t'])
+    return set_to_candle
+
+
+def test_delta_merge_fetches_only_new_candles(tmp_path, clock):
+    ex = FakeExchange(150)
+    store = CandleStore(str(tmp_path), min_refresh_sec=0)
+    clock(149)
+    assert len(store.get_rows(ex, timeframe='1h', limit=100)) == 100
+    assert ex.calls == [(None, 100)]
+
+    ex.add()
+    ex.add()
+    clock(151)
+    rows = store.get_rows(ex, timeframe='1h', limit=100)
+    since, limit = ex.calls[-1]
+    assert since == START + 149 * HOUR and limit <= 5
+    assert [r[0] for r in rows] == [START + i * HOUR for i in range(52, 152)]
+
+
+def test_overlapping_candle_is_replaced_not_duplicated(tmp_path, clock):
+    ex = FakeExchange(120)
+    store = CandleStore(str(tmp_path), min_refresh_sec=0)
+    clock(119)
+    store.refresh(ex, timeframe='1h', limit=100)
+    # 最後の足（未確定だった）の終値が変わっている
+    ex.rows[-1][4] = 999.0
+    ex.add()
+    clock(120)
+    store.refresh(ex, timeframe='1h', limit=100)
+    rows = store.get_rows(None, timeframe='1h', limit=1000)
+    stamps = [r[0] for r in rows]
+    assert len(stamps) == len(set(stamps)) == 101
+    assert rows[-2][4] == 999.0
+
+
+def test_short_history_uses_delta_and_min_refresh(tmp_path, clock):
+    ex = FakeExchange(30)
+    store = CandleStore(str(tmp_path), min_refresh_sec=60)
+    clock(29)
+    assert len(store.get_rows(ex, timeframe='1h', limit=100)) == 30
+    assert ex.calls == [(None, 100)]
+    # min_refresh_sec 内は取引所に問い合わせない
+    store.get_rows(ex, timeframe='1h', limit=100)
+    assert len(ex.calls) == 1
+
+    ex.add()
+    clock(30)
+    assert len(store.get_rows(ex, timeframe='1h', limit=100)) == 31
+    assert ex.calls[-1][0] == START + 29 * HOUR
+
+    # 再起動後も「これ以上古い足は無い」ことを覚えている
+    reopened = CandleStore(str(tmp_path), min_refresh_sec=60)
+    ex.add()
+    clock(31)
+    assert len(reopened.get_rows(ex, timeframe='1h', limit=100)) == 32
+    assert ex.calls[-1][0] == START + 30 * HOUR
+    assert sum(1 for since, _ in ex.calls if since is None) == 1
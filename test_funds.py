@@ -0,0 +1,218 @@
+"""funds.FundManager の write-behind（WAL）復旧と Ledger（入出金台帳）のテスト"""
+
+import json
+import shutil
+
+import pytest
+
+from funds import ACCOUNT_EXCHANGE, ACCOUNT_FREE, ACCOUNT_RESERVED, FundManager, Ledger
+
+
+def crash_copy(src_dir, dst_dir, name='funds_state.json'):
+    """動いている FundManager のファイルをその時点のまま別ディレクトリへ写す（プロセスが落ちた状態の再現）。"""
+    dst_dir.mkdir()
+    for suffix in ('', '.wal'):
+        src = src_dir / (name + suffix)
+        if src.exists():
+            shutil.copy(str(src), str(dst_dir / (name + suffix)))
+    return str(dst_dir / name)
+
+
+def test_group_commit_is_recovered_from_wal(tmp_path):
+    live = tmp_path / 'live'
+    live.mkdir()
+    fm = FundManager(initial_fund=10000.0, state_file=str(live / 'funds_state.json'), durability='group',
+                     snapshot_every=10_000)
+    try:
+        assert fm.reserve(3000)
+        fm.confirm(1000)
+        assert fm.place_order(500)
+        fm.add_funds(250)
+        # group モードでは呼び出しから戻った時点で WAL に fsync 済み
+        snapshot = json.loads((live / 'funds_state.json').read_text(encoding='utf-8'))
+        assert snapshot['available'] == 10000.0
+        recovered_path = crash_copy(live, tmp_path / 'crashed')
+    finally:
+        fm.close()
+
+    recovered = FundManager(state_file=recovered_path, durability='group')
+    try:
+        assert recovered.available_fund() == pytest.approx(fm.available_fund())
+        assert recovered._reserved == pytest.approx(fm._reserved)
+        assert recovered._seq == fm._seq
+    finally:
+        recovered.close()
+
+
+def test_async_flush_makes_changes_durable(tmp_path):
+    live = tmp_path / 'live'
+    live.mkdir()
+    fm = FundManager(initial_fund=5000.0, state_file=str(live / 'funds_state.json'), durability='async',
+                     snapshot_every=10_000)
+    try:
+        for _ in range(20):
+            assert fm.place_order(100)
+        assert fm.flush(timeout=5.0)
+        recovered_path = crash_copy(live, tmp_path / 'crashed')
+    finally:
+        fm.close()
+    recovered = FundManager(state_file=recovered_path, durability='async')
+    try:
+        assert recovered.available_fund() == pytest.approx(3000.0)
+    finally:
+        recovered.close()
+
+
+def test_replay_skips_records_covered_by_snapshot_and_torn_tail(tmp_path):
+    state = tmp_path / 'funds_state.json'
+    state.write_text(json.dumps({'available': 800.0, 'reserved': 0.0, 'seq': 5}), encoding='utf-8')
+    wal_lines = [
+        {'seq': 4, 'available': 1.0, 'reserved': 0.0},       # スナップショット済み（WAL を空にする前に落ちた）
+        {'seq': 5, 'available': 800.0, 'reserved': 0.0},
+        {'seq': 6, 'available': 700.0, 'reserved': 100.0},
+    ]
+    with open(str(state) + '.wal', 'w', encoding='utf-8') as fh:
+        for rec in wal_lines:
+            fh.write(json.dumps(rec) + '\n')
+        fh.write('{"seq": 7, "available": 1')                # 書き込み途中で落ちた行
+    fm = FundManager(state_file=str(state), durability='group')
+    try:
+        assert fm._seq == 6
+        assert fm.available_fund() == pytest.approx(600.0)
+    finally:
+        fm.close()
+
+
+def test_close_folds_wal_into_snapshot(tmp_path):
+    path = tmp_path / 'funds_state.json'
+    fm = FundManager(initial_fund=1000.0, state_file=str(path), durability='group', snapshot_every=10_000)
+    fm.reserve(200)
+    fm.close()
+    snapshot = json.loads(path.read_text(encoding='utf-8'))
+    assert (snapshot['available'], snapshot['reserved']) == (1000.0, 200.0)
+    assert (tmp_path / 'funds_state.json.wal').read_text(encoding='utf-8') == ''
+
+
+def test_switching_back_to_sync_keeps_wal_changes(tmp_path):
+    live = tmp_path / 'live'
+    live.mkdir()
+    fm = FundManager(initial_fund=1000.0, state_file=str(live / 'funds_state.json'), durability='group',
+                     snapshot_every=10_000)
+    try:
+        assert fm.place_order(300)
+        recovered_path = crash_copy(live, tmp_path / 'crashed')
+    finally:
+        fm.close()
+    synced = FundManager(state_file=recovered_path, durability='sync')
+    assert synced.available_fund() == pytest.approx(700.0)
+    assert not (tmp_path / 'crashed' / 'funds_state.json.wal').exists()
+    assert json.loads((tmp_path / 'crashed' / 'funds_state.json').read_text(encoding='utf-8'))['available'] == 700.0
+
+
+def test_second_crash_after_torn_wal_record_keeps_new_changes(tmp_path):
+    live = tmp_path / 'live'
+    live.mkdir()
+    fm = FundManager(initial_fund=10000.0, state_file=str(live / 'funds_state.json'), durability='group',
+                     snapshot_every=10_000)
+    try:
+        assert fm.place_order(1000)
+        first = crash_copy(live, tmp_path / 'crash1')
+    finally:
+        fm.close()
+    with open(first + '.wal', 'a', encoding='utf-8') as fh:
+        fh.write('{"seq": 99, "available": 1')               # 1 回目のクラッシュで途切れた行
+
+    recovered = FundManager(state_file=first, durability='group', snapshot_every=10_000)
+    try:
+        assert recovered.available_fund() == pytest.approx(9000.0)
+        assert recovered.place_order(1100)
+        # 2 回目のクラッシュ: 再起動後に fsync 済みの変更が WAL から復元されること
+        second = crash_copy(tmp_path / 'crash1', tmp_path / 'crash2')
+    finally:
+        recovered.close()
+    again = FundManager(state_file=second, durability='group')
+    try:
+        assert again.available_fund() == pytest.approx(7900.0)
+        assert again._seq == recovered._seq
+    finally:
+        again.close()
+
+
+def make_ledger(path):
+    clock = {'t': 100.0}
+
+    def tick():
+        clock['t'] += 1.0
+        return clock['t']
+    return Ledger(str(path), clock=tick)
+
+
+def post_orders(ledger):
+    ledger.post('opening', ACCOUNT_FREE, 'equity:opening', 1000.0)               # ts 101
+    ledger.post('reserve', ACCOUNT_RESERVED, ACCOUNT_FREE, 300.0, order_id='a')  # ts 102
+    ledger.post('confirm', ACCOUNT_EXCHANGE, ACCOUNT_RESERVED, 300.0, order_id='a')  # ts 103
+    ledger.post('reserve', ACCOUNT_RESERVED, ACCOUNT_FREE, 200.0, order_id='b')  # ts 104
+
+
+def test_ledger_queries_survive_reload(tmp_path):
+    path = tmp_path / 'funds_state.ledger.jsonl'
+    ledger = make_ledger(path)
+    post_orders(ledger)
+    ledger.close()
+
+    reloaded = Ledger(str(path))
+    assert len(reloaded) == 4
+    assert reloaded.verify()
+    assert reloaded.balance_at(ACCOUNT_FREE, 100.0) == 0.0
+    assert reloaded.balance_at(ACCOUNT_FREE, 101.0) == pytest.approx(1000.0)
+    assert reloaded.balance_at(ACCOUNT_FREE, 103.5) == pytest.approx(700.0)
+    assert reloaded.balance_at(ACCOUNT_RESERVED, 102.0) == pytest.approx(300.0)
+    assert reloaded.balance_at(ACCOUNT_RESERVED, 103.0) == 0.0
+    assert reloaded.balance(ACCOUNT_FREE) == pytest.approx(500.0)
+    assert [e['kind'] for e in reloaded.entries_for_order('a')] == ['reserve', 'confirm']
+    assert [e['order_id'] for e in reloaded.entries_between(102.0, 104.0)] == ['a', 'a', 'b']
+    assert reloaded.entries_for_order('missing') == []
+    reloaded.close()
+
+
+def test_ledger_postings_after_torn_entry_survive_next_reload(tmp_path):
+    path = tmp_path / 'funds_state.ledger.jsonl'
+    ledger = make_ledger(path)
+    post_orders(ledger)
+    ledger.close()
+    with open(path, 'a', encoding='utf-8') as fh:
+        fh.write('{"seq": 5, "ts": 105.0, "kind": "rel')              # 書き込み途中で落ちた仕訳
+
+    reopened = Ledger(str(path))
+    assert len(reopened) == 4
+    reopened.post('release', ACCOUNT_FREE, ACCOUNT_RESERVED, 200.0, order_id='b', ts=110.0)
+    reopened.close()
+
+    again = Ledger(str(path))
+    assert len(again) == 5
+    assert again.verify()
+    assert [e['kind'] for e in again.entries_for_order('b')] == ['reserve', 'release']
+    assert again.balance_at(ACCOUNT_RESERVED, 110.0) == 0.0
+    again.close()
+
+
+def test_fund_manager_ledger_matches_balances_after_restart(tmp_path):
+    state = str(tmp_path / 'funds_state.json')
+    ledger_file = str(tmp_path / 'funds_state.ledger.jsonl')
+    fm = FundManager(initial_fund=5000.0, state_file=state, ledger_file=ledger_file)
+    assert fm.reserve(1200, order_id='o1')
+    fm.confirm(1000, order_id='o1')
+    fm.add_funds(400, order_id='o2')
+    fm.close()
+
+    reopened = FundManager(state_file=state, ledger_file=ledger_file)
+    try:
+        ledger = reopened.ledger
+        assert ledger.verify()
+        assert ledger.balance(ACCOUNT_FREE) == pytest.approx(reopened.available_fund())
+        assert ledger.balance(ACCOUNT_RESERVED) == pytest.approx(reopened._reserved)
+        assert {e['kind'] for e in ledger.entries_for_order('o1')} == {'reserve', 'confirm'}
+        # 再起動しても残高が一致していれば調整仕訳は入らない
+        assert all(e['kind'] != 'adjustment' for e in ledger.entries_between(0, float('inf')))
+    finally:
+        reopened.close()
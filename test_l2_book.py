@@ -0,0 +1,153 @@
+"""l2_book.L2Book の差分適用とシーケンス飛び（gap）からの resync のテスト"""
+
+import pytest
+
+from l2_book import FeedRecorder, FeedReplayer, L2Book, L2BookExchange, synthetic_feed
+
+FEED = list(synthetic_feed(levels=50, updates=300, seed=3))
+
+
+def truth_at(seq):
+    """seq まで全ての差分を受け取った板のスナップショット（取引所側の正しい板）。"""
+    book = L2Book()
+    for kind, msg in FEED:
+        if kind == 'snapshot':
+            book.apply_snapshot(msg)
+        elif msg['sequence'] <= seq:
+            book.apply_diff(msg)
+    snap = book.to_ccxt()
+    snap['sequence'] = seq
+    return snap
+
+
+def diff(seq):
+    return FEED[seq][1]
+
+
+def levels(book_or_snapshot):
+    snap = book_or_snapshot.to_ccxt() if isinstance(book_or_snapshot, L2Book) else book_or_snapshot
+    return snap['bids'], snap['asks']
+
+
+class Server:
+    def __init__(self):
+        self.seq = 0
+        self.fetches = 0
+
+    def fetch(self):
+        self.fetches += 1
+        return truth_at(self.seq)
+
+
+def test_diffs_match_full_snapshot():
+    book = L2Book()
+    book.apply_snapshot(FEED[0][1])
+    for seq in range(1, 301):
+        assert book.apply_diff(diff(seq))
+    assert levels(book) == levels(truth_at(300))
+    assert book.best_bid() < book.best_ask()
+
+
+def test_gap_triggers_resync_and_drops_stale_buffered_diffs():
+    server = Server()
+    book = L2Book(snapshot_fetcher=server.fetch)
+    book.apply_snapshot(FEED[0][1])
+    for seq in range(1, 101):
+        book.apply_diff(diff(seq))
+    server.seq = 110
+    # 101〜105 を取りこぼして 106 が届く
+    assert book.apply_diff(diff(106)) is False
+    assert book.synced and book.sequence == 110
+    for seq in range(107, 301):
+        book.apply_diff(diff(seq))
+    assert levels(book) == levels(truth_at(300))
+    assert book.stats['gaps'] == 1
+    assert book.stats['resyncs'] == 1
+    assert book.stats['stale_diffs'] == 5  # 保留していた 106 と 107〜110
+
+
+def test_snapshot_older_than_buffer_is_retried_on_next_diff():
+    server = Server()
+    book = L2Book(snapshot_fetcher=server.fetch, resync_interval=0.0)
+    book.apply_snapshot(FEED[0][1])
+    for seq in range(1, 101):
+        book.apply_diff(diff(seq))
+    # 取り直したスナップショット（103）が溜めた差分（106）より古く、104・105 が埋まらない
+    server.seq = 103
+    book.apply_diff(diff(106))
+    assert not book.synced
+    server.seq = 120
+    for seq in range(107, 301):
+        book.apply_diff(diff(seq))
+    assert book.synced
+    assert levels(book) == levels(truth_at(300))
+    assert server.fetches == 2
+
+
+def test_failed_fetch_is_retried_after_interval(monkeypatch):
+    server = Server()
+    failures = {'left': 1}
+
+    def flaky():
+        if failures['left']:
+            failures['left'] -= 1
+            raise RuntimeError('503')
+        return server.fetch()
+
+    now = {'t': 1000.0}
+    monkeypatch.setattr('l2_book.time.monotonic', lambda: now['t'])
+    book = L2Book(snapshot_fetcher=flaky, resync_interval=5.0)
+    book.apply_snapshot(FEED[0][1])
+    for seq in range(1, 51):
+        book.apply_diff(diff(seq))
+    server.seq = 60
+    book.apply_diff(diff(55))        # gap -> 取得失敗
+    book.apply_diff(diff(56))        # まだ間隔内なので取り直さない
+    assert not book.synced and server.fetches == 0
+    now['t'] += 5.0
+    for seq in range(57, 301):
+        book.apply_diff(diff(seq))
+    assert book.synced and server.fetches == 1
+    assert levels(book) == levels(truth_at(300))
+
+
+def test_without_fetcher_waits_for_external_snapshot():
+    book = L2Book()
+    book.apply_snapshot(FEED[0][1])
+    for seq in range(1, 21):
+        book.apply_diff(diff(seq))
+    book.apply_diff(diff(25))
+    assert not book.synced
+    for seq in range(26, 31):
+        book.apply_diff(diff(seq))
+    # 外から与えたスナップショットより新しい保留中の差分は適用される
+    book.apply_snapshot(truth_at(27))
+    assert book.synced and book.sequence == 30
+    assert levels(book) == levels(truth_at(30))
+
+
+def test_exchange_falls_back_to_rest_while_unsynced():
+    class Rest:
+        def fetch_order_book(self, pair, *args, **kwargs):
+            return {'rest': True}
+
+    book = L2Book()
+    ex = L2BookExchange(Rest(), {'BTC/JPY': book})
+    assert ex.fetch_order_book('BTC/JPY') == {'rest': True}
+    book.apply_snapshot(FEED[0][1])
+    assert ex.fetch_order_book('BTC/JPY', 5)['bids'] == book.to_ccxt(5)['bids']
+    book.apply_diff(diff(3))
+    assert ex.fetch_order_book('BTC/JPY') == {'rest': True}
+
+
+def test_recorded_feed_replays_to_same_book(tmp_path):
+    path = str(tmp_path / 'feed.jsonl')
+    rec = FeedRecorder(path)
+    for kind, msg in FEED[:151]:
+        rec.record(kind, msg)
+    rec.close()
+    book = L2Book()
+    for _ in FeedReplayer(path).drive(book):
+        pass
+    assert levels(book) == levels(truth_at(150))
+    assert book.stats['diffs'] == 150
@@ -0,0 +1,156 @@
+"""market_cache.CachedExchange のティック固定（pin）のテスト
+
+ティックの途中で例外が出ても end_tick() が呼ばれ、次のティックで新しい価格が見えることを確認します。
+"""
+
+import pytest
+
+import ninibo1127 as bot
+from market_cache import CachedExchange
+from multi_pair import MultiPairEngine
+
+
+class FakeExchange:
+    def __init__(self, price=100.0):
+        self.prices = {'BTC/JPY': price, 'ETH/JPY': price}
+        self.failing = set()
+        self.ticker_calls = 0
+
+    def fetch_ticker(self, pair):
+        self.ticker_calls += 1
+        if pair in self.failing:
+            raise RuntimeError(f"ticker unavailable: {pair}")
+        return {'last': self.prices[pair]}
+
+    def fetch_order_book(self, pair):
+        price = self.prices[pair]
+        return {'bids': [[price - 1, 1.0]], 'asks': [[price + 1, 1.0]]}
+
+
+class BatchExchange(FakeExchange):
+    has = {'fetchTickers': True}
+
+    def __init__(self, price=100.0):
+        super().__init__(price)
+        self.tickers_calls = 0
+
+    def fetch_tickers(self, pairs):
+        self.tickers_calls += 1
+        return {p: {'last': self.prices[p]} for p in pairs}
+
+
+class NoFunds:
+    def available_fund(self):
+        return 0.0
+
+    def place_order(self, cost):
+        return False
+
+
+@pytest.fixture
+def positions_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('POSITIONS_FILE', str(tmp_path / 'positions.json'))
+    monkeypatch.setenv('DRY_RUN', '1')
+    return tmp_path
+
+
+def test_ttl_and_pin_within_tick():
+    raw = FakeExchange()
+    cache = CachedExchange(raw, ttl={'fetch_ticker': 0.0})
+    cache.begin_tick(None)
+    assert cache.fetch_ticker('BTC/JPY')['last'] == 100.0
+    raw.prices['BTC/JPY'] = 50.0
+    # ティック中は同じ価格を見る
+    assert cache.fetch_ticker('BTC/JPY')['last'] == 100.0
+    cache.end_tick()
+    assert cache.fetch_ticker('BTC/JPY')['last'] == 50.0
+
+
+def test_consecutive_ticks_see_new_price():
+    raw = FakeExchange()
+    # TTL が残っていても前のティックの値は使わない
+    cache = CachedExchange(raw, ttl={'fetch_ticker': 60.0, 'fetch_order_book': 60.0})
+    for price in (100.0, 50.0, 25.0):
+        raw.prices['BTC/JPY'] = price
+        cache.begin_tick(None)
+        try:
+            assert cache.fetch_ticker('BTC/JPY')['last'] == price
+            assert cache.fetch_order_book('BTC/JPY')['bids'][0][0] == price - 1
+            assert bot.get_latest_price(cache, 'BTC/JPY') == price
+        finally:
+            cache.end_tick()
+    assert raw.ticker_calls == 3
+
+
+def test_run_bot_reads_fresh_price_each_tick(positions_env, monkeypatch):
+    monkeypatch.setenv('PRICE_CHECK_SEC', '0')
+    raw = FakeExchange()
+    cache = CachedExchange(raw, ttl={'fetch_ticker': 0.0, 'fetch_order_book': 0.0})
+    seen = []
+    real = bot.get_latest_price
+
+    def spy(exchange, *args, **kwargs):
+        price = real(exchange, *args, **kwargs)
+        seen.append(price)
+        return price
+    monkeypatch.setattr(bot, 'get_latest_price', spy)
+    bot.run_bot(cache, NoFunds(), dry_run=True, notify=False)
+    raw.prices['BTC/JPY'] = 50.0
+    bot.run_bot(cache, NoFunds(), dry_run=True, notify=False)
+    assert seen and seen[0] == 100.0 and seen[-1] == 50.0
+
+
+def test_run_bot_releases_pin_when_tick_raises(positions_env):
+    raw = FakeExchange()
+    cache = CachedExchange(raw, ttl={'fetch_ticker': 0.0, 'fetch_order_book': 0.0})
+    raw.failing.add('BTC/JPY')
+    with pytest.raises(Exception):
+        bot.run_bot(cache, NoFunds(), dry_run=True, notify=False)
+    assert cache._pin_depth == 0
+
+    raw.failing.clear()
+    bot.run_bot(cache, NoFunds(), dry_run=True, notify=False)
+    raw.prices['BTC/JPY'] = 50.0
+    assert cache.fetch_ticker('BTC/JPY')['last'] == 50.0
+    assert bot.get_latest_price(cache, 'BTC/JPY') == 50.0
+
+
+def test_multi_pair_tick_releases_pins_after_pair_error(positions_env):
+    raw = FakeExchange()
+    cache = CachedExchange(raw, ttl={'fetch_ticker': 0.0, 'fetch_order_book': 0.0})
+    engine = MultiPairEngine(cache, NoFunds(), ['BTC/JPY', 'ETH/JPY'], dry_run=True, notify=False)
+    try:
+        raw.failing.add('ETH/JPY')
+        results = engine.tick()
+        assert results['ETH/JPY'].startswith('error')
+        assert results['BTC/JPY'] == 'run_bot executed'
+        assert cache._pin_depth == 0
+
+        raw.failing.clear()
+        raw.prices['BTC/JPY'] = 50.0
+        assert cache.fetch_ticker('BTC/JPY')['last'] == 50.0
+    finally:
+        engine.close()
+
+
+@pytest.mark.parametrize('exchange_cls', [FakeExchange, BatchExchange])
+def test_multi_pair_prefetch_refreshes_each_tick(positions_env, monkeypatch, exchange_cls):
+    raw = exchange_cls()
+    cache = CachedExchange(raw, ttl={'fetch_ticker': 60.0, 'fetch_tickers': 60.0, 'fetch_order_book': 60.0})
+    engine = MultiPairEngine(cache, NoFunds(), ['BTC/JPY', 'ETH/JPY'], dry_run=True, notify=False)
+    seen = []
+    real = bot.get_latest_price
+
+    def spy(exchange, pair='BTC/JPY', *args, **kwargs):
+        price = real(exchange, pair, *args, **kwargs)
+        seen.append((pair, price))
+        return price
+    monkeypatch.setattr(bot, 'get_latest_price', spy)
+    try:
+        engine.tick()
+        raw.prices.update({'BTC/JPY': 50.0, 'ETH/JPY': 40.0})
+        seen.clear()
+        engine.tick()
+        assert seen and dict(seen) == {'BTC/JPY': 50.0, 'ETH/JPY': 40.0}
+    finally:
+        engine.close()
@@ -0,0 +1,106 @@
+"""position_journal.PositionJournal の再生・圧縮のテスト"""
+
+import json
+
+from position_journal import PositionJournal, journal_paths
+
+
+def ids(positions):
+    return sorted(p['id'] for p in positions)
+
+
+def run_events(journal):
+    a = journal.open(100.0, 0.001, 1000)
+    b = journal.add(90.0, 0.001, 1100, nampin_count=1)
+    journal.close(a, 110.0, 1200)
+    c = journal.open(95.0, 0.002, 1300)
+    d = journal.add(85.0, 0.002, 1400, nampin_count=2)
+    journal.close(d, 99.0, 1500)
+    return b, c
+
+
+def test_replay_after_compaction_restores_positions_and_seq(tmp_path):
+    path = str(tmp_path / 'positions_state.json')
+    journal = PositionJournal(path, compact_every=4, fsync=False)
+    b, c = run_events(journal)
+    assert ids(journal.positions()) == sorted([b['id'], c['id']])
+    seq = journal.seq
+
+    reopened = PositionJournal(path, compact_every=4, fsync=False)
+    assert reopened.positions() == journal.positions()
+    assert reopened.seq == seq
+
+    # 圧縮後も seq は続き、履歴には全イベントが 1 回ずつ残る
+    e = reopened.open(80.0, 0.001, 1600)
+    assert reopened.seq == seq + 1
+    reopened.compact()
+    history = PositionJournal(path, fsync=False).history()
+    assert [ev['seq'] for ev in history] == list(range(1, seq + 2))
+    assert ids(PositionJournal(path, fsync=False).positions()) == sorted([b['id'], c['id'], e['id']])
+
+
+def test_crash_between_snapshot_and_journal_truncation_replays_idempotently(tmp_path):
+    path = str(tmp_path / 'positions_state.json')
+    journal_file, _ = journal_paths(path)
+    journal = PositionJournal(path, compact_every=1000, fsync=False)
+    run_events(journal)
+    expected = journal.positions()
+    before = journal_file.read_text(encoding='utf-8')
+
+    journal.compact()
+    # スナップショットは置き換わったがジャーナルを空にする前に落ちた状態を再現する
+    journal_file.write_text(before, encoding='utf-8')
+
+    reopened = PositionJournal(path, compact_every=1000, fsync=False)
+    assert sorted(reopened.positions(), key=lambda p: p['id']) == sorted(expected, key=lambda p: p['id'])
+    assert reopened.seq == journal.seq
+    reopened.compact()
+    assert len(reopened.history()) == journal.seq
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    path = str(tmp_path / 'positions_state.json')
+    journal_file, _ = journal_paths(path)
+    journal = PositionJournal(path, compact_every=1000, fsync=False)
+    kept = journal.open(100.0, 0.001, 1000)
+    with open(journal_file, 'a', encoding='utf-8') as fh:
+        fh.write(json.dumps({'op': 'open', 'seq': 2, 'position': {'id': 'torn', 'price': 1}})[:25])
+
+    reopened = PositionJournal(path, compact_every=1000, fsync=False)
+    assert ids(reopened.positions()) == [kept['id']]
+
+    # 再起動後の追記は壊れた行の続きではなく新しい行になり、次の再起動でも失われない
+    more = [reopened.open(90.0 + i, 0.001, 2000 + i) for i in range(2)]
+    expected = sorted([kept['id']] + [p['id'] for p in more])
+    assert ids(reopened.positions()) == expected
+    again = PositionJournal(path, compact_every=1000, fsync=False)
+    assert ids(again.positions()) == expected
+    assert again.seq == reopened.seq
+    again.compact()
+    assert [ev['seq'] for ev in again.history()] == list(range(1, again.seq + 1))
+
+
+def test_torn_history_tail_is_repaired_before_compaction(tmp_path):
+    path = str(tmp_path / 'positions_state.json')
+    _, history_file = journal_paths(path)
+    journal = PositionJournal(path, compact_every=2, fsync=False)
+    journal.open(100.0, 0.001, 1000)
+    journal.open(101.0, 0.001, 1001)
+    with open(history_file, 'a', encoding='utf-8') as fh:
+        fh.write('{"op":"open","seq":')
+
+    reopened = PositionJournal(path, compact_every=2, fsync=False)
+    reopened.open(102.0, 0.001, 1002)
+    reopened.open(103.0, 0.001, 1003)
+    assert [ev['seq'] for ev in reopened.history()] == [1, 2, 3, 4]
+
+
+def test_legacy_snapshot_without_ids_is_migrated(tmp_path):
+    path = tmp_path / 'positions_state.json'
+    path.write_text(json.dumps([{'price': 100.0, 'amount': 0.001, 'timestamp': 1000}]), encoding='utf-8')
+    journal = PositionJournal(str(path), fsync=False)
+    (pos,) = journal.positions()
+    assert 'id' in pos
+    assert json.loads(path.read_text(encoding='utf-8'))[0]['id'] == pos['id']
+    journal.close(pos, 120.0, 2000)
+    assert PositionJournal(str(path), fsync=False).positions() == []
@@ -0,0 +1,40 @@
+"""profiler の control ファイル設定のテスト"""
+
+import os
+
+from profiler import ProfilerControl, control_from_env
+
+
+class RecordingProfiler:
+    def __init__(self):
+        self.started = []
+
+    def start(self, seconds):
+        self.started.append(seconds)
+        return True
+
+
+def test_control_file_defaults_next_to_bot_state(tmp_path, monkeypatch):
+    monkeypatch.delenv('PROFILE_CONTROL_FILE', raising=False)
+    control = control_from_env(str(tmp_path / 'bot_state.json'))
+    assert control.control_file == str(tmp_path / 'bot_state.profile')
+
+
+def test_control_file_env_overrides_and_empty_disables(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROFILE_CONTROL_FILE', str(tmp_path / 'custom.profile'))
+    assert control_from_env(str(tmp_path / 'bot_state.json')).control_file == str(tmp_path / 'custom.profile')
+    monkeypatch.setenv('PROFILE_CONTROL_FILE', '')
+    assert control_from_env(str(tmp_path / 'bot_state.json')).control_file is None
+
+
+def test_touching_control_file_starts_profile(tmp_path):
+    path = tmp_path / 'bot_state.profile'
+    profiler = RecordingProfiler()
+    control = ProfilerControl(profiler, control_file=str(path), default_seconds=30)
+    assert control.check_control_file() is False
+    path.write_text('60\n', encoding='utf-8')
+    assert control.check_control_file() is True
+    path.write_text('', encoding='utf-8')
+    assert control.check_control_file() is True
+    assert profiler.started == [60.0, 30.0]
+    assert not os.path.exists(path)
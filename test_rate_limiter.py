@@ -0,0 +1,235 @@
+"""rate_limiter のエラー判定・再試行とコストクラス別の予算のテスト
+
+ccxt の例外は同名のクラスで代用します（判定はクラス名で継承関係をたどるため）。
+"""
+
+import json
+
+import pytest
+
+import ninibo1127 as bot
+from rate_limiter import (RateLimiter, RateLimitedExchange, classify, is_rate_limit_error, is_throttle_error,
+                          parse_budgets_env)
+
+
+class ExchangeError(Exception):
+    pass
+
+
+class NetworkError(Exception):
+    pass
+
+
+class DDoSProtection(NetworkError):
+    pass
+
+
+class RateLimitExceeded(DDoSProtection):
+    pass
+
+
+class ExchangeNotAvailable(NetworkError):
+    pass
+
+
+class RequestTimeout(NetworkError):
+    pass
+
+
+class HttpError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.http_status = status
+
+
+class FlakyExchange:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    def _next(self, name, *args):
+        self.calls.append(name)
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'id': 'ok', 'args': args}
+
+    def create_order(self, *args):
+        return self._next('create_order', *args)
+
+    def fetch_ticker(self, *args):
+        return self._next('fetch_ticker', *args)
+
+
+@pytest.fixture
+def limited(tmp_path):
+    sleeps = []
+    clock = {'now': 1000.0}
+
+    def fake_sleep(sec):
+        sleeps.append(sec)
+        clock['now'] += sec
+
+    limiter = RateLimiter(state_file=str(tmp_path / 'rl.json'), base_backoff=0.5,
+                          clock=lambda: clock['now'], sleep=fake_sleep)
+
+    def make(errors):
+        raw = FlakyExchange(errors)
+        return raw, RateLimitedExchange(raw, limiter, max_retries=3)
+    return make, sleeps
+
+
+def test_digits_in_message_are_not_throttle_errors():
+    exc = ExchangeError('order 4295003 rejected: price 5020000 amount 0.0429')
+    assert not is_throttle_error(exc)
+    assert not is_rate_limit_error(exc)
+
+
+def test_classification_by_exception_type_and_status():
+    assert is_throttle_error(RateLimitExceeded('slow down'))
+    assert is_rate_limit_error(RateLimitExceeded('slow down'))
+    assert is_throttle_error(ExchangeNotAvailable('maintenance'))
+    assert not is_rate_limit_error(ExchangeNotAvailable('maintenance'))
+    assert is_throttle_error(RequestTimeout('timed out'))
+    assert is_throttle_error(HttpError('bad gateway', 502))
+    assert is_rate_limit_error(HttpError('too many', 429))
+    assert not is_throttle_error(HttpError('bad request', 400))
+
+
+def test_order_with_lookalike_message_is_not_retried(limited):
+    make, sleeps = limited
+    raw, ex = make([ExchangeError('insufficient funds for order 429 at 5000000')])
+    with pytest.raises(ExchangeError):
+        ex.create_order('BTC/JPY', 'limit', 'buy', 0.001, 5000000)
+    assert raw.calls == ['create_order']
+    assert sleeps == []
+
+
+def test_order_is_not_retried_when_acceptance_is_unknown(limited):
+    make, sleeps = limited
+    for error in (ExchangeNotAvailable('503'), RequestTimeout('timeout'), HttpError('gateway', 504)):
+        raw, ex = make([error])
+        with pytest.raises(type(error)):
+            ex.create_order('BTC/JPY', 'market', 'sell', 0.001)
+        assert raw.calls == ['create_order']
+    assert sleeps == []
+
+
+def test_order_is_retried_after_rate_limit_with_injected_sleep(limited):
+    make, sleeps = limited
+    raw, ex = make([RateLimitExceeded('429 Too Many Requests')])
+    assert ex.create_order('BTC/JPY', 'market', 'buy', 0.001)['id'] == 'ok'
+    assert raw.calls == ['create_order', 'create_order']
+    assert len(sleeps) == 1 and sleeps[0] > 0
+
+
+def test_market_data_retries_server_errors(limited):
+    make, sleeps = limited
+    raw, ex = make([ExchangeNotAvailable('down'), RequestTimeout('slow')])
+    assert ex.fetch_ticker('BTC/JPY')['id'] == 'ok'
+    assert raw.calls == ['fetch_ticker'] * 3
+    assert len(sleeps) >= 2
+
+
+class Waited(Exception):
+    pass
+
+
+def frozen_limiter(path, **kwargs):
+    """時計が止まっていて、待とうとすると Waited を投げるリミッタ（待たずに取れた回数を数える用）。"""
+    def no_sleep(sec):
+        raise Waited(sec)
+    return RateLimiter(state_file=str(path), clock=lambda: 1000.0, sleep=no_sleep, **kwargs)
+
+
+def take_until_wait(limiter, endpoint):
+    n = 0
+    while True:
+        try:
+            limiter.acquire(endpoint)
+        except Waited:
+            return n
+        n += 1
+
+
+def test_endpoints_map_to_cost_classes():
+    assert classify('create_order')[0] == 'private_update'
+    assert classify('cancel_order')[0] == 'private_update'
+    assert classify('fetch_balance')[0] == 'private_query'
+    assert classify('fetch_ticker')[0] == 'public'
+
+
+def test_cost_classes_have_separate_budgets(tmp_path):
+    limiter = frozen_limiter(tmp_path / 'rl.json', budgets={'private_query': (1.0, 3.0), 'private_update': (1.0, 2.0)})
+    # 口座照会は予約分（1）を残して使い切る
+    assert take_until_wait(limiter, 'fetch_balance') == 2
+    # 注文の予算は別なので照会を使い切っても通る
+    assert take_until_wait(limiter, 'create_order') == 2
+
+
+def test_endpoint_budget_overrides_its_class(tmp_path):
+    limiter = frozen_limiter(tmp_path / 'rl.json', budgets={'fetch_ohlcv': (1.0, 3.0)}, reserve={2: 0.0})
+    assert limiter.bucket_for('fetch_ohlcv') == ('fetch_ohlcv', 2)
+    assert take_until_wait(limiter, 'fetch_ohlcv') == 3
+    assert take_until_wait(limiter, 'fetch_ticker') == 10
+
+
+def test_legacy_private_budget_and_env(tmp_path, monkeypatch):
+    legacy = frozen_limiter(tmp_path / 'a.json', budgets={'private': (2.0, 4.0)})
+    assert legacy._budgets['private_query'] == legacy._budgets['private_update'] == (2.0, 4.0)
+    assert parse_budgets_env('fetch_ohlcv=1:2, private_update=3:6,bad,x=1') == {
+        'fetch_ohlcv': (1.0, 2.0), 'private_update': (3.0, 6.0)}
+    monkeypatch.setenv('RATE_LIMIT_BUDGETS', 'public=1:2')
+    assert frozen_limiter(tmp_path / 'b.json')._budgets['public'] == (1.0, 2.0)
+
+
+def test_leased_tokens_skip_shared_state(tmp_path):
+    clock = {'now': 1000.0}
+    limiter = RateLimiter(state_file=str(tmp_path / 'rl.json'), clock=lambda: clock['now'], sleep=lambda s: None)
+    for _ in range(5):
+        limiter.acquire('fetch_ticker')
+    # rate 5/秒 * lease 1 秒分を 1 回で借りるので、共有ファイルの読み書きは 1 回
+    assert limiter.shared_reads == 1
+    limiter.acquire('fetch_ticker')
+    assert limiter.shared_reads == 2
+
+
+def test_processes_share_one_budget_with_leases(tmp_path):
+    path = tmp_path / 'rl.json'
+    a = frozen_limiter(path)
+    b = frozen_limiter(path)
+    taken = 0
+    for limiter in (a, b, a, b):
+        taken += take_until_wait(limiter, 'fetch_ticker')
+    # burst 10 から市場データの予約分 2 を除いた 8 回だけ
+    assert taken == 8
+
+
+def test_unused_lease_is_returned(tmp_path):
+    clock = {'now': 1000.0}
+    path = tmp_path / 'rl.json'
+    options = dict(state_file=str(path), clock=lambda: clock['now'], sleep=lambda s: None,
+                   budgets={'public': (0.5, 10.0)}, reserve={2: 0.0}, lease_sec=8.0)
+    a = RateLimiter(**options)
+    b = RateLimiter(**options)
+
+    def shared_tokens():
+        return json.loads(path.read_text())['buckets']['public']['tokens']
+    a.acquire('fetch_ticker')                          # 4 個借りて 1 個使う
+    a.acquire('fetch_ticker')                          # 期限内なので手元の分を使う
+    assert (a.shared_reads, shared_tokens()) == (1, pytest.approx(6.0))
+    b.acquire('fetch_ticker')
+    assert shared_tokens() == pytest.approx(2.0)
+    clock['now'] += 8.0                                # a の期限切れ: 未使用の 2 個を返してから借り直す
+    a.acquire('fetch_ticker')
+    assert a.shared_reads == 2
+    assert shared_tokens() == pytest.approx(2.0 + 2.0 + 8.0 * 0.5 - 4.0)
+
+
+def test_retries_are_logged_with_log_warn(limited, monkeypatch, capsys):
+    make, sleeps = limited
+    logged = []
+    monkeypatch.setattr(bot, 'log_warn', lambda *args, **kwargs: logged.append((args, kwargs)))
+    raw, ex = make([RateLimitExceeded('slow down')])
+    ex.fetch_ticker('BTC/JPY')
+    assert len(logged) == 1 and logged[0][1]['endpoint'] == 'fetch_ticker'
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,174 @@
+"""sqlite_funds.SqliteFundManager のプロセス間の原子性と台帳（FundManager と同じ仕訳）のテスト"""
+
+import multiprocessing
+import sqlite3
+
+import pytest
+
+import ninibo1127 as bot
+from funds import ACCOUNT_EXCHANGE, ACCOUNT_FREE, ACCOUNT_PNL, ACCOUNT_RESERVED, FundManager
+from sqlite_funds import SqliteFundManager
+
+
+def make_sqlite(tmp_path, **kwargs):
+    return SqliteFundManager(initial_fund=10000.0, state_file=str(tmp_path / 'funds_state.json'), **kwargs)
+
+
+def _reserve_worker(state_file, attempts, start, results):
+    fm = SqliteFundManager(state_file=state_file, ledger=True)
+    start.wait()
+    won = 0
+    name = multiprocessing.current_process().name
+    for i in range(attempts):
+        # 予約と即時差し引きを混ぜて、どちらも同じ残高を取り合うようにする
+        take = fm.reserve if i % 2 == 0 else fm.place_order
+        if take(100, order_id=f"{name}-{i}"):
+            won += 1
+    fm.close()
+    results.put(won)
+
+
+def exercise(fm):
+    assert fm.reserve(3000, order_id='o1')
+    fm.confirm(3000, order_id='o1')
+    assert fm.place_order(2000, order_id='o2')
+    fm.release(0, order_id='o3')
+    assert fm.reserve(1000, order_id='o3')
+    fm.release(1000, order_id='o3')
+    fm.add_funds(2500, order_id='o2')
+    fm.record_realized_pnl(500, order_id='o2')
+    fm.record_realized_pnl(-200, order_id='o4')
+
+
+def test_ledger_is_off_by_default(tmp_path, monkeypatch):
+    monkeypatch.delenv('FUND_LEDGER', raising=False)
+    assert make_sqlite(tmp_path).ledger is None
+
+
+def test_ledger_matches_json_fund_manager(tmp_path):
+    sq = make_sqlite(tmp_path, ledger=True)
+    js = FundManager(initial_fund=10000.0, state_file=str(tmp_path / 'b.json'),
+                     ledger_file=str(tmp_path / 'b.ledger.jsonl'))
+    exercise(sq)
+    exercise(js)
+
+    assert sq.ledger.verify()
+    assert sq.ledger.balances() == pytest.approx(js.ledger.balances())
+    assert sq.ledger.balance(ACCOUNT_FREE) == pytest.approx(sq.available_fund())
+    assert sq.ledger.balance(ACCOUNT_RESERVED) == pytest.approx(0.0)
+    assert sq.ledger.balance(ACCOUNT_PNL) == pytest.approx(-300.0)
+    kinds = [(e['kind'], e['debit'], e['amount']) for e in sq.ledger.entries_for_order('o2')]
+    assert kinds == [(e['kind'], e['debit'], e['amount']) for e in js.ledger.entries_for_order('o2')]
+    assert len(sq.ledger) == len(js.ledger)
+    js.close()
+    sq.close()
+
+
+def test_ledger_is_shared_and_adjusted_across_instances(tmp_path):
+    first = make_sqlite(tmp_path, ledger=True)
+    second = make_sqlite(tmp_path, ledger=True)
+    assert first.place_order(4000, order_id='a')
+    assert second.reserve(1000, order_id='b')
+    assert len(first.ledger) == len(second.ledger) == 3  # 開始残高 + 2 件
+
+    # 台帳を使わないプロセスが動かした分は、次に台帳付きで開いたときに調整仕訳になる
+    make_sqlite(tmp_path, ledger=False).add_funds(700)
+    third = make_sqlite(tmp_path, ledger=True)
+    assert third.ledger.balance(ACCOUNT_FREE) == pytest.approx(third.available_fund())
+    assert third.ledger.entries_between(0, float('inf'))[-1]['kind'] == 'adjustment'
+    assert third.ledger.verify()
+
+
+def test_record_sale_uses_sqlite_ledger(tmp_path):
+    fm = make_sqlite(tmp_path, ledger=True)
+    assert fm.place_order(5000, order_id='buy-1')
+    bot._record_sale(fm, 5600, {'id': 'sell-1'}, 600)
+    entries = fm.ledger.entries_for_order('sell-1')
+    assert [e['kind'] for e in entries] == ['deposit', 'realized_pnl']
+    assert entries[0]['credit'] == ACCOUNT_EXCHANGE
+    assert fm.ledger.balance(ACCOUNT_PNL) == pytest.approx(-600.0)
+    assert fm.available_fund() == pytest.approx(10600.0)
+
+
+def test_operations_are_traced(tmp_path, monkeypatch):
+    import tracing
+    tracer = tracing.Tracer(enabled=True, slow_tick_sec=0, out_dir=str(tmp_path / 'traces'))
+    monkeypatch.setattr(tracing, '_tracer', tracer)
+    fm = make_sqlite(tmp_path)
+    with tracer.tick('tick'):
+        fm.reserve(100)
+        fm.confirm(100)
+        fm.release(0)
+        fm.place_order(100)
+        fm.add_funds(50)
+        fm.record_realized_pnl(10)
+    names = {s.name for s in tracer.spans()}
+    assert {'SqliteFundManager.reserve', 'SqliteFundManager.confirm', 'SqliteFundManager.release',
+            'SqliteFundManager.place_order', 'SqliteFundManager.add_funds',
+            'SqliteFundManager.record_realized_pnl'} <= names
+
+
+def test_concurrent_processes_never_overspend(tmp_path):
+    state_file = str(tmp_path / 'funds_state.json')
+    fm = SqliteFundManager(initial_fund=1000.0, state_file=state_file, ledger=True)
+    ctx = multiprocessing.get_context('spawn')
+    start = ctx.Event()
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_reserve_worker, args=(state_file, 5, start, results)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    start.set()
+    won = [results.get(timeout=60) for _ in procs]
+    for p in procs:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+    # 20 回の予約のうち残高で賄える 10 回だけが通る
+    assert sum(won) == 10
+    assert fm.available_fund() == pytest.approx(0.0)
+    assert fm.ledger.verify()
+    assert fm.ledger.balance(ACCOUNT_FREE) == pytest.approx(0.0)
+    assert fm.ledger.balance(ACCOUNT_RESERVED) + fm.ledger.balance(ACCOUNT_EXCHANGE) == pytest.approx(1000.0)
+    assert sum(1 for m in fm.movements() if m['kind'] in ('reserve', 'order')) == 10
+    fm.close()
+
+
+def test_balance_at_uses_running_balances(tmp_path, monkeypatch):
+    import sqlite_funds
+    now = {'t': 1000.0}
+    monkeypatch.setattr(sqlite_funds.time, 'time', lambda: now['t'])
+    fm = make_sqlite(tmp_path, ledger=True)                      # 開始残高 t=1000
+    now['t'] = 1010.0
+    assert fm.reserve(3000, order_id='a')
+    now['t'] = 1020.0
+    fm.confirm(3000, order_id='a')
+    # 時計が戻っても時刻の索引は単調（直前の仕訳の時刻に揃う）
+    now['t'] = 1005.0
+    fm.add_funds(500)
+    assert fm.ledger.balance_at(ACCOUNT_FREE, 999.0) == 0.0
+    assert fm.ledger.balance_at(ACCOUNT_FREE, 1000.0) == pytest.approx(10000.0)
+    assert fm.ledger.balance_at(ACCOUNT_FREE, 1015.0) == pytest.approx(7000.0)
+    assert fm.ledger.balance_at(ACCOUNT_RESERVED, 1015.0) == pytest.approx(3000.0)
+    assert fm.ledger.balance_at(ACCOUNT_FREE, 1019.0) == pytest.approx(7000.0)
+    # confirm で予約分は free に戻り、1005 の入金は 1020 として記録されている
+    assert fm.ledger.balance_at(ACCOUNT_FREE, 1020.0) == pytest.approx(10500.0)
+    assert fm.ledger.balance(ACCOUNT_FREE) == pytest.approx(fm.available_fund())
+    plan = fm._conn().execute('EXPLAIN QUERY PLAN SELECT balance FROM ledger_balances WHERE account = ? AND ts <= ?'
+                              ' ORDER BY ts DESC, seq DESC LIMIT 1', (ACCOUNT_FREE, 1015.0)).fetchall()
+    assert any('ledger_balances_ts' in str(row[-1]) for row in plan)
+
+
+def test_running_balances_are_backfilled_for_old_databases(tmp_path):
+    fm = make_sqlite(tmp_path, ledger=True)
+    exercise(fm)
+    expected = fm.ledger.balances()
+    fm.close()
+    # ledger_balances が無かった頃の DB を再現する
+    conn = sqlite3.connect(str(tmp_path / 'funds_state.db'))
+    conn.execute('DROP TABLE ledger_balances')
+    conn.commit()
+    conn.close()
+    reopened = make_sqlite(tmp_path, ledger=True)
+    for account, balance in expected.items():
+        assert reopened.ledger.balance(account) == pytest.approx(balance)
+    assert reopened.ledger.verify()
+    reopened.close()
@@ -0,0 +1,89 @@
+"""streaming_indicators.IndicatorEngine のテスト
+
+未確定の最新足が何度差し替えられても、最終的な足だけを流したエンジンと同じ値になることを確認します。
+"""
+
+import math
+import random
+
+import pytest
+
+from streaming_indicators import IndicatorEngine
+
+
+def make_rows(n, seed=7, start_ts=0, step=3600):
+    rng = random.Random(seed)
+    rows = []
+    price = 100.0
+    for i in range(n):
+        o = price
+        c = max(1.0, o * (1 + rng.uniform(-0.02, 0.02)))
+        h = max(o, c) * (1 + rng.uniform(0, 0.01))
+        l = min(o, c) * (1 - rng.uniform(0, 0.01))
+        rows.append([start_ts + i * step, o, h, l, c, 1.0])
+        price = c
+    return rows
+
+
+def revised(row, close):
+    return [row[0], row[1], max(row[2], close), min(row[3], close), close, row[5]]
+
+
+def assert_same_values(engine, expected):
+    got = engine.values()
+    want = expected.values()
+    assert set(got) == set(want)
+    for name, value in want.items():
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            assert got[name] == value, name
+        else:
+            assert got[name] == pytest.approx(value, rel=1e-12), name
+
+
+def test_revising_open_candle_matches_fresh_engine():
+    rows = make_rows(260)
+    engine = IndicatorEngine()
+    engine.feed(rows[:-1])
+    last = rows[-1]
+    for close in (last[4] * 1.01, last[4] * 0.97, last[4] * 1.02, last[4]):
+        engine.feed(rows[-30:-1] + [revised(last, close)])
+        assert engine.last_ts == last[0]
+
+    fresh = IndicatorEngine()
+    fresh.feed(rows)
+    assert engine.last_ts == fresh.last_ts
+    assert engine._ind['ema_12']._count == fresh._ind['ema_12']._count
+    assert_same_values(engine, fresh)
+
+
+def test_revision_then_new_candle_counts_once():
+    rows = make_rows(80)
+    engine = IndicatorEngine()
+    engine.feed(rows[:-1])
+    for factor in (1.01, 0.99, 1.03):
+        assert engine.update(revised(rows[-2], rows[-2][4] * factor)) is False
+    assert engine.update(rows[-2]) is False
+    assert engine.update(rows[-1]) is True
+
+    fresh = IndicatorEngine()
+    fresh.feed(rows)
+    assert_same_values(engine, fresh)
+
+
+def test_revision_survives_save_and_load(tmp_path):
+    rows = make_rows(120)
+    path = tmp_path / 'engine.json'
+    engine = IndicatorEngine(str(path))
+    engine.feed(rows[:-1])
+    engine.update(revised(rows[-2], rows[-2][4] * 1.05))
+    engine.save()
+
+    reloaded = IndicatorEngine(str(path))
+    reloaded.update(rows[-2])
+    reloaded.update(revised(rows[-2], rows[-2][4] * 0.95))
+    reloaded.update(rows[-2])
+    reloaded.feed(rows[-10:])
+
+    fresh = IndicatorEngine()
+    fresh.feed(rows)
+    assert_same_values(reloaded, fresh)
@@ -0,0 +1,45 @@
+"""sweep のパラメータ検証とワーカーのジャーナル後始末のテスト"""
+
+import pytest
+
+import ninibo1127 as bot
+import sweep
+
+HOUR = 60 * 60 * 1000
+
+
+def candles(n=12, start=1_700_000_000_000):
+    return [[start + i * HOUR, 100.0, 110.0, 90.0, 1000.0 - 5 * (i % 4), 1.0] for i in range(n)]
+
+
+@pytest.mark.parametrize('name', ['RSI_BUY_LEVEL', 'RSI_SELL_LEVEL', 'DYN_THRESHOLD_RATIO', 'NOT_A_PARAM'])
+def test_parameters_run_bot_ignores_are_rejected(name):
+    with pytest.raises(ValueError):
+        sweep.run_sweep(candles(), [{name: 1.0}], workers=1)
+
+
+def test_sweepable_parameters_are_read_by_run_bot():
+    import inspect
+    source = inspect.getsource(bot.run_bot)
+    for name in sweep.SWEEPABLE:
+        assert name in source
+
+
+def test_worker_does_not_keep_journals_for_temporary_dirs(monkeypatch):
+    monkeypatch.setattr(sweep, '_worker_candles', candles())
+    monkeypatch.setattr(sweep, '_worker_books', None)
+    monkeypatch.setattr(sweep, '_worker_options', {'tick_sec': 1800})
+    before = set(bot._position_journals)
+    for pct in (5, 10, 15):
+        result = sweep._run_one({'PROFIT_TAKE_PCT': pct})
+        assert 'error' not in result
+        assert result['params'] == {'PROFIT_TAKE_PCT': pct}
+    assert set(bot._position_journals) == before
+
+
+def test_run_sweep_ranks_results():
+    results = sweep.run_sweep(candles(), sweep.grid_params({'PROFIT_TAKE_PCT': [5, 10]}), tick_sec=1800, workers=1)
+    assert sorted(r['params']['PROFIT_TAKE_PCT'] for r in results) == [5, 10]
+    assert all('error' not in r for r in results)
+    assert [r['pnl'] for r in results] == sorted((r['pnl'] for r in results), reverse=True)
+    assert 'PROFIT_TAKE_PCT' in sweep.format_table(results)
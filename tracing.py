@@ -0,0 +1,261 @@
+"""tracing: ティック内の処理を区間（span）として記録し、Chrome の trace-event JSON に書き出す
+
+ティックがたまに 20 秒以上かかっても、板情報・SMTP・save_state のどれが遅かったのか
+分かりませんでした。このモジュールでは
+  - @traced('名前') を付けた関数の開始・終了時刻を上限付きのリングバッファに積む
+    （無効のときはフラグを 1 回見るだけで元の関数を呼ぶ）
+  - tracer.tick('tick') で囲んだティックが TRACE_SLOW_TICK_SEC 以上かかったら、
+    そのティックの区間だけを TRACE_DIR/trace-*.json に書き出す
+  - request_dump()（SIGUSR1 または control ファイル）で、次のティックの終わりに
+    バッファ全体を書き出す
+を行います。書き出したファイルは chrome://tracing や Perfetto、speedscope でそのまま開けます。
+  - get_tracer() -> Tracer                         # 環境変数の設定で作る共有インスタンス
+  - traced(name=None)                              # 関数用デコレーター
+  - Tracer.span(name, **args) / tick(name) / export_chrome(path, spans=None) / request_dump()
+"""
+
+from typing import Dict, List, Optional
+from collections import deque
+import functools
+import json
+import os
+import threading
+import time
+
+
+class Span:
+    __slots__ = ('name', 'start', 'end', 'tid', 'tick', 'args')
+
+    def __init__(self, name: str, start: int, tid: int, tick: int, args: Optional[dict]):
+        self.name = name
+        self.start = start
+        self.end = start
+        self.tid = tid
+        self.tick = tick
+        self.args = args
+
+    @property
+    def duration(self) -> float:
+        return (self.end - self.start) / 1e9
+
+    def __repr__(self) -> str:
+        return f"<Span {self.name} {self.duration * 1000:.2f}ms tick={self.tick}>"
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _SpanContext:
+    __slots__ = ('_tracer', '_span')
+
+    def __init__(self, tracer: 'Tracer', span: Span):
+        self._tracer = tracer
+        self._span = span
+
+    def __enter__(self):
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self._span
+        span.end = time.perf_counter_ns()
+        if exc_type is not None:
+            span.args = dict(span.args or {}, error=exc_type.__name__)
+        self._tracer._buffer.append(span)
+        return False
+
+
+class _TickContext:
+    __slots__ = ('_tracer', '_name', '_span', '_previous')
+
+    def __init__(self, tracer: 'Tracer', name: str):
+        self._tracer = tracer
+        self._name = name
+
+    def __enter__(self):
+        tracer = self._tracer
+        with tracer._lock:
+            tracer._tick_seq += 1
+            tick = tracer._tick_seq
+        self._previous = getattr(tracer._local, 'tick', 0)
+        tracer._local.tick = tick
+        self._span = Span(self._name, time.perf_counter_ns(), threading.get_ident(), tick, None)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        tracer = self._tracer
+        span = self._span
+        span.end = time.perf_counter_ns()
+        if exc_type is not None:
+            span.args = {'error': exc_type.__name__}
+        tracer._buffer.append(span)
+        tracer._local.tick = self._previous
+        tracer._after_tick(span)
+        return False
+
+
+class Tracer:
+    """区間をリングバッファに記録し、遅いティックや要求に応じて書き出すクラス。"""
+
+    def __init__(self, enabled: bool = True, capacity: int = 4096, slow_tick_sec: float = 10.0,
+                 out_dir: str = 'logs/traces', control_file: Optional[str] = None):
+        """
+        Args:
+            capacity: 保持する区間の上限（古いものから捨てる）
+            slow_tick_sec: ティックがこの秒数以上かかったら自動で書き出す（0 なら書き出さない）
+            control_file: このファイルが現れたら書き出して削除する（SIGUSR1 が使えない環境用）
+        """
+        self.enabled = bool(enabled)
+        self.slow_tick_sec = float(slow_tick_sec)
+        self.out_dir = out_dir
+        self.control_file = control_file
+        self._buffer: deque = deque(maxlen=max(16, int(capacity)))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._tick_seq = 0
+        self._dump_requested = False
+        self._epoch_ns = time.time_ns() - time.perf_counter_ns()
+        self.exported: List[str] = []
+
+    # --- 記録 ---
+    def span(self, name: str, **args):
+        if not self.enabled:
+            return _NOOP
+        return _SpanContext(self, Span(name, time.perf_counter_ns(), threading.get_ident(),
+                                       getattr(self._local, 'tick', 0), args or None))
+
+    def tick(self, name: str = 'tick'):
+        if not self.enabled:
+            return _NOOP
+        return _TickContext(self, name)
+
+    def spans(self, tick: Optional[int] = None) -> List[Span]:
+        items = list(self._buffer)
+        if tick is None:
+            return items
+        return [s for s in items if s.tick == tick]
+
+    def clear(self) -> None:
+        self._buffer.clear()
+
+    # --- 書き出し ---
+    def request_dump(self) -> None:
+        """次のティックの終わりにバッファ全体を書き出す（シグナルハンドラーから呼んでよい）。"""
+        self._dump_requested = True
+
+    def install_signal(self) -> bool:
+        """SIGUSR1 で request_dump() するようにする（メインスレッドかつ POSIX のみ）。"""
+        try:
+            import signal
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.request_dump())
+            return True
+        except (AttributeError, ValueError, OSError):
+            return False
+
+    def _after_tick(self, root: Span) -> None:
+        try:
+            if self.control_file and os.path.exists(self.control_file):
+                self._dump_requested = True
+                try:
+                    os.remove(self.control_file)
+                except OSError:
+                    pass
+            if self._dump_requested:
+                self._dump_requested = False
+                path = self.export_chrome(self._new_path('dump'))
+                print(f"🧵 トレースを書き出しました: {path}")
+            elif self.slow_tick_sec > 0 and root.duration >= self.slow_tick_sec:
+                path = self.export_chrome(self._new_path(root.name), self.spans(root.tick))
+                print(f"🐢 {root.name} に {root.duration:.1f}秒かかったためトレースを書き出しました: {path}")
+        except Exception as e:
+            print(f"⚠️ トレース書き出しエラー: {e}")
+
+    def _new_path(self, label: str) -> str:
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        return os.path.join(self.out_dir, f"trace-{stamp}-{label}-{self._tick_seq}.json")
+
+    def to_chrome(self, spans: Optional[List[Span]] = None) -> Dict:
+        """区間を trace-event 形式（'X' 完了イベント、時刻はマイクロ秒）の辞書にする。"""
+        spans = self.spans() if spans is None else spans
+        pid = os.getpid()
+        events = []
+        for s in sorted(spans, key=lambda s: (s.start, -s.end)):
+            event = {
+                'name': s.name,
+                'cat': 'bot',
+                'ph': 'X',
+                'ts': (s.start + self._epoch_ns) / 1000.0,
+                'dur': (s.end - s.start) / 1000.0,
+                'pid': pid,
+                'tid': s.tid,
+                'args': dict(s.args or {}, tick=s.tick),
+            }
+            events.append(event)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome(self, path: str, spans: Optional[List[Span]] = None) -> str:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(self.to_chrome(spans), fh, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+        self.exported.append(path)
+        return path
+
+    def __repr__(self) -> str:
+        return f"<Tracer enabled={self.enabled} spans={len(self._buffer)} ticks={self._tick_seq}>"
+
+
+def _from_env() -> Tracer:
+    log_dir = os.getenv('LOG_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'))
+    try:
+        capacity = int(os.getenv('TRACE_BUFFER', '4096'))
+        slow = float(os.getenv('TRACE_SLOW_TICK_SEC', '10'))
+    except ValueError:
+        capacity, slow = 4096, 10.0
+    return Tracer(
+        enabled=str(os.getenv('TRACING', '1')).lower() in ('1', 'true', 'yes', 'on'),
+        capacity=capacity,
+        slow_tick_sec=slow,
+        out_dir=os.getenv('TRACE_DIR', os.path.join(log_dir, 'traces')),
+        control_file=os.getenv('TRACE_CONTROL_FILE') or None,
+    )
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """TRACING / TRACE_* 環境変数から共有の Tracer を作る。"""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = _from_env()
+    return _tracer
+
+
+def traced(name: Optional[str] = None):
+    """関数の実行を区間として記録するデコレーター（Tracer が無効なら素通し）。"""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer if _tracer is not None else get_tracer()
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,78 @@
+"""TriggerIndex: 保有ポジションの利確・ナンピン水準を整列して持ち、価格の通過を O(log n) で調べる
+
+5 分ごとのティックの合間に ticker だけを見て、どこかの水準を価格が通過したときだけ
+`run_bot` の判定を実行するための索引です。
+  - 利確水準（価格がこれ以上になったら発火）と、ナンピン水準（これ以下になったら発火）を
+    それぞれ昇順の配列で持つ
+  - crossed(price) は前回の価格から今回の価格までの間にある水準だけを二分探索で返す。
+    水準の上に居続けても再発火しない（一度戻ってから再び越えたら発火する）
+  - rebuild(positions, ...) でポジションが変わったときに作り直す
+"""
+
+from typing import List, Optional, Tuple
+import bisect
+
+
+TAKE_PROFIT = 'take_profit'
+NAMPIN = 'nampin'
+
+
+class TriggerIndex:
+    """利確（上向き）とナンピン（下向き）の発火水準の索引。"""
+
+    def __init__(self):
+        self._up: List[float] = []
+        self._up_ids: List[str] = []
+        self._down: List[float] = []
+        self._down_ids: List[str] = []
+        self.version = None
+        self.last_price: Optional[float] = None
+
+    def rebuild(self, positions: List[dict], profit_take_pct: float, nampin_interval: float, max_nampin: int,
+                custom_take_profit: Optional[float] = None, version=None) -> None:
+        """run_bot と同じ式で各ポジションの水準を計算して並べ直す。"""
+        up: List[Tuple[float, str]] = []
+        down: List[Tuple[float, str]] = []
+        for i, pos in enumerate(positions):
+            pos_id = str(pos.get('id', i))
+            buy_price = float(pos['price'])
+            up.append((custom_take_profit if custom_take_profit else buy_price * (1 + profit_take_pct / 100.0), pos_id))
+            nampin_count = int(pos.get('nampin_count', 0))
+            if nampin_count < max_nampin:
+                down.append((buy_price * (1 - nampin_interval * (nampin_count + 1)), pos_id))
+        up.sort()
+        down.sort()
+        self._up = [p for p, _ in up]
+        self._up_ids = [i for _, i in up]
+        self._down = [p for p, _ in down]
+        self._down_ids = [i for _, i in down]
+        self.version = version
+
+    def crossed(self, price: float) -> List[Tuple[str, str, float]]:
+        """前回の価格から price までに通過した水準を (種類, ポジション id, 水準) で返す。"""
+        price = float(price)
+        last = self.last_price
+        self.last_price = price
+        hits = []
+        # 利確: last < level <= price（初回は price 以下の水準すべて）
+        hi = bisect.bisect_right(self._up, price)
+        lo = 0 if last is None else bisect.bisect_right(self._up, last)
+        for k in range(lo, hi):
+            hits.append((TAKE_PROFIT, self._up_ids[k], self._up[k]))
+        # ナンピン: price <= level < last（初回は price 以上の水準すべて）
+        lo = bisect.bisect_left(self._down, price)
+        hi = len(self._down) if last is None else bisect.bisect_left(self._down, last)
+        for k in range(lo, hi):
+            hits.append((NAMPIN, self._down_ids[k], self._down[k]))
+        return hits
+
+    def nearest(self) -> Tuple[Optional[float], Optional[float]]:
+        """(最も低い利確水準, 最も高いナンピン水準)。"""
+        return (self._up[0] if self._up else None, self._down[-1] if self._down else None)
+
+    def __len__(self) -> int:
+        return len(self._up) + len(self._down)
+
+    def __repr__(self) -> str:
+        up, down = self.nearest()
+        return f"<TriggerIndex levels={len(self)} take_profit>={up} nampin<={down} last={self.last_price}>"
@@ -0,0 +1,127 @@
+"""NumPy によるバッチ指標計算（全履歴を 1 パスで系列として計算）
+
+`ninibo1127.py` のスカラー関数は「末尾の値」だけを返すため、研究用に全期間の系列が
+必要な場合は 1 本ずつ呼び出すことになり、長期の 1 分足では非常に遅くなります。
+このモジュールは各時点 i について、スカラー関数に values[:i+1] を渡したときと
+同じ値（浮動小数の丸め誤差の範囲で一致）を配列で返します。データ不足の位置は NaN。
+提供する関数:
+  - sma_series(closes, period)                 # compute_sma_from_list と同じ定義
+  - ema_series(closes, period)                 # compute_ema と同じ定義
+  - rsi_series(closes, period=14)              # compute_rsi（単純平均 RSI）と同じ定義
+  - atr_series(high, low, close, period=14)    # compute_atr（TR の単純平均）と同じ定義
+  - recent_high_series(high, period=20)        # compute_indicators の recent_high_20 と同じ定義
+  - compute_all(ohlcv) -> dict                 # compute_indicators と同じキーの系列一式
+"""
+
+from typing import Dict
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _as_array(values) -> np.ndarray:
+    return np.asarray(values, dtype=np.float64)
+
+
+def as_ohlcv_array(ohlcv) -> np.ndarray:
+    """[[ts, o, h, l, c, v], ...]・(N, 6) 配列・DataFrame を (N, 6) の float64 配列に揃える。"""
+    if hasattr(ohlcv, 'columns'):
+        cols = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+        return ohlcv[cols].to_numpy(dtype=np.float64)
+    arr = np.asarray(ohlcv, dtype=np.float64)
+    if arr.ndim != 2 or arr.shape[1] < 6:
+        raise ValueError(f"OHLCV array must have shape (N, 6), got {arr.shape}")
+    return arr[:, :6]
+
+
+def _rolling_mean(x: np.ndarray, period: int, offset: int = 0) -> np.ndarray:
+    """x の末尾 period 個の平均を、元の系列で offset だけずらした位置に置いた系列。"""
+    out = np.full(len(x) + offset, np.nan)
+    if period <= 0 or len(x) < period:
+        return out
+    out[offset + period - 1:] = sliding_window_view(x, period).mean(axis=1)
+    return out
+
+
+def sma_series(closes, period: int) -> np.ndarray:
+    return _rolling_mean(_as_array(closes), int(period))
+
+
+def ema_series(closes, period: int) -> np.ndarray:
+    # compute_ema は直近 period 本の SMA を初期値とし、その窓の 2 本目以降で EMA を回す。
+    # つまり窓に対する固定の線形結合なので、重みベクトルとの内積で一度に計算できる。
+    x = _as_array(closes)
+    p = int(period)
+    out = np.full(len(x), np.nan)
+    if p <= 0 or len(x) < p:
+        return out
+    k = 2.0 / (p + 1)
+    j = np.arange(p)
+    weights = np.full(p, (1 - k) ** (p - 1) / p)
+    weights[1:] += k * (1 - k) ** (p - 1 - j[1:])
+    out[p - 1:] = sliding_window_view(x, p) @ weights
+    return out
+
+
+def rsi_series(closes, period: int = 14) -> np.ndarray:
+    x = _as_array(closes)
+    p = int(period)
+    out = np.full(len(x), np.nan)
+    if p <= 0 or len(x) < p + 1:
+        return out
+    delta = np.diff(x)
+    gains = np.where(delta > 0, delta, 0.0)
+    losses = np.where(delta < 0, -delta, 0.0)
+    avg_gain = sliding_window_view(gains, p).sum(axis=1) / p
+    avg_loss = sliding_window_view(losses, p).sum(axis=1) / p
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100 - (100 / (1 + avg_gain / avg_loss))
+    rsi[avg_loss == 0] = 100.0
+    out[p:] = rsi
+    return out
+
+
+def atr_series(high, low, close, period: int = 14) -> np.ndarray:
+    h = _as_array(high)
+    l = _as_array(low)
+    c = _as_array(close)
+    p = int(period)
+    out = np.full(len(c), np.nan)
+    if p <= 0 or len(c) < p + 1:
+        return out
+    prev_close = c[:-1]
+    tr = np.maximum.reduce([h[1:] - l[1:], np.abs(h[1:] - prev_close), np.abs(l[1:] - prev_close)])
+    out[p:] = sliding_window_view(tr, p).sum(axis=1) / p
+    return out
+
+
+def recent_high_series(high, period: int = 20) -> np.ndarray:
+    # 先頭の period 本未満の区間は取得できた分だけの最大値（highs[-20:] と同じ）
+    h = _as_array(high)
+    p = int(period)
+    out = np.full(len(h), np.nan)
+    if len(h) == 0 or p <= 0:
+        return out
+    head = min(p - 1, len(h))
+    out[:head] = np.maximum.accumulate(h[:head])
+    if len(h) >= p:
+        out[p - 1:] = sliding_window_view(h, p).max(axis=1)
+    return out
+
+
+def compute_all(ohlcv) -> Dict[str, np.ndarray]:
+    """compute_indicators と同じキーで、全時点の指標系列を返す。"""
+    arr = as_ohlcv_array(ohlcv)
+    high = arr[:, 2]
+    low = arr[:, 3]
+    close = arr[:, 4]
+    return {
+        'timestamp': arr[:, 0].astype(np.int64),
+        'latest_close': close.copy(),
+        'sma_short_50': sma_series(close, 50),
+        'sma_long_200': sma_series(close, 200),
+        'ema_12': ema_series(close, 12),
+        'ema_26': ema_series(close, 26),
+        'atr_14': atr_series(high, low, close, 14),
+        'rsi_14': rsi_series(close, 14),
+        'recent_high_20': recent_high_series(high, 20),
+    }